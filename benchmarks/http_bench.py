@@ -0,0 +1,402 @@
+"""
+HTTP benchmark of the API routes, run in-process against a seeded database.
+
+The application is served through httpx's ASGI transport, so the numbers measure the app itself
+(routing, validation, database, caches) without a network or server in between. Redis is replaced
+by fakeredis, emails stay in its job queue and avatars are stored in the temporary directory,
+so a run needs no network at all.
+
+    python -m benchmarks.http_bench run --concurrency 8 --requests 300 --out benchmarks/results/base.json
+    python -m benchmarks.http_bench run --database-url postgresql+psycopg2://... --env SQLALCHEMY_ASYNC=1
+    python -m benchmarks.http_bench compare benchmarks/results/base.json benchmarks/results/new.json
+
+Without --database-url a fresh SQLite file in a temporary directory is used. A database given with
+--database-url is reset: its tables are dropped and seeded again.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from itertools import count
+from functools import lru_cache
+from typing import Callable
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench123"
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    # Builds the keyword arguments of the request number i
+    build: Callable[[int, dict], dict]
+    # Share of --requests this scenario runs, slow routes such as bcrypt logins run fewer
+    share: float = 1.0
+    # Caps --concurrency for routes whose requests depend on each other
+    concurrency: int | None = None
+    # Called with every response and the context, e.g. to keep a rotated token
+    after: Callable[[object, dict], None] | None = None
+
+
+def _keep_tokens(response, ctx: dict):
+    if response.status_code == 200:
+        ctx.update(response.json())
+
+
+# Phone prefixes keep the contacts written by each scenario apart from the seeded ones
+PHONE_PREFIXES = {"Import": 70, "Create": 71, "Update": 72}
+
+
+def _contact(i: int, prefix: str) -> dict:
+    return {"name": f"{prefix}{i:06}", "sure_name": "Benchmark", "email": f"{prefix.lower()}{i}@bench.example.com",
+            "phone_number": f"+38{PHONE_PREFIXES[prefix]}{i:08}", "birthday": "1990-06-15",
+            "additional_data": "created by the benchmark"}
+
+
+@lru_cache(maxsize=None)
+def _photo() -> bytes:
+    """
+    The _photo function returns a JPEG the size of a phone picture for the avatar scenarios.
+
+    :return: The JPEG file
+    """
+    from PIL import Image
+
+    image = Image.merge("RGB", [Image.radial_gradient("L"), Image.linear_gradient("L"),
+                                Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100)])
+    out = io.BytesIO()
+    image.resize((3000, 2000)).save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def scenarios(contacts: int) -> list[Scenario]:
+    """
+    The scenarios function lists the routes a run drives, in the order they run.
+    Writes run after the reads, and deletes remove the contacts created before.
+
+    :param contacts: int: Number of seeded contacts
+    :return: The list of scenarios
+    """
+    auth = lambda ctx: {"Authorization": f"Bearer {ctx['access_token']}"}  # noqa: E731
+    contact_id = lambda i: i * 7919 % contacts + 1  # noqa: E731
+    ndjson = "\n".join(json.dumps(_contact(i, "Import")) for i in range(100))
+    return [
+        Scenario("root", "GET", lambda i, ctx: {"url": "/"}),
+        Scenario("healthchecker", "GET", lambda i, ctx: {"url": "/api/healthchecker"}),
+        Scenario("contacts_list", "GET", lambda i, ctx: {"url": "/api/users/", "params": {"limit": 20},
+                                                         "headers": auth(ctx)}),
+        Scenario("contacts_list_pages", "GET",
+                 lambda i, ctx: {"url": "/api/users/", "params": {"limit": 20, "offset": i * 20 % contacts},
+                                 "headers": auth(ctx)}),
+        # Pages of the maximum size, mostly cache misses, where rendering the rows dominates
+        Scenario("contacts_list_large", "GET",
+                 lambda i, ctx: {"url": "/api/users/", "params": {"limit": 300, "offset": i * 300 % contacts},
+                                 "headers": auth(ctx)}),
+        Scenario("contact_get", "GET", lambda i, ctx: {"url": f"/api/users/{contact_id(i)}", "headers": auth(ctx)}),
+        Scenario("contacts_search", "GET",
+                 lambda i, ctx: {"url": "/api/users/search", "params": {"q": f"{i % 100:02}1"},
+                                 "headers": auth(ctx)}),
+        Scenario("contacts_birthdays", "GET",
+                 lambda i, ctx: {"url": "/api/users/birthdays", "params": {"days": 30}, "headers": auth(ctx)}),
+        Scenario("users_me", "GET", lambda i, ctx: {"url": "/api/users_prof/me/", "headers": auth(ctx)}),
+        Scenario("contacts_export", "GET", lambda i, ctx: {"url": "/api/users/export", "headers": auth(ctx)},
+                 share=0.05),
+        # Every refresh rotates the refresh token and reusing an old one revokes it, so refreshes run one by one
+        Scenario("refresh_token", "GET",
+                 lambda i, ctx: {"url": "/api/auth/refresh_token",
+                                 "headers": {"Authorization": f"Bearer {ctx['refresh_token']}"}},
+                 share=0.1, concurrency=1, after=_keep_tokens),
+        Scenario("login", "POST",
+                 lambda i, ctx: {"url": "/api/auth/login",
+                                 "data": {"username": BENCH_EMAIL, "password": BENCH_PASSWORD}},
+                 share=0.1),
+        Scenario("signup", "POST",
+                 lambda i, ctx: {"url": "/api/auth/signup",
+                                 "json": {"username": f"user{i}", "email": f"user{i}@bench.example.com",
+                                          "password": BENCH_PASSWORD}},
+                 share=0.1),
+        Scenario("contact_create", "POST",
+                 lambda i, ctx: {"url": "/api/users/", "json": _contact(i, "Create"), "headers": auth(ctx)}),
+        Scenario("contact_update", "PUT",
+                 lambda i, ctx: {"url": f"/api/users/{contact_id(i)}",
+                                 "json": {**_contact(contact_id(i), "Update"), "additional_data": f"update {i}"},
+                                 "headers": auth(ctx)}),
+        Scenario("contacts_import", "POST",
+                 lambda i, ctx: {"url": "/api/users/import", "content": ndjson,
+                                 "headers": {**auth(ctx), "Content-Type": "application/x-ndjson"}},
+                 share=0.1),
+        # Bytes after the end of the JPEG make every upload a new file to process, the picture stays the same
+        Scenario("avatar_upload", "PATCH", lambda i, ctx: {"url": "/api/users_prof/avatar", "headers": auth(ctx),
+                                                           "files": {"avatar": ("me.jpg", _photo() + str(i).encode(),
+                                                                                "image/jpeg")}}, share=0.2),
+        Scenario("avatar_repeat", "PATCH", lambda i, ctx: {"url": "/api/users_prof/avatar", "headers": auth(ctx),
+                                                           "files": {"avatar": ("me.jpg", _photo(), "image/jpeg")}},
+                 share=0.2),
+        Scenario("contact_delete", "DELETE",
+                 lambda i, ctx: {"url": f"/api/users/{contacts + 1 + i}", "headers": auth(ctx)}),
+    ]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    The percentile function returns the nearest-rank percentile of a list of numbers.
+
+    :param values: list[float]: The samples, in any order
+    :param p: float: The percentile, between 0 and 100
+    :return: The percentile, or 0.0 for no samples
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(latencies: list[float], statuses: dict, elapsed: float) -> dict:
+    """
+    The summarize function turns the samples of one scenario into the figures stored in the results file.
+
+    :param latencies: list[float]: Latency of every request in seconds
+    :param statuses: dict: Number of responses per status code
+    :param elapsed: float: Wall time of the scenario in seconds
+    :return: A dict with throughput and latency percentiles in milliseconds
+    """
+    errors = sum(n for status, n in statuses.items() if int(status) >= 400)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+def compare(base: dict, new: dict, threshold: float) -> tuple[list[dict], bool]:
+    """
+    The compare function lines up two result files scenario by scenario. A scenario regressed if
+    its throughput dropped or its p95 latency grew by more than threshold, or if it has new errors.
+
+    :param base: dict: Results of the reference run
+    :param new: dict: Results of the run to check
+    :param threshold: float: Tolerated relative change, e.g. 0.1 for 10%
+    :return: One row per scenario present in both runs, and whether any of them regressed
+    """
+    rows, regressed = [], False
+    for name, after in new["results"].items():
+        before = base["results"].get(name)
+        if before is None:
+            continue
+        throughput = after["throughput_rps"] / before["throughput_rps"] - 1 if before["throughput_rps"] else 0.0
+        p95 = after["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        reasons = []
+        if throughput < -threshold:
+            reasons.append("throughput")
+        if p95 > threshold:
+            reasons.append("p95")
+        if after["errors"] > before["errors"]:
+            reasons.append("errors")
+        regressed = regressed or bool(reasons)
+        rows.append({"scenario": name, "throughput_change": throughput, "p95_change": p95,
+                     "before": before, "after": after, "regressions": reasons})
+    return rows, regressed
+
+
+async def _drive(client, scenario: Scenario, requests: int, concurrency: int, warmup: int, ctx: dict) -> dict:
+    numbers = count()
+    latencies, statuses = [], {}
+
+    async def send(i: int):
+        response = await client.request(scenario.method, **scenario.build(i, ctx))
+        if scenario.after is not None:
+            scenario.after(response, ctx)
+        return response
+
+    for _ in range(min(warmup, requests)):
+        await send(next(numbers))
+
+    async def worker():
+        while True:
+            i = next(numbers)
+            if i >= requests + warmup:
+                return
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, scenario.concurrency or concurrency))))
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def _seed(database_url: str, contacts: int):
+    from sqlalchemy import create_engine, insert
+
+    from src.database import maintenance
+    from src.database.models import Base, Contact, User, birthday_key
+    from src.services.auth import auth_service
+
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine)
+    today = date.today()
+    rows = []
+    for i in range(contacts):
+        birthday = (today + timedelta(days=i % 365)).replace(year=1980 + i % 30)
+        # The benchmark user is the first user, the owner of every seeded contact
+        rows.append({"owner_id": 1, "name": f"Name{i:06}", "sure_name": f"Sure{i % 997:03}",
+                     "email": f"contact{i}@bench.example.com", "phone_number": f"+380{i:09}",
+                     "birthday": birthday.isoformat(), "birthday_date": birthday,
+                     "birthday_key": birthday_key(birthday), "additional_data": f"note {i} " + "x" * 40})
+    with engine.begin() as connection:
+        maintenance.run(connection)
+        connection.execute(insert(User.__table__), [{
+            "id": 1, "username": "bench", "email": BENCH_EMAIL, "confirmed": True,
+            "avatar": "https://example.com/avatar.png", "password": auth_service.pwd_context.hash(BENCH_PASSWORD)}])
+        for start in range(0, len(rows), 1000):
+            connection.execute(insert(Contact.__table__), rows[start:start + 1000])
+    engine.dispose()
+
+
+async def _run(args) -> dict:
+    import fakeredis
+    from httpx import ASGITransport, AsyncClient
+
+    from main import app
+    from src.database import conn_to_db
+    from src.services import redis_pool
+
+    # Statement logging would dominate the timings
+    conn_to_db.engine.echo = False
+    redis_pool._client = fakeredis.aioredis.FakeRedis()
+    if not args.rate_limit:
+        for route in app.routes:
+            for dependency in getattr(route, "dependencies", []):
+                app.dependency_overrides[dependency.dependency] = lambda: None
+
+    results = {}
+    selected = set(args.scenario or [])
+    await app.router.startup()
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app, raise_app_exceptions=False),
+                               base_url="http://bench") as client:
+            login = await client.post("/api/auth/login", data={"username": BENCH_EMAIL, "password": BENCH_PASSWORD})
+            login.raise_for_status()
+            ctx = login.json()
+            for scenario in scenarios(args.contacts):
+                if selected and scenario.name not in selected:
+                    continue
+                requests = max(1, round(args.requests * scenario.share))
+                results[scenario.name] = await _drive(client, scenario, requests, args.concurrency,
+                                                      round(args.warmup * scenario.share), ctx)
+                print(_format_result(scenario.name, results[scenario.name]), flush=True)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def _format_result(name: str, result: dict) -> str:
+    return (f"{name:22} {result['requests']:6} req {result['throughput_rps']:9.1f} req/s  "
+            f"p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms"
+            f"{'  errors ' + str(result['statuses']) if result['errors'] else ''}")
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="http-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env = dict(item.split("=", 1) for item in args.env)
+    # Settings are read when the application is imported, so the environment is set first
+    os.environ.update({"AVATAR_DIR": os.path.join(workdir, "avatars"), **env}, SQLALCHEMY_DATABASE_URL=database_url)
+    _seed(database_url, args.contacts)
+    results = asyncio.run(_run(args))
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": database_url.split(":", 1)[0],
+            "env": env,
+            "contacts": args.contacts,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "rate_limit": args.rate_limit,
+        },
+        "results": results,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+
+def run_compare(args) -> int:
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows, regressed = compare(base, new, args.threshold)
+    print(f"{'scenario':22} {'req/s before':>12} {'after':>9} {'change':>8}   "
+          f"{'p95 before':>10} {'after':>9} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION: " + ", ".join(row["regressions"]) if row["regressions"] else ""
+        print(f"{row['scenario']:22} {row['before']['throughput_rps']:12.1f} {row['after']['throughput_rps']:9.1f} "
+              f"{row['throughput_change']:+8.1%}   {row['before']['p95_ms']:10.2f} {row['after']['p95_ms']:9.2f} "
+              f"{row['p95_change']:+8.1%}{flag}")
+    return 1 if regressed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark the routes and write the results")
+    run_parser.add_argument("--database-url", help="database to reset and seed, a temporary SQLite file by default")
+    run_parser.add_argument("--contacts", type=int, default=5000, help="number of seeded contacts")
+    run_parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at a time")
+    run_parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each scenario")
+    run_parser.add_argument("--scenario", action="append", help="run only this scenario, may be repeated")
+    run_parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                            help="setting for the application, e.g. RESPONSE_CACHE_SIZE=0, may be repeated")
+    run_parser.add_argument("--rate-limit", action="store_true", help="keep the route rate limits")
+    run_parser.add_argument("--out", help="path of the JSON results file")
+
+    compare_parser = commands.add_parser("compare", help="compare two results files, exit 1 on a regression")
+    compare_parser.add_argument("base", help="results of the reference run")
+    compare_parser.add_argument("new", help="results of the run to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="tolerated relative change of throughput and p95, default 0.1")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return run_compare(args)
+    run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,65 @@
+import logging
+
 from fastapi import FastAPI, Depends, HTTPException
+from fastapi.staticfiles import StaticFiles
+from prometheus_client import REGISTRY
 from sqlalchemy import text
-from sqlalchemy.orm import Session
 
-import redis.asyncio as redis
-from src.database.conn_to_db import get_db
-from src.routes import contacts, auth, users
-from fastapi_limiter import FastAPILimiter
 from src.conf.config import settings
+from src.database.conn_to_db import (DBSession, engine, get_db, maybe_await, read_replicas, replica_engines,
+                                     warm_up_pool)
+from src.database.replicas import ReadYourWritesMiddleware
+from src.routes import contacts, auth, users, ops
+from src.services.avatars import avatar_processor
+from src.services.cache import token_cache, user_cache
+from src.services.compression import CompressionMiddleware
+from src.services.hashing import password_hasher
+from src.services.metrics import MetricsMiddleware, StatsCollector, metrics_response
+from src.services.profiling import sql_profiler
+from src.services.rate_limit import rate_limiter
+from src.services.redis_pool import close_redis
+from src.services.response_cache import response_cache
 from starlette.middleware.cors import CORSMiddleware
 
 app = FastAPI()
 
+REGISTRY.register(StatsCollector(
+    caches={
+        "user_local": lambda: user_cache.stats()["local"],
+        "user_redis": lambda: {"hits": user_cache.redis_hits, "misses": user_cache.redis_misses},
+        "token": token_cache.stats,
+        "response": lambda: response_cache.stats()["local"],
+    },
+    pools={"password_hash": password_hasher.stats, "avatar": avatar_processor.stats},
+    # The engine replaces its pool on dispose(), so it is looked up at scrape time
+    db_pools={"primary": lambda: engine.pool.stats(),
+              **{f"replica{i}": lambda replica=replica: replica.pool.stats()
+                 for i, replica in enumerate(replica_engines)}},
+))
+
 
 @app.on_event("startup")
 async def startup():
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
-    await FastAPILimiter.init(r)
+    user_cache.listen()
+    response_cache.listen()
+    sql_profiler.listen()
+    rate_limiter.start()
+    if settings.db_pool_warm_up:
+        try:
+            await warm_up_pool()
+        except Exception:
+            logging.exception("Connection pool warm-up failed")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await user_cache.stop()
+    await response_cache.stop()
+    await sql_profiler.stop()
+    await rate_limiter.stop()
+    await close_redis()
+    password_hasher.shutdown()
+    avatar_processor.shutdown()
 
 
 app.add_middleware(
@@ -24,7 +68,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+if read_replicas:
+    app.add_middleware(ReadYourWritesMiddleware, seconds=settings.replica_sticky_seconds)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size,
+                   content_types=settings.compression_content_types,
+                   levels={"gzip": settings.compression_gzip_level, "br": settings.compression_brotli_quality})
+# Added last so it is the outermost middleware and times everything below it
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
@@ -33,17 +85,31 @@ async def root():
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: DBSession = Depends(get_db)):
     try:
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await maybe_await(db.execute(text("SELECT 1")))).fetchone()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to FastAPI!"}
-    except Exception as e:
-        print(e)
+    except Exception:
+        logging.exception("Health check failed")
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    The metrics function exposes the metrics of this worker in the Prometheus text format.
+
+    :return: The current value of every metric
+    """
+    return metrics_response()
+
+
 app.include_router(contacts.router, prefix="/api")
 app.include_router(auth.router, prefix="/api")
-app.include_router(users.router, prefix='/api')
\ No newline at end of file
+app.include_router(users.router, prefix='/api')
+app.include_router(ops.router, prefix='/api')
+if settings.avatar_storage == "local":
+    # The avatar files never change, see src.services.storage.LocalStorage
+    app.mount(settings.avatar_url, StaticFiles(directory=settings.avatar_dir, check_dir=False), name="avatars")
\ No newline at end of file
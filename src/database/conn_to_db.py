@@ -1,19 +1,111 @@
+import inspect
+from typing import Union
+
+from fastapi import Depends, Request
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 
 from src.conf.config import settings
+from src.database.pool import TimedAsyncAdaptedQueuePool, TimedQueuePool
+from src.database.replicas import ReplicaSet, is_sticky
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True, max_overflow=5)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+DBSession = Union[Session, AsyncSession]
+
+
+def to_async_url(url: str) -> str:
+    """
+    The to_async_url function swaps the sync DBAPI driver of a database url for its asyncio counterpart.
+    Urls that already name an async driver are returned unchanged.
+
+    :param url: str: The database url from the settings
+    :return: The same url with an asyncio driver
+    """
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+POOL_OPTIONS = {
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+    "pool_timeout": settings.db_pool_timeout,
+    "pool_recycle": settings.db_pool_recycle,
+    # Replaces connections the server closed, e.g. after a PostgreSQL restart, before they reach a request
+    "pool_pre_ping": settings.db_pool_pre_ping,
+}
+
+if settings.sqlalchemy_async:
+    async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), echo=settings.sqlalchemy_echo,
+                                       poolclass=TimedAsyncAdaptedQueuePool, **POOL_OPTIONS)
+    engine = async_engine.sync_engine
+    SessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    async_replica_engines = [create_async_engine(to_async_url(url), echo=settings.sqlalchemy_echo,
+                                                 poolclass=TimedAsyncAdaptedQueuePool, **POOL_OPTIONS)
+                             for url in settings.sqlalchemy_replica_urls]
+    replica_engines = [replica.sync_engine for replica in async_replica_engines]
+    replica_sessions = [async_sessionmaker(replica, autoflush=False, expire_on_commit=False)
+                        for replica in async_replica_engines]
+else:
+    async_engine = None
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=settings.sqlalchemy_echo, poolclass=TimedQueuePool,
+                           **POOL_OPTIONS)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    replica_engines = [create_engine(url, echo=settings.sqlalchemy_echo, poolclass=TimedQueuePool, **POOL_OPTIONS)
+                       for url in settings.sqlalchemy_replica_urls]
+    replica_sessions = [sessionmaker(autocommit=False, autoflush=False, bind=replica) for replica in replica_engines]
+
+read_replicas = ReplicaSet(replica_sessions, retry_after=settings.replica_retry_seconds)
+
+
+async def warm_up_pool(size: int = settings.db_pool_size):
+    """
+    The warm_up_pool function opens size connections and returns them to the pool,
+    so the first requests after a start do not pay for connecting to the database.
+
+    :param size: int: The number of connections to open, the pool_size by default
+    :return: None
+    """
+    if async_engine is not None:
+        connections = [await async_engine.connect() for _ in range(size)]
+        for connection in connections:
+            await connection.close()
+    else:
+        connections = [engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.close()
+
+
+async def maybe_await(result):
+    """
+    The maybe_await function lets the repositories run unchanged on both a Session and an AsyncSession.
+    Methods such as execute, commit or refresh return a coroutine on an AsyncSession and a plain value on a Session.
+
+    :param result: The value returned by a session method
+    :return: The awaited value for coroutines, otherwise the value itself
+    """
+    if inspect.isawaitable(result):
+        return await result
+    return result
 
 
 # Dependency
-def get_db():
+async def get_db():
     """
     The get_db function is a context manager that returns the database session.
     It also ensures that the connection to the database is closed after each request.
+    Depending on settings.sqlalchemy_async the session is a Session or an AsyncSession.
 
     :return: A database sessionlocal object, which is a local thread-safe instance of sqlalchemy’s session
     """
@@ -21,4 +113,31 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
+        await maybe_await(db.close())
+
+
+async def get_read_db(request: Request, primary: DBSession = Depends(get_db)):
+    """
+    The get_read_db function is the session dependency of read-only routes. It returns a session on a read replica,
+    or the primary session when no replica is configured or healthy, and for a client that wrote in the last
+    replica_sticky_seconds, so it reads its own writes. Overriding get_db overrides this dependency too.
+
+    :param request: Request: The current request, for the sticky cookie
+    :param primary: DBSession: The session on the primary
+    :return: A database session
+    """
+    if not read_replicas or is_sticky(request.cookies):
+        yield primary
+        return
+    db = await read_replicas.open()
+    if db is None:
+        yield primary
+        return
+    try:
+        yield db
+    except DBAPIError as e:
+        if e.connection_invalidated:
+            read_replicas.mark_down(db.info["replica"], e)
+        raise
+    finally:
+        await maybe_await(db.close())
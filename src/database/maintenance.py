@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import Table, bindparam, inspect, select, update
+
+from src.database import search
+from src.database.conn_to_db import async_engine, engine
+from src.database.models import Base, Contact, User, birthday_key, parse_birthday
+
+BACKFILL_BATCH_SIZE = 1000
+# Global indexes replaced by the per-owner indexes of Contact
+REPLACED_INDEXES = ("ix_contacts_email", "ix_contacts_phone_number", "ix_contacts_name_id", "ix_contacts_birthday_key",
+                    "ix_contacts_search_trgm",
+                    # PostgreSQL search matches on the trigram index, the tsvector is only computed for the rows found
+                    "ix_contacts_search_tsv")
+
+
+def add_missing_columns(connection, table: Table):
+    """
+    The add_missing_columns function adds the columns and indexes of a model table that an existing
+    database does not have yet. New columns are added as nullable and filled with their server default, if any.
+    A foreign key of a new column is added with it, as create_all would, e.g. contacts.owner_id references users.
+
+    :param connection: Connection: An open connection inside a transaction
+    :param table: Table: The table as declared in the models
+    :return: None
+    """
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=connection.dialect)
+            default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+            references = "".join(f" REFERENCES {fk.column.table.name} ({fk.column.name})"
+                                 + (f" ON DELETE {fk.ondelete}" if fk.ondelete else "") for fk in column.foreign_keys)
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"
+                                       f"{references}")
+            logging.info("Added column %s.%s", table.name, column.name)
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def backfill_birthdays(connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    The backfill_birthdays function fills birthday_date and birthday_key for contacts stored
+    before those columns existed.
+    It walks the table in id order, one batch per statement, so it can run on a live database.
+    Birthdays that are not valid dates are left without a key.
+
+    :param connection: Connection: An open connection inside a transaction
+    :param batch_size: int: Number of contacts read and updated per statement
+    :return: The number of contacts that got a birthday key
+    """
+    stmt = (update(Contact.__table__)
+            .where(Contact.__table__.c.id == bindparam("contact_id"))
+            .values(birthday_date=bindparam("day"), birthday_key=bindparam("key")))
+    last_id, filled = 0, 0
+    while True:
+        rows = connection.execute(
+            select(Contact.id, Contact.birthday)
+            .where(Contact.id > last_id, Contact.birthday_key.is_(None), Contact.birthday.isnot(None))
+            .order_by(Contact.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return filled
+        last_id = rows[-1].id
+        params = []
+        for row in rows:
+            day = parse_birthday(row.birthday)
+            if day is not None:
+                params.append({"contact_id": row.id, "day": day, "key": birthday_key(day)})
+        if params:
+            connection.execute(stmt, params)
+            filled += len(params)
+
+
+def drop_replaced_indexes(connection):
+    """
+    The drop_replaced_indexes function drops the global indexes that the per-owner indexes replaced,
+    among them the global unique indexes on email and phone_number, which would keep two owners
+    from storing the same contact, and the tsvector index that contact search no longer uses.
+
+    :param connection: Connection: An open connection inside a transaction
+    :return: None
+    """
+    existing = {index["name"] for index in inspect(connection).get_indexes(Contact.__tablename__)}
+    for name in REPLACED_INDEXES:
+        if name in existing:
+            connection.exec_driver_sql(f"DROP INDEX {name}")
+            logging.info("Dropped index %s", name)
+
+
+def drop_replaced_search_index(connection):
+    """
+    The drop_replaced_search_index function drops the SQLite search index from before it held the owner,
+    so that search.install creates the current one and indexes the contacts again.
+
+    :param connection: Connection: An open connection inside a transaction
+    :return: None
+    """
+    if connection.dialect.name != "sqlite" or "contacts_fts" not in inspect(connection).get_table_names():
+        return
+    if "owner" not in {column["name"] for column in inspect(connection).get_columns("contacts_fts")}:
+        for statement in search.SQLITE_DROP:
+            connection.exec_driver_sql(statement)
+        logging.info("Dropped the search index without owners")
+
+
+def adopt_orphans(connection, owner_email: str) -> int:
+    """
+    The adopt_orphans function gives the contacts stored before contacts had owners to one user.
+    Until then they are not visible to anyone.
+
+    :param connection: Connection: An open connection inside a transaction
+    :param owner_email: str: Email of the user who gets the contacts
+    :return: The number of contacts adopted
+    """
+    owner_id = connection.execute(select(User.id).where(User.email == owner_email)).scalar()
+    if owner_id is None:
+        raise ValueError(f"No user with the email {owner_email}")
+    result = connection.execute(update(Contact.__table__).where(Contact.__table__.c.owner_id.is_(None))
+                                .values(owner_id=owner_id))
+    return result.rowcount
+
+
+def run(connection, owner_email: str | None = None):
+    """
+    The run function brings an existing database up to date with the current models:
+    it adds new contact columns and indexes, drops the indexes they replaced, backfills birthdays,
+    installs the contact search index and, if owner_email is given, gives the contacts without an owner to that user.
+
+    :param connection: Connection: An open connection inside a transaction
+    :param owner_email: str | None: Email of the user who gets the contacts without an owner
+    :return: None
+    """
+    Base.metadata.create_all(connection)
+    add_missing_columns(connection, Contact.__table__)
+    drop_replaced_indexes(connection)
+    drop_replaced_search_index(connection)
+    logging.info("Backfilled %d birthdays", backfill_birthdays(connection))
+    search.install(connection)
+    if owner_email is not None:
+        logging.info("Adopted %d contacts", adopt_orphans(connection, owner_email))
+
+
+async def main(owner_email: str | None = None):
+    """
+    The main function runs the maintenance steps on the configured database, in sync or async mode.
+
+    :param owner_email: str | None: Email of the user who gets the contacts without an owner
+    :return: None
+    """
+    if async_engine is not None:
+        async with async_engine.begin() as connection:
+            await connection.run_sync(run, owner_email)
+    else:
+        with engine.begin() as connection:
+            run(connection, owner_email)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bring the database up to date with the models")
+    parser.add_argument("--adopt-orphans", metavar="EMAIL", help="give the contacts without an owner to this user")
+    asyncio.run(main(parser.parse_args().adopt_orphans))
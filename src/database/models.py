@@ -1,23 +1,81 @@
-from sqlalchemy import Column, Integer, String, DateTime, func, Boolean
-from sqlalchemy.orm import declarative_base
+from datetime import date, datetime
 
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, func, Boolean, Index
+from sqlalchemy.orm import declarative_base, validates
+
+from src.database import search
 from src.database.conn_to_db import engine
 
 Base = declarative_base()
 
 
+def parse_birthday(value: str | None) -> date | None:
+    """
+    The parse_birthday function parses a birthday string in the YYYY-MM-DD format.
+
+    :param value: str | None: The birthday as stored in Contact.birthday
+    :return: The date, or None if the string is missing or is not a valid date
+    """
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def birthday_key(day: date) -> int:
+    """
+    The birthday_key function maps a date to its month and day as a sortable number, e.g. March 9 -> 309.
+
+    :param day: date: Any date
+    :return: month * 100 + day
+    """
+    return day.month * 100 + day.day
+
+
 class Contact(Base):
     __tablename__ = "contacts"
 
     id = Column(Integer, primary_key=True, index=True)
+    # Every query filters on the owner, so the indexes below lead with it
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
     name = Column(String)
     sure_name = Column(String)
-    email = Column(String, unique=True, index=True)
-    phone_number = Column(String, unique=True, index=True)
+    email = Column(String)
+    phone_number = Column(String)
     birthday = Column(String)
+    birthday_date = Column(Date, nullable=True)
+    birthday_key = Column(Integer, nullable=True)
     additional_data = Column(String)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Incremented by every write, the ETag of the contact is derived from it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # Serve the pages of one owner, ordered by id or by (name, id)
+        Index("ix_contacts_owner_id_id", "owner_id", "id"),
+        Index("ix_contacts_owner_id_name_id", "owner_id", "name", "id"),
+        Index("ix_contacts_owner_id_birthday_key", "owner_id", "birthday_key"),
+        # Emails and phone numbers are unique per owner, and the email index is the upsert conflict target
+        Index("ix_contacts_owner_id_email", "owner_id", "email", unique=True),
+        Index("ix_contacts_owner_id_phone_number", "owner_id", "phone_number", unique=True),
+    )
+
+    @validates("birthday")
+    def validate_birthday(self, key, value):
+        """
+        The validate_birthday function keeps birthday_date and birthday_key in step with the birthday string.
+
+        :param key: str: The name of the attribute being set
+        :param value: str: The new birthday string
+        :return: The birthday string unchanged
+        """
+        self.birthday_date = parse_birthday(value)
+        self.birthday_key = birthday_key(self.birthday_date) if self.birthday_date else None
+        return value
+
+
+search.register(Contact.__table__)
 
 
 class User(Base):
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class TimedPoolMixin:
+    """
+    Counts how long checkouts wait for a connection and how many give up after pool_timeout.
+    The wait includes opening a new connection when the pool may still grow.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the state of the pool and its checkout counters.
+        checked_out close to size + max_overflow with a growing wait_time or timeouts means the pool is too small.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the pool size, usage and wait counters
+        """
+        return {"size": self.size(), "max_overflow": self._max_overflow, "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(), "overflow": max(self.overflow(), 0), "checkouts": self.checkouts,
+                "timeouts": self.timeouts, "wait_time": round(self.wait_time, 6), "max_wait": round(self.max_wait, 6)}
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
@@ -0,0 +1,130 @@
+import logging
+import time
+from http.cookies import SimpleCookie
+from typing import Callable
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+STICKY_COOKIE = "primary_until"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class ReplicaSet:
+    """
+    Round robin over the sessionmakers of the read replicas. A replica that fails to connect is skipped
+    for retry_after seconds, and while every replica is down reads go to the primary.
+    """
+
+    def __init__(self, sessionmakers: list[Callable[[], Session | AsyncSession]], retry_after: float):
+        self.sessionmakers = sessionmakers
+        self.retry_after = retry_after
+        self.down_until = [0.0] * len(sessionmakers)
+        self.reads = [0] * len(sessionmakers)
+        self.failures = [0] * len(sessionmakers)
+        self.fallbacks = 0
+        self._next = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.sessionmakers)
+
+    def mark_down(self, index: int, error: Exception):
+        """
+        The mark_down function takes a replica out of the rotation for retry_after seconds.
+
+        :param self: Represent the instance of the class
+        :param index: int: Position of the replica
+        :param error: Exception: The error the replica failed with
+        :return: None
+        """
+        logging.warning("Read replica %s is unavailable for %ss: %s", index, self.retry_after, error)
+        self.failures[index] += 1
+        self.down_until[index] = time.monotonic() + self.retry_after
+
+    async def open(self) -> Session | AsyncSession | None:
+        """
+        The open function returns a session on the next healthy replica, with its connection already checked out,
+        so a replica that is down is noticed here and not in the middle of a request.
+        The index of the replica is kept in session.info["replica"].
+
+        :param self: Represent the instance of the class
+        :return: A session, or None if no replica is available
+        """
+        for _ in range(len(self.sessionmakers)):
+            index = self._next
+            self._next = (self._next + 1) % len(self.sessionmakers)
+            if self.down_until[index] > time.monotonic():
+                continue
+            db = self.sessionmakers[index]()
+            try:
+                if isinstance(db, AsyncSession):
+                    await db.connection()
+                else:
+                    db.connection()
+            except DBAPIError as e:
+                if isinstance(db, AsyncSession):
+                    await db.close()
+                else:
+                    db.close()
+                self.mark_down(index, e)
+                continue
+            db.info["replica"] = index
+            self.reads[index] += 1
+            return db
+        self.fallbacks += 1
+        return None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {"replicas": [{"reads": reads, "failures": failures, "healthy": down_until <= now}
+                             for reads, failures, down_until in zip(self.reads, self.failures, self.down_until)],
+                "fallbacks": self.fallbacks}
+
+
+def is_replica(db: Session | AsyncSession) -> bool:
+    return "replica" in db.info
+
+
+def is_sticky(cookies: dict) -> bool:
+    """
+    The is_sticky function checks whether a client wrote recently and must read from the primary,
+    which has its writes, rather than from a replica that may lag behind.
+
+    :param cookies: dict: The cookies of the request
+    :return: True while the sticky window set by the last write is open
+    """
+    try:
+        return float(cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware that marks a client after every successful write with a cookie holding the end
+    of the sticky window, so its reads in the next seconds go to the primary and see the write.
+    """
+
+    def __init__(self, app, seconds: float):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = SimpleCookie()
+                cookie[STICKY_COOKIE] = f"{time.time() + self.seconds:.3f}"
+                cookie[STICKY_COOKIE]["max-age"] = max(int(self.seconds), 1)
+                cookie[STICKY_COOKIE]["path"] = "/"
+                cookie[STICKY_COOKIE]["httponly"] = True
+                cookie[STICKY_COOKIE]["samesite"] = "lax"
+                header = cookie.output(header="").strip().encode("latin-1")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", header)]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
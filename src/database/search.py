@@ -0,0 +1,162 @@
+import re
+
+from sqlalchemy import DDL, Table, and_, column, event, func, literal_column, select, table
+
+SEARCH_COLUMNS = ("name", "sure_name", "email", "phone_number", "additional_data")
+
+
+# SQLite: external content FTS5 table over contacts. The trigram tokenizer matches any substring
+# of three or more characters, so fragments of phone numbers and emails are found too.
+# The owner is indexed as one more column and every search matches it, so the index only yields the rows
+# of one owner. Its id is wrapped in ~ because the tokenizer skips values shorter than three characters,
+# and so that "~12~" is not found in "~112~". The view gives the indexed values to the rebuild command.
+# Triggers keep it in sync with every insert, update and delete on contacts.
+def _owner_token(prefix: str = "") -> str:
+    return f"'~' || {prefix}owner_id || '~'"
+
+
+_fts_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join([_owner_token("new.")] + [f"new.{c}" for c in SEARCH_COLUMNS])
+_old_values = ", ".join([_owner_token("old.")] + [f"old.{c}" for c in SEARCH_COLUMNS])
+
+SQLITE_DDL = (
+    f"CREATE VIEW IF NOT EXISTS contacts_fts_source AS SELECT id, {_owner_token()} AS owner, {_fts_columns} "
+    f"FROM contacts",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(owner, {_fts_columns}, "
+    f"content='contacts_fts_source', content_rowid='id', tokenize='trigram')",
+    # The owner matches every row of a search, it does not weigh in the ranking
+    "INSERT INTO contacts_fts(contacts_fts, rank) VALUES ('rank', 'bm25(0" + ", 1" * len(SEARCH_COLUMNS) + ")')",
+    f"CREATE TRIGGER IF NOT EXISTS contacts_fts_ai AFTER INSERT ON contacts BEGIN "
+    f"INSERT INTO contacts_fts(rowid, owner, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS contacts_fts_ad AFTER DELETE ON contacts BEGIN "
+    f"INSERT INTO contacts_fts(contacts_fts, rowid, owner, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS contacts_fts_au AFTER UPDATE ON contacts BEGIN "
+    f"INSERT INTO contacts_fts(contacts_fts, rowid, owner, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO contacts_fts(rowid, owner, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+)
+SQLITE_REBUILD = "INSERT INTO contacts_fts(contacts_fts) VALUES ('rebuild')"
+SQLITE_DROP = (
+    "DROP TRIGGER IF EXISTS contacts_fts_ai",
+    "DROP TRIGGER IF EXISTS contacts_fts_ad",
+    "DROP TRIGGER IF EXISTS contacts_fts_au",
+    "DROP TABLE IF EXISTS contacts_fts",
+    "DROP VIEW IF EXISTS contacts_fts_source",
+)
+
+contacts_fts = table("contacts_fts", column("rowid"), column("rank"))
+
+
+# PostgreSQL: a GIN index on the owner and a trigram expression over one search document, which serves
+# the owner filter together with the ILIKE of every fragment (btree_gin provides the GIN operators of integers).
+# The query below must use exactly the same expression. Whole words only weigh in the ranking.
+def _document(prefix: str = "") -> str:
+    return "(" + " || ' ' || ".join(f"coalesce({prefix}{c}, '')" for c in SEARCH_COLUMNS) + ")"
+
+
+DOCUMENT_SQL = _document("contacts.")
+TSVECTOR_SQL = f"to_tsvector('simple', {DOCUMENT_SQL})"
+
+POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    f"CREATE INDEX IF NOT EXISTS ix_contacts_owner_id_search_trgm ON contacts "
+    f"USING gin (owner_id, {_document()} gin_trgm_ops)",
+)
+
+
+def register(contacts_table: Table):
+    """
+    The register function attaches the search index DDL to the create and drop events of the contacts table,
+    so metadata.create_all and drop_all manage the index together with the table.
+
+    :param contacts_table: Table: The contacts table
+    :return: None
+    """
+    for statement in SQLITE_DDL:
+        event.listen(contacts_table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    for statement in SQLITE_DROP:
+        event.listen(contacts_table, "before_drop", DDL(statement).execute_if(dialect="sqlite"))
+    for statement in POSTGRES_DDL:
+        event.listen(contacts_table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+def install(connection):
+    """
+    The install function creates the search index on a database whose contacts table already exists
+    and indexes the rows that are already there.
+
+    :param connection: Connection: An open connection inside a transaction
+    :return: None
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        for statement in SQLITE_DDL + (SQLITE_REBUILD,):
+            connection.exec_driver_sql(statement)
+    elif dialect == "postgresql":
+        for statement in POSTGRES_DDL:
+            connection.exec_driver_sql(statement)
+
+
+def search_fragments(q: str) -> list[str]:
+    """
+    The search_fragments function splits free user input into the whitespace separated fragments
+    a contact must all contain. Fragments shorter than three characters are skipped because the trigram indexes
+    of both databases cannot match them.
+
+    :param q: str: The search string from the request
+    :return: The fragments, possibly none
+    """
+    return [f for f in re.split(r"\s+", q.strip()) if len(f) >= 3]
+
+
+def fts5_query(q: str, owner_id: int) -> str | None:
+    """
+    The fts5_query function turns free user input into an FTS5 query that matches the rows of one owner
+    containing every fragment. Each fragment becomes a quoted phrase so FTS5 operators in the input are not interpreted,
+    and the fragments are only looked for in the search columns.
+
+    :param q: str: The search string from the request
+    :param owner_id: int: The id of the user who owns the contacts
+    :return: The FTS5 query, or None if nothing searchable is left
+    """
+    fragments = search_fragments(q)
+    if not fragments:
+        return None
+    phrases = " ".join('"' + f.replace('"', '""') + '"' for f in fragments)
+    return f'owner : "~{int(owner_id)}~" AND {{{" ".join(SEARCH_COLUMNS)}}} : ({phrases})'
+
+
+def search_statement(contact, dialect: str, q: str, owner_id: int):
+    """
+    The search_statement function builds the ranked search query of one owner for the given database dialect.
+    The owner is matched in the search index itself, the contacts of other owners are neither read nor ranked.
+
+    :param contact: The Contact model
+    :param dialect: str: Name of the database dialect
+    :param q: str: The search string from the request
+    :param owner_id: int: The id of the user who owns the contacts
+    :return: A select of Contact ordered by relevance, or None if the query cannot match anything
+    """
+    if dialect == "sqlite":
+        match = fts5_query(q, owner_id)
+        if match is None:
+            return None
+        return (select(contact)
+                .join(contacts_fts, contacts_fts.c.rowid == contact.id)
+                .where(literal_column("contacts_fts").match(match), contact.owner_id == owner_id)
+                .order_by(contacts_fts.c.rank, contact.id))
+    fragments = search_fragments(q)
+    if not fragments:
+        return None
+    document = literal_column(DOCUMENT_SQL)
+    # The owner and one ILIKE per fragment, all served by the one index, so every fragment must occur as on SQLite
+    matches = and_(contact.owner_id == owner_id,
+                   *(document.ilike("%" + f.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%",
+                                    escape="/") for f in fragments))
+    if dialect == "postgresql":
+        tsquery = func.plainto_tsquery(literal_column("'simple'"), q)
+        # Whole words rank above fragments, matching is left to the trigram index
+        rank = func.ts_rank(literal_column(TSVECTOR_SQL), tsquery) + func.similarity(document, q)
+        return select(contact).where(matches).order_by(rank.desc(), contact.id)
+    return select(contact).where(matches).order_by(contact.id)
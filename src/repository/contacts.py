@@ -1,67 +1,284 @@
-from fastapi import Depends
-from sqlalchemy.orm import Session
+from datetime import date, timedelta
 
-from src.database.conn_to_db import get_db
-from src.database.models import Contact
-from src.schemas import ContactModel
+from fastapi import Depends, status
+from sqlalchemy import bindparam, case, func, insert, or_, select, tuple_
+from sqlalchemy import delete as delete_statement, update as update_statement
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 
+from src.database import search
+from src.database.conn_to_db import DBSession, get_db, maybe_await
+from src.database.models import Contact, birthday_key, parse_birthday
+from src.schemas import ContactBatchUpdate, ContactModel
+from src.services.response_cache import contact_list_tag, contact_tag, response_cache
 
-async def get_contacts(limit: int, offset: int, db: Session):
+
+async def get_contacts(limit: int, offset: int, owner_id: int, db: DBSession, sort_by: str = "id",
+                       after: tuple | None = None):
     """
-    The get_contacts function returns a list of contacts from the database.
+    The get_contacts function returns a list of the contacts of one owner from the database.
+    Contacts are ordered by (sort_by, id). When after is given the page starts right after that
+    position (keyset pagination), which is served by an index range scan instead of skipping offset rows.
 
     :param limit: int: Limit the number of contacts returned
     :param offset: int: Skip a certain number of rows in the database
+    :param owner_id: int: The id of the user who owns the contacts
     :param db: Session: Pass the database session to the function
+    :param sort_by: str: Name of the column to order by, id or name
+    :param after: tuple | None: The (sort key value, id) of the last contact of the previous page
     :return: A list of contacts
     """
-    contacts = db.query(Contact).limit(limit).offset(offset).all()
+    stmt = select(Contact).where(Contact.owner_id == owner_id)
+    result = await maybe_await(db.execute(_page_statement(stmt, limit, offset, sort_by, after)))
+    contacts = result.scalars().all()
     return contacts
 
 
-async def get_contact_by_id(contact_id: int, db: Session):
+async def get_contact_versions(limit: int, offset: int, owner_id: int, db: DBSession, sort_by: str = "id",
+                               after: tuple | None = None):
+    """
+    The get_contact_versions function returns the same page as get_contacts, but only the id, version
+    and sort key of each contact, which is all a page ETag and the next cursor need.
+
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip a certain number of rows in the database
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :param sort_by: str: Name of the column to order by, id or name
+    :param after: tuple | None: The (sort key value, id) of the last contact of the previous page
+    :return: A list of (id, version, sort key value) rows
+    """
+    stmt = (select(Contact.id, Contact.version, getattr(Contact, sort_by).label("sort_key"))
+            .where(Contact.owner_id == owner_id))
+    result = await maybe_await(db.execute(_page_statement(stmt, limit, offset, sort_by, after)))
+    return result.all()
+
+
+def _page_statement(stmt, limit: int, offset: int, sort_by: str, after: tuple | None):
+    if sort_by == "id":
+        order_by = (Contact.id,)
+        if after is not None:
+            stmt = stmt.where(Contact.id > after[1])
+    else:
+        order_by = (getattr(Contact, sort_by), Contact.id)
+        if after is not None:
+            stmt = stmt.where(tuple_(*order_by) > tuple_(*after))
+    if after is None:
+        stmt = stmt.offset(offset)
+    return stmt.order_by(*order_by).limit(limit)
+
+
+async def get_contact_by_id(contact_id: int, owner_id: int, db: DBSession):
     """
     The get_contact_by_id function returns a contact object from the database based on its id.
+    Contacts of other owners are not found.
         Args:
             contact_id (int): The id of the desired contact.
+            owner_id (int): The id of the user who owns the contact.
             db (Session): A connection to the database.
 
     :param contact_id: int: Pass in the id of the contact we want to retrieve
+    :param owner_id: int: The id of the user who owns the contact
     :param db: Session: Pass in the database session to the function
     :return: The contact with the given id
     """
-    contact = db.query(Contact).filter_by(id=contact_id).first()
+    result = await maybe_await(db.execute(select(Contact).filter_by(id=contact_id, owner_id=owner_id)))
+    contact = result.scalars().first()
     return contact
 
 
-async def create(body: ContactModel, db: Session = Depends(get_db)):
+async def get_contact_version(contact_id: int, owner_id: int, db: DBSession) -> int | None:
+    """
+    The get_contact_version function returns only the version of a contact, which is all its ETag needs.
+
+    :param contact_id: int: The id of the contact
+    :param owner_id: int: The id of the user who owns the contact
+    :param db: Session: Pass in the database session to the function
+    :return: The version, or None if the owner has no such contact
+    """
+    result = await maybe_await(db.execute(select(Contact.version).filter_by(id=contact_id, owner_id=owner_id)))
+    return result.scalar()
+
+
+async def search_contacts(q: str, limit: int, offset: int, owner_id: int, db: DBSession):
+    """
+    The search_contacts function finds the contacts of one owner whose name, sure_name, email, phone_number
+    or additional_data contain the fragments of the search string. It runs on the full-text index of the database
+    (FTS5 on SQLite, a trigram index on PostgreSQL), which holds the owner too, and returns the best matches first.
+
+    :param q: str: The search string
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip a certain number of matches
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :return: A list of contacts ordered by relevance
+    """
+    stmt = search.search_statement(Contact, db.get_bind().dialect.name, q, owner_id)
+    if stmt is None:
+        return []
+    result = await maybe_await(db.execute(stmt.limit(limit).offset(offset)))
+    return result.scalars().all()
+
+
+async def get_upcoming_birthdays(days: int, limit: int, offset: int, owner_id: int, db: DBSession,
+                                 today: date | None = None):
+    """
+    The get_upcoming_birthdays function returns the contacts of one owner whose birthday falls within
+    the next days days, from today to today + days - 1, soonest first.
+    It filters on the indexed (owner_id, birthday_key), so the lookup is a range scan.
+    A window that runs past December 31 is split into two ranges, the end of this year and the start of the next.
+
+    :param days: int: Size of the window in days, today included
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip a certain number of contacts
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :param today: date | None: First day of the window, defaults to the current date
+    :return: A list of contacts ordered by the date of their next birthday
+    """
+    if days < 1:
+        return []
+    today = today or date.today()
+    start = birthday_key(today)
+    # The last day of the window, a window of one day is today only
+    end = birthday_key(today + timedelta(days=days - 1))
+    if days >= 366:
+        condition = Contact.birthday_key.isnot(None)
+    elif start <= end:
+        condition = Contact.birthday_key.between(start, end)
+    else:
+        condition = or_(Contact.birthday_key >= start, Contact.birthday_key <= end)
+    stmt = (select(Contact)
+            .where(Contact.owner_id == owner_id, condition)
+            .order_by(case((Contact.birthday_key >= start, 0), else_=1), Contact.birthday_key, Contact.id)
+            .limit(limit)
+            .offset(offset))
+    result = await maybe_await(db.execute(stmt))
+    return result.scalars().all()
+
+
+async def create(body: ContactModel, owner_id: int, db: DBSession = Depends(get_db)):
     """
     The create function creates a new contact in the database.
         It takes a ContactModel object as input and returns the newly created contact.
 
     :param body: ContactModel: Get the contact data from the request body
+    :param owner_id: int: The id of the user who owns the contact
     :param db: Session: Get a database session
     :return: A contact object
     """
-    contact = Contact(**body.dict())
+    contact = Contact(**body.dict(), owner_id=owner_id)
     db.add(contact)
-    db.commit()
+    await maybe_await(db.commit())
+    await maybe_await(db.refresh(contact))
+    await response_cache.invalidate(contact_list_tag(owner_id))
     return contact
 
 
-async def update(contact_id: int, body: ContactModel, db: Session):
+EXPORT_COLUMNS = (Contact.id, Contact.name, Contact.sure_name, Contact.email, Contact.phone_number,
+                  Contact.birthday, Contact.additional_data)
+
+
+async def get_contact_rows(after_id: int, limit: int, owner_id: int, db: DBSession):
+    """
+    The get_contact_rows function reads the next chunk of contacts of one owner in id order as plain rows,
+    without building ORM objects. It is the read side of the contact export.
+
+    :param after_id: int: Return contacts with an id greater than this one
+    :param limit: int: Maximum number of rows in the chunk
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :return: A list of rows with the EXPORT_COLUMNS
+    """
+    stmt = (select(*EXPORT_COLUMNS).where(Contact.owner_id == owner_id, Contact.id > after_id)
+            .order_by(Contact.id).limit(limit))
+    result = await maybe_await(db.execute(stmt))
+    return result.all()
+
+
+def _contact_values(body: ContactModel, owner_id: int) -> dict:
+    values = body.dict()
+    values["owner_id"] = owner_id
+    values["birthday_date"] = parse_birthday(body.birthday)
+    values["birthday_key"] = birthday_key(values["birthday_date"]) if values["birthday_date"] else None
+    return values
+
+
+def _upsert_statement(dialect: str, rows: list[dict]):
+    """
+    The _upsert_statement function builds one multi-row INSERT that updates the existing contact
+    of the owner with the same email instead of failing on it. Dialects without ON CONFLICT get a plain INSERT.
+    The statement returns the ids of the inserted and updated contacts.
+
+    :param dialect: str: Name of the database dialect
+    :param rows: list[dict]: Column values of the contacts
+    :return: An insert statement
+    """
+    dialects = {"postgresql": postgresql, "sqlite": sqlite}
+    if dialect not in dialects:
+        return insert(Contact.__table__).values(rows).returning(Contact.__table__.c.id)
+    stmt = dialects[dialect].insert(Contact.__table__).values(rows)
+    updated = {name: stmt.excluded[name] for name in rows[0] if name not in ("owner_id", "email")}
+    return stmt.on_conflict_do_update(index_elements=[Contact.__table__.c.owner_id, Contact.__table__.c.email],
+                                      set_={**updated, "updated_at": func.now(),
+                                            "version": Contact.__table__.c.version + 1}
+                                      ).returning(Contact.__table__.c.id)
+
+
+async def upsert_many(bodies: list[ContactModel], owner_id: int, db: DBSession) -> list[str | None]:
+    """
+    The upsert_many function creates or updates a batch of contacts of one owner with a single statement
+    and a single commit. Contacts are matched on email. If the batch breaks another constraint (a phone number
+    that belongs to a different contact), it is retried one contact per transaction to find out which rows fail.
+
+    :param bodies: list[ContactModel]: The contacts to store
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :return: One entry per contact, None if it was stored, otherwise the reason it was rejected
+    """
+    if not bodies:
+        return []
+    dialect = db.get_bind().dialect.name
+    # A row may only be touched once per statement, so the last duplicate of an email wins
+    rows = list({body.email: _contact_values(body, owner_id) for body in bodies}.values())
+    try:
+        result = await maybe_await(db.execute(_upsert_statement(dialect, rows)))
+        ids = result.scalars().all()
+        await maybe_await(db.commit())
+        await response_cache.invalidate(contact_list_tag(owner_id), *map(contact_tag, ids))
+        return [None] * len(bodies)
+    except IntegrityError:
+        await maybe_await(db.rollback())
+
+    errors, ids = [], []
+    for body in bodies:
+        try:
+            result = await maybe_await(db.execute(_upsert_statement(dialect, [_contact_values(body, owner_id)])))
+            ids.extend(result.scalars().all())
+            await maybe_await(db.commit())
+            errors.append(None)
+        except IntegrityError as e:
+            await maybe_await(db.rollback())
+            errors.append(str(e.orig))
+    await response_cache.invalidate(contact_list_tag(owner_id), *map(contact_tag, ids))
+    return errors
+
+
+async def update(contact_id: int, body: ContactModel, owner_id: int, db: DBSession):
     """"
     The update function updates a contact in the database.
         Args:
             contact_id (int): The id of the contact to update.
             body (ContactModel): The updated version of the ContactModel object.
+            owner_id (int): The id of the user who owns the contact.
 
     :param contact_id: int: Get the contact by id
     :param body: ContactModel: Get the data from the request body
+    :param owner_id: int: The id of the user who owns the contact
     :param db: Session: Pass the database session to the function
     :return: The updated contact
     """
-    contact = await get_contact_by_id(contact_id, db)
+    contact = await get_contact_by_id(contact_id, owner_id, db)
     if contact:
         contact.name = body.name
         contact.sure_name = body.sure_name
@@ -69,23 +286,134 @@ async def update(contact_id: int, body: ContactModel, db: Session):
         contact.phone_number = body.phone_number
         contact.birthday = body.birthday
         contact.additional_data = body.additional_data
-        db.commit()
+        contact.version = Contact.version + 1
+        await maybe_await(db.commit())
+        await maybe_await(db.refresh(contact))
+        await response_cache.invalidate(contact_list_tag(owner_id), contact_tag(contact_id))
     return contact
 
 
-async def delete(contact_id: int, db: Session):
+async def delete(contact_id: int, owner_id: int, db: DBSession):
     """
     The delete function deletes a contact from the database.
         Args:
             contact_id (int): The id of the contact to delete.
+            owner_id (int): The id of the user who owns the contact.
             db (Session): A connection to the database.
 
     :param contact_id: int: Specify the id of the contact to be deleted
+    :param owner_id: int: The id of the user who owns the contact
     :param db: Session: Pass the database session to the function
     :return: The contact that was deleted
     """
-    contact = await get_contact_by_id(contact_id, db)
+    contact = await get_contact_by_id(contact_id, owner_id, db)
     if contact:
-        db.delete(contact)
-        db.commit()
-    return contact
\ No newline at end of file
+        await maybe_await(db.delete(contact))
+        await maybe_await(db.commit())
+        await response_cache.invalidate(contact_list_tag(owner_id), contact_tag(contact_id))
+    return contact
+
+
+async def get_contacts_by_ids(ids: list[int], owner_id: int, db: DBSession) -> dict:
+    """
+    The get_contacts_by_ids function returns the contacts of one owner with the given ids, with a single IN query.
+
+    :param ids: list[int]: The ids of the contacts
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :return: A dict of the contacts found, by id
+    """
+    stmt = (select(Contact).where(Contact.owner_id == owner_id, Contact.id.in_(ids))
+            # Contacts loaded earlier in the session are refreshed, e.g. after a bulk update
+            .execution_options(populate_existing=True))
+    result = await maybe_await(db.execute(stmt))
+    return {contact.id: contact for contact in result.scalars().all()}
+
+
+async def update_many(bodies: list[ContactBatchUpdate], owner_id: int, db: DBSession) -> list[dict]:
+    """
+    The update_many function applies a batch of updates to the contacts of one owner in one transaction
+    with one commit. An update of a contact that does not exist gets a 404. An update that would give
+    a contact an email or phone number still held by another contact, including one held by a contact
+    updated later in the batch, gets a 409. Both are skipped and the others are applied.
+    The number of statements does not depend on the size of the batch.
+
+    :param bodies: list[ContactBatchUpdate]: The updates, each with the id of its contact
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :return: One result per update with its status, the reason it was skipped or the updated contact
+    """
+    table = Contact.__table__
+    rows = (await maybe_await(db.execute(
+        select(table.c.id, table.c.email, table.c.phone_number)
+        .where(table.c.owner_id == owner_id,
+               or_(table.c.id.in_([body.id for body in bodies]),
+                   table.c.email.in_([body.email for body in bodies]),
+                   table.c.phone_number.in_([body.phone_number for body in bodies])))
+    ))).all()
+    current = {row.id: (("email", row.email), ("phone_number", row.phone_number)) for row in rows}
+    taken = {key: contact_id for contact_id, keys in current.items() for key in keys}
+    results, params = [], []
+    for body in bodies:
+        if body.id not in current:
+            results.append({"id": body.id, "status": status.HTTP_404_NOT_FOUND, "detail": "Not found!"})
+            continue
+        keys = (("email", body.email), ("phone_number", body.phone_number))
+        conflict = next((key for key in keys if taken.get(key, body.id) != body.id), None)
+        if conflict is not None:
+            results.append({"id": body.id, "status": status.HTTP_409_CONFLICT,
+                            "detail": f"The {conflict[0]} {conflict[1]} belongs to contact {taken[conflict]}"})
+            continue
+        # Updates run in batch order, so the old values are free for the updates after this one
+        for key in current[body.id]:
+            taken.pop(key, None)
+        taken.update((key, body.id) for key in keys)
+        current[body.id] = keys
+        results.append({"id": body.id, "status": status.HTTP_200_OK})
+        values = _contact_values(body, owner_id)
+        del values["id"], values["owner_id"]
+        params.append({"contact_id": body.id, **values})
+    if not params:
+        return results
+    # One executemany, the SET clause takes the columns from the parameters
+    stmt = (update_statement(table)
+            .where(table.c.id == bindparam("contact_id"), table.c.owner_id == owner_id)
+            .values(version=table.c.version + 1, updated_at=func.now()))
+    updated = [param["contact_id"] for param in params]
+    try:
+        await maybe_await(db.execute(stmt, params))
+        await maybe_await(db.commit())
+    except IntegrityError as e:
+        # A concurrent write took a value the checks above saw free, nothing of the batch is applied
+        await maybe_await(db.rollback())
+        for result in results:
+            if result["status"] == status.HTTP_200_OK:
+                result.update(status=status.HTTP_409_CONFLICT, detail=str(e.orig))
+        return results
+    await response_cache.invalidate(contact_list_tag(owner_id), *map(contact_tag, updated))
+    contacts = await get_contacts_by_ids(updated, owner_id, db)
+    for result in results:
+        if result["status"] == status.HTTP_200_OK:
+            result["contact"] = contacts[result["id"]]
+    return results
+
+
+async def delete_many(ids: list[int], owner_id: int, db: DBSession) -> list[dict]:
+    """
+    The delete_many function deletes a batch of contacts of one owner with one statement and one commit.
+
+    :param ids: list[int]: The ids of the contacts to delete
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the function
+    :return: One result per id, 204 if the contact was deleted, 404 if it was not found
+    """
+    table = Contact.__table__
+    result = await maybe_await(db.execute(
+        delete_statement(table).where(table.c.owner_id == owner_id, table.c.id.in_(ids)).returning(table.c.id)
+    ))
+    deleted = set(result.scalars().all())
+    await maybe_await(db.commit())
+    if deleted:
+        await response_cache.invalidate(contact_list_tag(owner_id), *map(contact_tag, deleted))
+    return [{"id": contact_id, "status": status.HTTP_204_NO_CONTENT} if contact_id in deleted
+            else {"id": contact_id, "status": status.HTTP_404_NOT_FOUND, "detail": "Not found!"} for contact_id in ids]
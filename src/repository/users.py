@@ -1,13 +1,15 @@
 import logging
 
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 
+from src.database.conn_to_db import DBSession, maybe_await
 from src.database.models import User
 from src.schemas import UserModel
+from src.services.cache import user_cache
 
 
-async def get_user_by_email(email: str, db: Session) -> User | None:
+async def get_user_by_email(email: str, db: DBSession) -> User | None:
     """
     The get_user_by_email function takes in an email and a database session,
     and returns the user associated with that email. If no such user exists, it returns None.
@@ -16,10 +18,11 @@ async def get_user_by_email(email: str, db: Session) -> User | None:
     :param db: Session: Pass the database session to the function
     :return: A user object or none if no user was found
     """
-    return db.query(User).filter(User.email == email).first()
+    result = await maybe_await(db.execute(select(User).filter(User.email == email)))
+    return result.scalars().first()
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def create_user(body: UserModel, db: DBSession) -> User:
     """
     The create_user function creates a new user in the database.
 
@@ -36,12 +39,12 @@ async def create_user(body: UserModel, db: Session) -> User:
 
     new_user = User(**body.dict(), avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await maybe_await(db.commit())
+    await maybe_await(db.refresh(new_user))
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session) -> None:
+async def update_token(user: User, token: str | None, db: DBSession) -> None:
     """
     The update_token function updates the refresh token for a user.
 
@@ -51,10 +54,11 @@ async def update_token(user: User, token: str | None, db: Session) -> None:
     :return: None
     """
     user.refresh_token = token
-    db.commit()
+    await maybe_await(db.commit())
+    await user_cache.invalidate(user.email)
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: DBSession) -> None:
     """
     The confirmed_email function takes in an email and a database session,
     and sets the confirmed field of the user with that email to True.
@@ -66,4 +70,22 @@ async def confirmed_email(email: str, db: Session) -> None:
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await maybe_await(db.commit())
+    await user_cache.invalidate(email)
+
+
+async def update_avatar(email: str, url: str, db: DBSession) -> User:
+    """
+    The update_avatar function sets the avatar URL of the user with that email.
+
+    :param email: str: Specify the email address of the user
+    :param url: str: The URL of the new avatar
+    :param db: Session: Pass in the database session
+    :return: The updated user
+    """
+    user = await get_user_by_email(email, db)
+    user.avatar = url
+    await maybe_await(db.commit())
+    await maybe_await(db.refresh(user))
+    await user_cache.invalidate(email)
+    return user
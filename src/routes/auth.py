@@ -1,27 +1,45 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
+import logging
+
+from fastapi import APIRouter, HTTPException, Depends, status, Security, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
 
-from src.database.conn_to_db import get_db
+from src.database.conn_to_db import DBSession, get_db
 from src.repository import users as repository_users
 from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
 from src.services.auth import auth_service
-from src.services.email import send_email
+from src.services.jobs import job_queue
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 security = HTTPBearer()
 
 
+async def queue_confirmation_email(user, host: str) -> bool:
+    """
+    The queue_confirmation_email function asks the job worker to send the confirmation email of a user.
+
+    :param user: User: The user to confirm
+    :param host: str: The base URL of the application, for the link in the email
+    :return: False if the job queue is unavailable and the email was not queued
+    """
+    try:
+        await job_queue.enqueue("send_email", email=user.email, username=user.username, host=host)
+    except RedisError as e:
+        logging.error("Confirmation email of %s not queued: %s", user.email, e)
+        return False
+    return True
+
+
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, request: Request, db: DBSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes a UserModel object as input, which is validated by pydantic.
         The password is hashed using Argon2 and stored in the database.
-        An email with an activation link is sent to the user's email address.
+        An email with an activation link is sent to the user's email address by the job worker.
+        The account is created even if the email cannot be queued, it can be sent again with request_email.
 
     :param body: UserModel: Get the user's email and password
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks
     :param request: Request: Get the base_url of the request
     :param db: Session: Get the database session
     :return: A user object, which is the same as what we get when we login
@@ -29,14 +47,14 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, str(request.base_url))
+    await queue_confirmation_email(new_user, str(request.base_url))
     return new_user
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: DBSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
         It takes the username and password from the request body,
@@ -51,7 +69,7 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
     # Generate JWT
     access_token = await auth_service.create_access_token(data={"sub": user.email})
@@ -61,7 +79,8 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        db: DBSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns an access_token, a new refresh_token, and the type of token.
@@ -85,7 +104,7 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(sec
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: DBSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         It takes the token from the URL and uses it to get the user's email address.
@@ -109,17 +128,16 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
 
 
 @router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+async def request_email(body: RequestEmail, request: Request,
+                        db: DBSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that will allow them
     to confirm their account. The function takes in a RequestEmail object, which contains the email of
     the user who wants to confirm their account. It then checks if there is already a confirmed user with
-    that email address, and if so returns an error message saying that they are already confirmed. If not, it sends
-    an email containing a confirmation link.
+    that email address, and if so returns an error message saying that they are already confirmed. If not, the job
+    worker sends an email containing a confirmation link, or 503 is returned if it cannot be queued.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
     :param db: Session: Get a database session
     :return: A message that tells the user to check their email for confirmation
@@ -128,6 +146,7 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
 
     if user.confirmed:
         return {"message": "Your email is already confirmed"}
-    if user:
-        background_tasks.add_task(send_email, user.email, user.username, str(request.base_url))
+    if user and not await queue_confirmation_email(user, str(request.base_url)):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Email cannot be sent now, try again later", headers={"Retry-After": "30"})
     return {"message": "Check your email for confirmation."}
@@ -1,95 +1,331 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Path, status, Query
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
-from src.database.conn_to_db import get_db
+from src.database.conn_to_db import DBSession, get_db, get_read_db
+from src.database.replicas import is_replica
 from src.database.models import User
 from src.repository import contacts as repository_contacts
-from src.schemas import ContactModel, ContactResponse
+from src.conf.config import settings
+from src.schemas import (ContactBatchItem, ContactBatchUpdate, ContactFileFormat, ContactModel, ContactResponse,
+                         ContactSort, ImportReport)
 from src.services.auth import auth_service
+from src.services.etag import contact_etag, etag_matches, not_modified, page_etag
+from src.services.exporter import MEDIA_TYPES, export_contacts
+from src.services.importer import CONTENT_TYPES, import_contacts
+from src.services.pagination import decode_cursor, encode_cursor
+from src.services.rate_limit import RateLimit
+from src.services.serialization import fast_response, to_content
+from src.services.response_cache import (contact_list_tag, contact_tag, json_entry, response_cache,
+                                         response_cache_key)
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-@router.get("/", response_model=List[ContactResponse], dependencies=[Depends(RateLimiter(times=2, seconds=5))],
+def replica_settle(db: DBSession) -> float:
+    # A replica may not have a write yet when its invalidation arrives, so its reads are not cached right after one
+    return settings.replica_sticky_seconds if is_replica(db) else 0
+
+
+def check_batch(ids: List[int]):
+    """
+    The check_batch function rejects batches larger than settings.batch_max_size or naming a contact twice.
+
+    :param ids: List[int]: The ids of the contacts in the batch
+    :return: None
+    """
+    if len(ids) > settings.batch_max_size:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"A batch holds at most {settings.batch_max_size} contacts")
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="A contact may appear only once in a batch")
+
+
+@router.get("/", response_model=List[ContactResponse], dependencies=[Depends(RateLimit("contacts_list"))],
             description="Two request on 5 second")
-async def get_contacts(limit: int = Query(10, le=300), offset: int = 0, db: Session = Depends(get_db)):
+async def get_contacts(request: Request, limit: int = Query(10, le=300), offset: int = 0,
+                       sort_by: ContactSort = ContactSort.id, after: str | None = None,
+                       if_none_match: str | None = Header(None), db: DBSession = Depends(get_read_db),
+                       current_user: User = Depends(auth_service.get_current_user)):
     """
-    The get_contacts function returns a list of contacts.
+    The get_contacts function returns a list of the contacts of the current user.
+    A full page carries an X-Next-Cursor header. Passing it back as after fetches the next page
+    by keyset pagination, in which case offset is ignored.
+    The page carries an ETag derived from the ids and versions on it. A request whose If-None-Match
+    still matches gets an empty 304; if the page is not cached this is checked with a query of those columns only.
+    Rendered pages are kept in the response cache until a contact is written.
+    The page is read from a read replica when one is configured.
 
+    :param request: Request: The request, the response cache is keyed by its query
     :param limit: int: Limit the number of contacts returned
     :param le: Limit the number of contacts returned to 300
     :param offset: int: Specify the number of records to skip
+    :param sort_by: ContactSort: Order contacts by id or by name
+    :param after: str | None: Opaque cursor of the last contact of the previous page
+    :param if_none_match: str | None: ETag of the page the client already has
+    :param db: Session: Pass the read-only database session to the repository
+    :param current_user: User: Get the current user from the auth_service
+    :return: A list of contacts
+    """
+    cache_key = response_cache_key(request, current_user.id)
+    key = None
+    if after is not None:
+        try:
+            key = decode_cursor(after, sort_by.value)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if if_none_match and cache_key not in response_cache:
+        rows = await repository_contacts.get_contact_versions(limit, offset, current_user.id, db, sort_by.value, key)
+        etag = page_etag(rows)
+        if etag_matches(if_none_match, etag):
+            headers = {}
+            if rows and len(rows) == limit:
+                headers["X-Next-Cursor"] = encode_cursor(sort_by.value, rows[-1].sort_key, rows[-1].id)
+            return not_modified(etag, headers)
+
+    async def load():
+        contacts = await repository_contacts.get_contacts(limit, offset, current_user.id, db, sort_by.value, key)
+        headers = {"ETag": page_etag(contacts)}
+        if contacts and len(contacts) == limit:
+            last = contacts[-1]
+            headers["X-Next-Cursor"] = encode_cursor(sort_by.value, getattr(last, sort_by.value), last.id)
+        return json_entry([to_content(ContactResponse, contact) for contact in contacts],
+                          tags=(contact_list_tag(current_user.id),), headers=headers)
+
+    entry = await response_cache.get_or_load(cache_key, load, settle=replica_settle(db))
+    if etag_matches(if_none_match, entry.headers["ETag"]):
+        return not_modified(entry.headers["ETag"], entry.headers)
+    return entry.response()
+
+
+@router.get("/search", response_model=List[ContactResponse])
+async def search_contacts(q: str = Query(min_length=3, max_length=100), limit: int = Query(10, le=100),
+                          offset: int = 0, db: DBSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The search_contacts function returns the contacts of the current user matching a search string, best matches first.
+    Every whitespace separated fragment of at least three characters must occur in the name, sure_name,
+    email, phone_number or additional_data of a contact.
+
+    :param q: str: The search string
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the number of matches to skip
+    :param db: Session: Pass the database session to the repository
+    :param current_user: User: Get the current user from the auth_service
+    :return: A list of contacts
+    """
+    contacts = await repository_contacts.search_contacts(q, limit, offset, current_user.id, db)
+    return fast_response(ContactResponse, contacts)
+
+
+@router.get("/birthdays", response_model=List[ContactResponse])
+async def get_upcoming_birthdays(days: int = Query(7, ge=1, le=366), limit: int = Query(100, le=300),
+                                 offset: int = 0, db: DBSession = Depends(get_db),
+                                 current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_upcoming_birthdays function returns the contacts of the current user with a birthday in the next days days,
+    from today to today + days - 1, ordered by the date of the birthday.
+
+    :param days: int: Size of the window in days, today included
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the number of records to skip
     :param db: Session: Pass the database session to the repository
+    :param current_user: User: Get the current user from the auth_service
     :return: A list of contacts
     """
-    contacts = await repository_contacts.get_contacts(limit, offset, db)
-    return contacts
+    contacts = await repository_contacts.get_upcoming_birthdays(days, limit, offset, current_user.id, db)
+    return fast_response(ContactResponse, contacts)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_contacts_file(format: ContactFileFormat = ContactFileFormat.ndjson, after_id: int = Query(0, ge=0),
+                               db: DBSession = Depends(get_db),
+                               current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The export_contacts_file function streams all contacts of the current user as a CSV or NDJSON file, in id order.
+    To resume an interrupted export, pass the id of the last contact received as after_id.
+
+    :param format: ContactFileFormat: Format of the file, csv or ndjson
+    :param after_id: int: Export only contacts with a greater id
+    :param db: Session: Pass the database session to the exporter
+    :param current_user: User: Get the current user from the auth_service
+    :return: A streaming response with the contacts
+    """
+    return StreamingResponse(export_contacts(format, after_id, current_user.id, db),
+                             media_type=MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f"attachment; filename=contacts.{format.value}"})
+
+
+@router.get("/batch", response_model=List[ContactBatchItem])
+async def get_contacts_batch(ids: List[int] = Query(), db: DBSession = Depends(get_read_db),
+                             current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_contacts_batch function returns the contacts of the current user with the given ids, read with one query.
+    Every id gets an entry, in the order of the request, with status 200 and the contact or status 404.
+
+    :param ids: List[int]: The ids of the contacts, e.g. ?ids=1&ids=2
+    :param db: Session: Pass the read-only database session to the repository
+    :param current_user: User: Get the current user from the auth_service
+    :return: One entry per id
+    """
+    check_batch(ids)
+    contacts = await repository_contacts.get_contacts_by_ids(ids, current_user.id, db)
+    return fast_response(ContactBatchItem, [
+        {"id": contact_id, "status": status.HTTP_200_OK, "contact": contacts[contact_id]} if contact_id in contacts
+        else {"id": contact_id, "status": status.HTTP_404_NOT_FOUND, "detail": "Not found!"} for contact_id in ids])
+
+
+@router.put("/batch", response_model=List[ContactBatchItem])
+async def update_contacts_batch(bodies: List[ContactBatchUpdate], db: DBSession = Depends(get_db),
+                                current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The update_contacts_batch function applies a list of updates to contacts of the current user in one transaction.
+    Every update gets an entry, in the order of the request: 200 with the updated contact, 404 if the contact
+    does not exist or 409 if its email or phone number belongs to another contact.
+    Failed updates do not stop the others.
+
+    :param bodies: List[ContactBatchUpdate]: The updates, each with the id of its contact
+    :param db: Session: Pass the database session to the repository
+    :param current_user: User: Get the current user from the auth_service
+    :return: One entry per update
+    """
+    check_batch([body.id for body in bodies])
+    if not bodies:
+        return []
+    return await repository_contacts.update_many(bodies, current_user.id, db)
+
+
+@router.delete("/batch", response_model=List[ContactBatchItem])
+async def delete_contacts_batch(ids: List[int] = Query(), db: DBSession = Depends(get_db),
+                                current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The delete_contacts_batch function deletes contacts of the current user with one statement and one commit.
+    Every id gets an entry, in the order of the request, with status 204 if it was deleted or 404.
+
+    :param ids: List[int]: The ids of the contacts, e.g. ?ids=1&ids=2
+    :param db: Session: Pass the database session to the repository
+    :param current_user: User: Get the current user from the auth_service
+    :return: One entry per id
+    """
+    check_batch(ids)
+    return await repository_contacts.delete_many(ids, current_user.id, db)
 
 
 @router.get("/{contact_id}", response_model=ContactResponse)
-async def get_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db)):
+async def get_contact(request: Request, contact_id: int = Path(ge=1), if_none_match: str | None = Header(None),
+                      db: DBSession = Depends(get_read_db),
+                      current_user: User = Depends(auth_service.get_current_user)):
     """
-    The get_contact function returns a contact by its id.
+    The get_contact function returns a contact of the current user by its id, with an ETag derived from its version.
+    If the If-None-Match header still matches, an empty 304 is returned and the contact is not serialized:
+    when it is not cached, only its version is read to compare the ETag.
+    The rendered contact is kept in the response cache until it is written.
+    The contact is read from a read replica when one is configured.
 
+    :param request: Request: The request, the response cache is keyed by its path
     :param contact_id: int: Get the contact id from the url path
-    :param db: Session: Pass the database session to the function
+    :param if_none_match: str | None: ETag of the contact the client already has
+    :param db: Session: Pass the read-only database session to the function
+    :param current_user: User: Get the current user from the auth_service
     :return: A contact object
     """
-    contact = await repository_contacts.get_contact_by_id(contact_id, db)
-    if contact is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
-    return contact
+    cache_key = response_cache_key(request, current_user.id)
+    if if_none_match and cache_key not in response_cache:
+        version = await repository_contacts.get_contact_version(contact_id, current_user.id, db)
+        if version is not None and etag_matches(if_none_match, contact_etag(contact_id, version)):
+            return not_modified(contact_etag(contact_id, version))
+
+    async def load():
+        contact = await repository_contacts.get_contact_by_id(contact_id, current_user.id, db)
+        if contact is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+        return json_entry(to_content(ContactResponse, contact), tags=(contact_tag(contact.id),),
+                          headers={"ETag": contact_etag(contact.id, contact.version)})
+
+    entry = await response_cache.get_or_load(cache_key, load, settle=replica_settle(db))
+    if etag_matches(if_none_match, entry.headers["ETag"]):
+        return not_modified(entry.headers["ETag"])
+    return entry.response()
 
 
 @router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED, )
-async def create_contact(body: ContactModel, db: Session = Depends(get_db),
-                         _: User = Depends(auth_service.get_current_user)):
+async def create_contact(body: ContactModel, response: Response, db: DBSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
     """
-    The create_contact function creates a new contact in the database.
+    The create_contact function creates a new contact of the current user in the database.
 
     :param body: ContactModel: Get the data from the request body
+    :param response: Response: Set the ETag header
     :param db: Session: Get the database session
-    :param _: User: Get the current user from the auth_service
+    :param current_user: User: Get the current user from the auth_service
     :return: The contact object that was created
     """
-    contact = await repository_contacts.create(body, db)
+    contact = await repository_contacts.create(body, current_user.id, db)
+    response.headers["ETag"] = contact_etag(contact.id, contact.version)
     return contact
 
 
+@router.post("/import", response_model=ImportReport)
+async def import_contacts_file(request: Request, format: ContactFileFormat | None = None,
+                               batch_size: int = Query(settings.import_batch_size, ge=1, le=2000),
+                               db: DBSession = Depends(get_db),
+                               current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The import_contacts_file function creates or updates contacts of the current user from a CSV or NDJSON file
+    sent as the request body.
+    The body is parsed while it streams in and stored in batches; contacts with an email that already
+    exists are updated. The format comes from the format parameter or else from the Content-Type header.
+
+    :param request: Request: Read the body as a stream
+    :param format: ContactFileFormat | None: Format of the body, csv or ndjson
+    :param batch_size: int: Number of contacts stored per statement
+    :param db: Session: Pass the database session to the repository
+    :param current_user: User: Get the current user from the auth_service
+    :return: A report with the number of stored and rejected rows and the error of each rejected row
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    fmt = format or CONTENT_TYPES.get(content_type)
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Send text/csv or application/x-ndjson, or set the format parameter")
+    return await import_contacts(request.stream(), fmt, batch_size, current_user.id, db)
+
+
 @router.put("/{contact_id}", response_model=ContactResponse)
-async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: Session = Depends(get_db),
-                         _: User = Depends(auth_service.get_current_user)):
+async def update_contact(body: ContactModel, response: Response, contact_id: int = Path(ge=1),
+                         db: DBSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
-    The update_contact function updates a contact in the database.
+    The update_contact function updates a contact of the current user in the database.
 
     :param body: ContactModel: Validate the json body of the request
+    :param response: Response: Set the ETag header of the new version
     :param contact_id: int: Specify the id of the contact to be deleted
     :param db: Session: Pass the database session to the repository layer
-    :param _: User: Get the current user from the auth_service
+    :param current_user: User: Get the current user from the auth_service
     :return: The updated contact
     """
-    contact = await repository_contacts.update(contact_id, body, db)
+    contact = await repository_contacts.update(contact_id, body, current_user.id, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
+    response.headers["ETag"] = contact_etag(contact.id, contact.version)
     return contact
 
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db),
-                         _: User = Depends(auth_service.get_current_user)):
+async def delete_contact(contact_id: int = Path(ge=1), db: DBSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
     """
-    The delete_contact function deletes a contact from the database.
+    The delete_contact function deletes a contact of the current user from the database.
         It takes in an integer representing the id of the contact to be deleted, and returns None.
 
     :param contact_id: int: Get the contact id from the path
     :param db: Session: Pass the database session to the repository layer
-    :param _: User: Get the current user from the auth_service
+    :param current_user: User: Get the current user from the auth_service
     :return: None
     """
-    contact = await repository_contacts.delete(contact_id, db)
+    contact = await repository_contacts.delete(contact_id, current_user.id, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found!")
     return None
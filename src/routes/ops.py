@@ -0,0 +1,115 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from src.conf.config import settings
+from src.database.conn_to_db import engine, read_replicas, replica_engines
+from src.schemas import CachedUser, ProfilingSettings
+from src.services.auth import auth_service
+from src.services.cache import token_cache, user_cache
+from src.services.hashing import password_hasher
+from src.services.jobs import job_queue
+from src.services.profiling import sql_profiler
+from src.services.rate_limit import rate_limiter
+from src.services.response_cache import response_cache
+
+router = APIRouter(prefix="/ops", tags=["ops"])
+
+
+async def get_operator(current_user: CachedUser = Depends(auth_service.get_current_user)) -> CachedUser:
+    """
+    The get_operator function is a dependency that lets only the users listed in ops_admin_emails through.
+    The ops routes expose SQL text and change the profiling of every worker, signing up is not enough for them.
+
+    :param current_user: CachedUser: Get the current user from the auth_service
+    :return: The current user
+    """
+    if current_user.email.lower() not in {email.lower() for email in settings.ops_admin_emails}:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operators only")
+    return current_user
+
+
+@router.get("/cache")
+async def cache_stats(_: CachedUser = Depends(get_operator)):
+    """
+    The cache_stats function reports the hit and miss counters of the in-process caches of this worker,
+    which is what the cache sizes in Settings are tuned from.
+
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: A dict with the stats of each cache
+    """
+    return {"user_cache": user_cache.stats(), "token_cache": token_cache.stats(),
+            "response_cache": response_cache.stats()}
+
+
+@router.get("/hashing")
+async def hashing_stats(_: CachedUser = Depends(get_operator)):
+    """
+    The hashing_stats function reports the load of the password hashing pool of this worker.
+    A growing rejected counter means password_hash_workers or password_hash_queue is too small.
+
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: A dict with the stats of the pool
+    """
+    return {"password_hash": password_hasher.stats()}
+
+
+@router.get("/pool")
+async def pool_stats(_: CachedUser = Depends(get_operator)):
+    """
+    The pool_stats function reports the database connection pools of this worker: their size, the connections
+    in use and in overflow, and how long checkouts waited. Multiplied by the worker count, size and max_overflow
+    must stay below the connection limit of the database.
+
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: A dict with the stats of the pool of the primary and of each read replica
+    """
+    return {"primary": engine.pool.stats(), "replicas": [replica.pool.stats() for replica in replica_engines],
+            "routing": read_replicas.stats()}
+
+
+@router.get("/rate-limit")
+async def rate_limit_stats(_: CachedUser = Depends(get_operator)):
+    """
+    The rate_limit_stats function reports the rate limiter of this worker: the buckets it holds,
+    the requests it allowed and rejected, and how its syncs with Redis went.
+
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: A dict with the stats of the rate limiter
+    """
+    return rate_limiter.stats()
+
+
+@router.get("/jobs")
+async def job_stats(_: CachedUser = Depends(get_operator)):
+    """
+    The job_stats function reports the depth of the job queue: jobs waiting for a worker, running or left behind
+    by a worker that died, waiting for a retry, and dead. A growing ready count means more workers are needed.
+
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: A dict with the number of jobs by state
+    """
+    return await job_queue.depth()
+
+
+@router.get("/profiling")
+async def profiling_stats(_: CachedUser = Depends(get_operator)):
+    """
+    The profiling_stats function reports the SQL profiler settings of this worker, its counters
+    and the last requests flagged as N+1.
+
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: A dict with the settings and counters of the profiler
+    """
+    return sql_profiler.stats()
+
+
+@router.put("/profiling")
+async def update_profiling(body: ProfilingSettings, _: CachedUser = Depends(get_operator)):
+    """
+    The update_profiling function turns SQL profiling on or off, or changes its thresholds, on every worker
+    without a restart. Fields left out keep their current value.
+
+    :param body: ProfilingSettings: The settings to change
+    :param _: CachedUser: Allow operators only, see get_operator
+    :return: The resulting settings
+    """
+    return await sql_profiler.update(**body.dict(exclude_none=True))
@@ -1,45 +1,50 @@
-from fastapi import APIRouter, Depends, UploadFile, File
+from fastapi import APIRouter, Depends, Request
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
 
-from src.database.conn_to_db import get_db
-from src.database.models import User
+from src.conf.config import settings
+from src.database.conn_to_db import DBSession, get_db
 from src.repository import users as repository_users
-from src.schemas import UserResponse
+from src.schemas import CachedUser, UserResponse
 from src.services.auth import auth_service
-from src.services.upload_avatar import UploadService
+from src.services.avatars import avatar_pipeline, read_upload
+from src.services.serialization import fast_response
 
 router = APIRouter(prefix="/users_prof", tags=["users_prof"])
 templates = Jinja2Templates(directory='templates')
+# The avatar body is parsed by the route itself, this documents it
+AVATAR_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["avatar"], "properties": {"avatar": {"type": "string", "format": "binary"}}}}}}}
 
 
 @router.get("/me/", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
+async def read_users_me(current_user: CachedUser = Depends(auth_service.get_current_user)):
     """
     The read_users_me function is a GET endpoint that returns the current user's information.
     It uses the auth_service to get the current user, and then returns it.
 
-    :param current_user: User: Get the current user
+    :param current_user: CachedUser: Get the current user
     :return: The current_user object
     """
-    return current_user
+    return fast_response(UserResponse, current_user)
 
 
-@router.patch('/avatar', response_model=UserResponse)
-async def update_avatar_user(avatar: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+@router.patch('/avatar', response_model=UserResponse, openapi_extra=AVATAR_BODY)
+async def update_avatar_user(request: Request, current_user: CachedUser = Depends(auth_service.get_current_user),
+                             db: DBSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
+    The image is sent as the avatar field of a multipart/form-data body and read as it streams in.
+    It is stored as a square JPEG, see AvatarPipeline; sending the current avatar again changes nothing.
 
-    :param avatar: UploadFile: Receive the file sent by the user
-    :param current_user: User: Get the current user from the database
+    :param request: Request: Read the body as a stream
+    :param current_user: CachedUser: Get the current user from the database
     :param db: Session: Access the database
     :return: A user object
     """
-    public_id = UploadService.create_name_avatar(current_user.email, 'web10')
-
-    r = UploadService.upload(avatar.file, public_id)
-
-    src_url = UploadService.get_url_avatar(public_id, r.get('version'))
+    data, digest = await read_upload(request.stream(), request.headers.get("content-type", ""), "avatar",
+                                     settings.avatar_max_bytes)
+    if avatar_pipeline.url(digest) == current_user.avatar:
+        return current_user
+    src_url = await avatar_pipeline.store(data, digest)
     user = await repository_users.update_avatar(current_user.email, src_url, db)
     return user
@@ -1,4 +1,17 @@
-from pydantic import BaseModel, EmailStr, Field
+from datetime import datetime
+from enum import Enum
+
+from pydantic import BaseModel, EmailStr, Field, validator
+
+
+class ContactSort(str, Enum):
+    id = "id"
+    name = "name"
+
+
+class ContactFileFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
 
 
 class ContactModel(BaseModel):
@@ -6,9 +19,17 @@ class ContactModel(BaseModel):
     sure_name: str = Field('Dilan', min_length=3, max_length=16)
     email: EmailStr
     phone_number: str = Field('+3801112233', min_length=9, max_length=16)
-    birthday: str = Field('184-03-09')
+    birthday: str = Field('1984-03-09')
     additional_data: str
 
+    @validator('birthday')
+    def birthday_is_date(cls, v):
+        try:
+            datetime.strptime(v, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("birthday must be a date in the YYYY-MM-DD format")
+        return v
+
 
 class ContactResponse(BaseModel):
     id: int = 1
@@ -23,6 +44,29 @@ class ContactResponse(BaseModel):
         orm_mode = True
 
 
+class ContactBatchUpdate(ContactModel):
+    id: int = Field(ge=1)
+
+
+class ContactBatchItem(BaseModel):
+    id: int
+    status: int
+    detail: str | None = None
+    contact: ContactResponse | None = None
+
+
+class ImportRowError(BaseModel):
+    row: int
+    detail: str
+
+
+class ImportReport(BaseModel):
+    processed: int
+    upserted: int
+    failed: int
+    errors: list[ImportRowError]
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=12)
     email: EmailStr
@@ -39,6 +83,17 @@ class UserResponse(BaseModel):
         orm_mode = True
 
 
+class CachedUser(BaseModel):
+    id: int
+    username: str | None
+    email: str
+    avatar: str | None
+    confirmed: bool | None
+
+    class Config:
+        orm_mode = True
+
+
 class TokenModel(BaseModel):
     access_token: str
     refresh_token: str
@@ -47,3 +102,9 @@ class TokenModel(BaseModel):
 
 class RequestEmail(BaseModel):
     email: EmailStr
+
+
+class ProfilingSettings(BaseModel):
+    enabled: bool | None = None
+    slow_query_ms: float | None = Field(None, ge=0)
+    n_plus_one_threshold: int | None = Field(None, ge=2)
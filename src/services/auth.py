@@ -1,49 +1,49 @@
-import pickle
 from typing import Optional
 
-import redis
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
 from src.conf.config import settings
 
-from src.database.conn_to_db import get_db
+from src.database.conn_to_db import DBSession, get_db
 from src.repository import users as repository_users
+from src.services.cache import token_cache, user_cache
+from src.services.hashing import password_hasher
 
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
     SECRET_KEY = settings.jwt_secret_key
     ALGORITHM = settings.jwt_algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
 
-    def verify_password(self, plain_password, hashed_password):
+    async def verify_password(self, plain_password, hashed_password):
         """
         The verify_password function takes a plain-text password and hashed
         password as arguments. It then uses the pwd_context object to verify that the
         plain-text password matches the hashed one.
+        bcrypt runs on the password_hasher pool, which raises 503 when it is saturated.
 
         :param self: Make the function a method of the user class
         :param plain_password: Pass in the password that the user enters when they log in
         :param hashed_password: Check if the password is correct
         :return: True if the password is correct, and false otherwise
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await password_hasher.run(self.pwd_context.verify, plain_password, hashed_password)
 
-    def get_password_hash(self, password: str):
+    async def get_password_hash(self, password: str):
         """
         The get_password_hash function takes a password as input and returns the hash of that password.
-        The hash is generated using the pwd_context object, which is an instance of Flask-Bcrypt's Bcrypt class.
+        The hash is generated using the pwd_context object with settings.bcrypt_rounds rounds,
+        on the password_hasher pool so the event loop keeps serving other requests.
 
         :param self: Represent the instance of the class
         :param password: str: Define the password that will be hashed
         :return: A hash of the password
         """
-        return self.pwd_context.hash(password)
+        return await password_hasher.run(self.pwd_context.hash, password)
 
     # define a function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
@@ -110,16 +110,36 @@ class Auth:
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    def token_claims(self, token: str) -> dict | None:
+        """
+        The token_claims function returns the claims of a token if its signature is valid and it has not expired.
+        A token verified before skips the signature check: its claims are kept in token_cache until it expires.
+
+        :param self: Access the class attributes
+        :param token: str: A JWT
+        :return: The claims of the token, or None if it is invalid
+        """
+        payload = token_cache.get(token)
+        if payload is None:
+            try:
+                # Decode JWT
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            except JWTError:
+                return None
+            token_cache.set(token, payload)
+        return payload
+
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_db)):
         """
         The get_current_user function is a dependency that will be used in the
             protected endpoints. It takes a token as an argument and returns the user
             if it's valid, otherwise raises an HTTPException with status code 401.
+            The claims of verified tokens are kept in token_cache until the token expires.
 
         :param self: Access the class attributes
         :param token: str: Get the token from the header
         :param db: Session: Get the database session from the dependency
-        :return: The user object, which is a dictionary
+        :return: The cached fields of the user
         """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -127,27 +147,20 @@ class Auth:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
-        except JWTError as e:
+        # The scope is checked on every request, the signature only once per token
+        payload = self.token_claims(token)
+        if payload is None or payload.get('scope') != 'access_token':
+            raise credentials_exception
+        email = payload.get("sub")
+        if email is None:
             raise credentials_exception
 
-        user = self.r.get(f"user:{email}")
+        user = await user_cache.get(email)
         if user is None:
             user = await repository_users.get_user_by_email(email, db)
             if user is None:
                 raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            user = await user_cache.set(user)
         return user
 
     def create_email_token(self, data: dict):
@@ -0,0 +1,178 @@
+import hashlib
+import io
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+from multipart.multipart import MultipartParser, parse_options_header
+from PIL import Image, ImageOps
+
+from src.conf.config import settings
+from src.services.hashing import BoundedExecutor
+from src.services.storage import AvatarStorage, avatar_storage
+
+
+class _FieldReader:
+    """
+    Callbacks of the multipart parser that keep the content of one field and skip the other parts.
+    """
+
+    def __init__(self, field: str, max_bytes: int):
+        self.field = field.encode()
+        self.max_bytes = max_bytes
+        self.data = bytearray()
+        self.digest = hashlib.sha256()
+        self.found = False
+        self._header = b""
+        self._value = b""
+        self._wanted = False
+
+    def on_part_begin(self):
+        self._wanted = False
+
+    # A header may come in pieces when it spans chunks
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        if self._header.lower() == b"content-disposition":
+            _, options = parse_options_header(self._value)
+            self._wanted = not self.found and options.get(b"name") == self.field
+            self.found = self.found or self._wanted
+        self._header, self._value = b"", b""
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self._wanted:
+            return
+        if len(self.data) + end - start > self.max_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"The image is larger than {self.max_bytes} bytes")
+        chunk = data[start:end]
+        self.data += chunk
+        self.digest.update(chunk)
+
+
+async def read_upload(chunks: AsyncIterator[bytes], content_type: str, field: str,
+                      max_bytes: int) -> tuple[bytes, str]:
+    """
+    The read_upload function reads one file of a multipart/form-data body as the chunks arrive, without spooling
+    the body to a temporary file: the file is kept in memory up to max_bytes and hashed on the way,
+    the other fields are dropped.
+
+    :param chunks: AsyncIterator[bytes]: The body of the request
+    :param content_type: str: The Content-Type header of the request, with the boundary
+    :param field: str: The name of the file field
+    :param max_bytes: int: Largest file accepted, a larger one is rejected with 413 as soon as it goes past it
+    :return: The content of the file and its SHA-256 in hex
+    """
+    media_type, options = parse_options_header(content_type)
+    if media_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Send the image as multipart/form-data")
+    reader = _FieldReader(field, max_bytes)
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": reader.on_part_begin,
+        "on_header_field": reader.on_header_field,
+        "on_header_value": reader.on_header_value,
+        "on_header_end": reader.on_header_end,
+        "on_part_data": reader.on_part_data,
+    })
+    async for chunk in chunks:
+        parser.write(chunk)
+    parser.finalize()
+    if not reader.found or not reader.data:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"No file in the {field} field")
+    return bytes(reader.data), reader.digest.hexdigest()
+
+
+def render_avatar(data: bytes, size: int, quality: int, max_pixels: int) -> bytes:
+    """
+    The render_avatar function turns an uploaded image into a square JPEG avatar: it is turned upright
+    by its EXIF orientation, cropped to the center and resized to size x size. It runs in the avatar worker processes.
+
+    :param data: bytes: The uploaded image, in any format Pillow reads
+    :param size: int: Width and height of the avatar in pixels
+    :param quality: int: JPEG quality, 1 to 95
+    :param max_pixels: int: Largest image decoded, width times height
+    :return: The JPEG image
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # Only the header is read so far, a small file can declare a huge image
+        if image.width * image.height > max_pixels:
+            raise ValueError(f"The image has more than {max_pixels} pixels")
+        # A JPEG is decoded at a fraction of its size that is still at least size x size, which is much faster
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        image = ImageOps.fit(image.convert("RGB"), (size, size), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class AvatarPipeline:
+    """
+    Turns uploads into stored avatars. An avatar is keyed by the hash of the uploaded file and the size,
+    so an upload that was stored before, by any user, is neither processed nor written again.
+    The images are processed in worker processes, which keeps the event loop and the GIL free.
+    """
+
+    def __init__(self, storage: AvatarStorage, processor: BoundedExecutor, size: int, quality: int,
+                 max_pixels: int):
+        self.storage = storage
+        self.processor = processor
+        self.size = size
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.processed = 0
+        self.reused = 0
+
+    def key(self, digest: str) -> str:
+        return f"{digest[:2]}/{digest}-{self.size}.jpg"
+
+    def url(self, digest: str) -> str:
+        """
+        The url function returns the URL the avatar of an upload has or will have once stored.
+
+        :param self: Represent the instance of the class
+        :param digest: str: The SHA-256 of the uploaded file
+        :return: The URL
+        """
+        return self.storage.url(self.key(digest))
+
+    async def store(self, data: bytes, digest: str) -> str:
+        """
+        The store function processes an upload and writes the avatar, unless the storage has it already.
+
+        :param self: Represent the instance of the class
+        :param data: bytes: The uploaded file
+        :param digest: str: Its SHA-256, see read_upload
+        :return: The URL of the avatar
+        """
+        key = self.key(digest)
+        if await self.storage.exists(key):
+            self.reused += 1
+            return self.storage.url(key)
+        try:
+            image = await self.processor.run(render_avatar, data, self.size, self.quality, self.max_pixels)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # UnidentifiedImageError and truncated files are OSErrors
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=f"The file is not a usable image: {e}")
+        await self.storage.save(key, image, "image/jpeg")
+        self.processed += 1
+        return self.storage.url(key)
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "reused": self.reused, "pool": self.processor.stats()}
+
+
+avatar_processor = BoundedExecutor(settings.avatar_workers, settings.avatar_queue, "avatar", processes=True)
+avatar_pipeline = AvatarPipeline(avatar_storage, avatar_processor, size=settings.avatar_size,
+                                 quality=settings.avatar_quality, max_pixels=settings.avatar_max_pixels)
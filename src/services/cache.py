@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.schemas import CachedUser
+from src.services.redis_pool import get_redis, listen_to_channel
+
+USER_CACHE_VERSION = 1
+USER_INVALIDATION_CHANNEL = "user-cache:invalidate"
+
+
+class LRUCache:
+    """
+    A bounded in-process cache. The least recently used entry is evicted when it is full,
+    and every entry expires ttl seconds after it was stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        The get function returns the cached value for a key, or None if it is missing or expired.
+
+        :param self: Represent the instance of the class
+        :param key: The cache key
+        :return: The cached value or None
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl: float | None = None):
+        """
+        The set function stores a value, evicting the least recently used entry if the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: The cache key
+        :param value: The value to store
+        :param ttl: float | None: Lifetime of the entry in seconds, defaults to the ttl of the cache
+        :return: None
+        """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        The delete function drops the entry for a key if there is one.
+
+        :param self: Represent the instance of the class
+        :param key: The cache key
+        :return: None
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[object], bool]) -> int:
+        """
+        The delete_where function drops every entry whose value matches the predicate.
+        It scans the whole cache, so it is meant for rare events such as revocations.
+
+        :param self: Represent the instance of the class
+        :param predicate: Callable[[object], bool]: Returns True for the values to drop
+        :return: The number of dropped entries
+        """
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the size of the cache and how often it was hit.
+
+        :param self: Represent the instance of the class
+        :return: A dict with size, maxsize, hits, misses and hit_ratio
+        """
+        lookups = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+
+class UserCache:
+    """
+    Two-tier cache of the authenticated user: a per-worker LRUCache in front of Redis.
+    Only the fields the routes need are cached, as version-tagged JSON, so a change of
+    CachedUser never reads entries written by an older version.
+    Writes to a user must call invalidate, which also tells the other workers to drop their copy.
+    """
+
+    def __init__(self, get_client: Callable[[], redis.Redis], maxsize: int, ttl: float, redis_ttl: int):
+        self.get_client = get_client
+        self.redis_ttl = redis_ttl
+        self.local = LRUCache(maxsize, ttl)
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        self.invalidations = 0
+        self.subscribers: list[Callable[[str], None]] = []
+        self._listener = None
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:v{USER_CACHE_VERSION}:{email}"
+
+    async def get(self, email: str) -> CachedUser | None:
+        """
+        The get function looks the user up in the local cache, then in Redis.
+        A Redis hit is copied into the local cache. Redis errors count as a miss.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: The cached user or None
+        """
+        user = self.local.get(email)
+        if user is not None:
+            return user
+        try:
+            raw = await self.get_client().get(self.key(email))
+        except RedisError as e:
+            self.redis_errors += 1
+            logging.warning("User cache read failed: %s", e)
+            raw = None
+        data = json.loads(raw) if raw else None
+        if data is None or data.pop("v", None) != USER_CACHE_VERSION:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        user = CachedUser.construct(**data)
+        self.local.set(email, user)
+        return user
+
+    async def set(self, user) -> CachedUser:
+        """
+        The set function stores the cached fields of a user in both tiers, with a single SET EX round trip to Redis.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user loaded from the database
+        :return: The cached representation of the user
+        """
+        cached = CachedUser.from_orm(user)
+        self.local.set(cached.email, cached)
+        try:
+            await self.get_client().set(self.key(cached.email),
+                                        json.dumps({"v": USER_CACHE_VERSION, **cached.dict()}), ex=self.redis_ttl)
+        except RedisError as e:
+            self.redis_errors += 1
+            logging.warning("User cache write failed: %s", e)
+        return cached
+
+    async def invalidate(self, email: str):
+        """
+        The invalidate function drops a user from both tiers and asks the other workers to drop it too.
+        The delete and the publish go to Redis as one pipeline.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user that changed
+        :return: None
+        """
+        self.invalidations += 1
+        self._drop(email)
+        try:
+            pipe = self.get_client().pipeline(transaction=False)
+            pipe.delete(self.key(email))
+            pipe.publish(USER_INVALIDATION_CHANNEL, email)
+            await pipe.execute()
+        except RedisError as e:
+            self.redis_errors += 1
+            logging.warning("User cache invalidation failed: %s", e)
+
+    def listen(self):
+        """
+        The listen function starts a background task that applies invalidations published by other workers.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        # Entries cached while unsubscribed may have missed an invalidation
+        await listen_to_channel(self.get_client, USER_INVALIDATION_CHANNEL, self._on_invalidate,
+                                on_subscribe=self.local.clear)
+
+    def _on_invalidate(self, message):
+        email = message["data"]
+        self._drop(email.decode() if isinstance(email, bytes) else email)
+
+    def _drop(self, email: str):
+        self.local.delete(email)
+        for subscriber in self.subscribers:
+            subscriber(email)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the hit and miss counters of both tiers.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the local cache stats and the Redis counters
+        """
+        return {"local": self.local.stats(), "redis_hits": self.redis_hits, "redis_misses": self.redis_misses,
+                "redis_errors": self.redis_errors, "invalidations": self.invalidations}
+
+
+class TokenCache:
+    """
+    Per-worker cache of the claims of access tokens whose signature was already verified,
+    so a token that is used again skips jwt.decode. Entries are keyed by the SHA-256 of the token
+    and expire at the exp claim of the token. Only tokens that passed verification are stored.
+    """
+
+    def __init__(self, maxsize: int):
+        self.local = LRUCache(maxsize, ttl=0)
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        return self.local.get(self.key(token))
+
+    def set(self, token: str, claims: dict):
+        """
+        The set function stores the verified claims of a token until the token expires.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :param claims: dict: The claims returned by jwt.decode
+        :return: None
+        """
+        ttl = claims.get("exp", 0) - time.time()
+        if ttl > 0:
+            self.local.set(self.key(token), {"sub": claims.get("sub"), "scope": claims.get("scope")}, ttl=ttl)
+
+    def revoke(self, email: str):
+        """
+        The revoke function drops the cached tokens of a user, so their next use is verified again.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user, the sub claim of the tokens
+        :return: None
+        """
+        self.local.delete_where(lambda claims: claims["sub"] == email)
+
+    def stats(self) -> dict:
+        return self.local.stats()
+
+
+user_cache = UserCache(get_redis, maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl,
+                       redis_ttl=settings.user_cache_redis_ttl)
+token_cache = TokenCache(maxsize=settings.token_cache_size)
+# A change of the user, such as a new refresh token, also drops the cached tokens of the user
+user_cache.subscribers.append(token_cache.revoke)
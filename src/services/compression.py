@@ -0,0 +1,169 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli is an optional extra, without it only gzip is offered
+    brotli = None
+
+# Encodings in order of preference, br compresses JSON better than gzip at a similar cost
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+NOT_COMPRESSED_STATUSES = {204, 206, 304}
+
+
+class GzipCompressor:
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        # A sync flush sends what was compressed so far, so a streamed body reaches the client chunk by chunk
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliCompressor:
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.process(data) + (self._compressor.finish() if final else self._compressor.flush())
+
+
+COMPRESSORS = {"gzip": GzipCompressor, "br": BrotliCompressor}
+
+
+def accepted_encoding(accept_encoding: str, encodings: tuple[str, ...] = ENCODINGS) -> str | None:
+    """
+    The accepted_encoding function picks the encoding of a response: the first of encodings,
+    in order of preference, that the Accept-Encoding header of the request allows.
+    An encoding the header does not name is allowed by *, and q=0 refuses an encoding.
+
+    :param accept_encoding: str: The Accept-Encoding header of the request
+    :param encodings: tuple[str, ...]: The encodings the server supports, in order of preference
+    :return: The encoding, or None to send the body as it is
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip():
+            qualities[name.strip().lower()] = quality
+    for encoding in encodings:
+        if qualities.get(encoding, qualities.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    The encoded_etag function returns the ETag of the compressed representation of a response.
+    A strong ETag promises byte-identical bodies, so the compressed body needs a tag of its own.
+    Weak ETags only promise equivalent content and are kept.
+
+    :param etag: str: The ETag of the uncompressed response
+    :param encoding: str: The content encoding
+    :return: The ETag of the compressed response
+    """
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def decoded_etags(if_none_match: str, encoding: str) -> str:
+    """
+    The decoded_etags function maps the tags of an If-None-Match header that name the compressed
+    representation back to the ETags the routes compute, see encoded_etag.
+
+    :param if_none_match: str: The If-None-Match header of the request
+    :param encoding: str: The content encoding of the response
+    :return: The header with the encoding suffix removed from its tags
+    """
+    suffix = f'-{encoding}"'
+    return ", ".join(tag[:-len(suffix)] + '"' if tag.endswith(suffix) else tag
+                     for tag in (tag.strip() for tag in if_none_match.split(",")))
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses response bodies with the best encoding the client accepts.
+    Only bodies of the allowed content types and of at least minimum_size bytes are compressed.
+    A streamed body, e.g. an export, is compressed chunk by chunk as it is sent and never buffered;
+    its length is unknown upfront, so it is compressed unless it declares a smaller Content-Length.
+    """
+
+    def __init__(self, app, minimum_size: int, content_types: list[str], levels: dict[str, int]):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = set(content_types)
+        self.levels = levels
+
+    def _compressible(self, start: dict, headers: Headers, body: bytes, more_body: bool) -> bool:
+        if start["status"] < 200 or start["status"] in NOT_COMPRESSED_STATUSES or "content-encoding" in headers:
+            return False
+        if headers.get("content-type", "").split(";")[0].strip().lower() not in self.content_types:
+            return False
+        if not more_body:
+            return len(body) >= self.minimum_size
+        return int(headers.get("content-length", self.minimum_size)) >= self.minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = accepted_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = MutableHeaders(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        # A client revalidating the compressed representation gets its tag back on a 304
+        encoded_validator = bool(if_none_match) and decoded_etags(if_none_match, encoding) != if_none_match
+        if encoded_validator:
+            request_headers["if-none-match"] = decoded_etags(if_none_match, encoding)
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=list(start["headers"]))
+                if self._compressible(start, headers, body, more_body):
+                    compressor = COMPRESSORS[encoding](self.levels[encoding])
+                    headers["content-encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    if "etag" in headers:
+                        headers["etag"] = encoded_etag(headers["etag"], encoding)
+                    if more_body:
+                        del headers["content-length"]
+                    else:
+                        body = compressor.compress(body, final=True)
+                        headers["content-length"] = str(len(body))
+                        compressor = None
+                        message = {**message, "body": body}
+                elif start["status"] == 304 and encoded_validator and "etag" in headers:
+                    headers["etag"] = encoded_etag(headers["etag"], encoding)
+                await send({**start, "headers": headers.raw})
+                start = None
+            if compressor is not None:
+                message = {**message, "body": compressor.compress(body, final=not more_body)}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -1,28 +1,147 @@
-import logging
+import asyncio
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
+from typing import Callable
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import aiosmtplib
+from aiosmtplib import SMTPException, SMTPServerDisconnected
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import EmailStr
 
 from src.conf.config import settings
 from src.services.auth import auth_service
+from src.services.jobs import job_handler
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_from),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Cat System Corporation",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+# The templates never change while the app runs, they are compiled once here and not checked on disk again
+template_env = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'),
+                           autoescape=select_autoescape(["html"]), auto_reload=False)
+TEMPLATES = {name: template_env.get_template(name) for name in template_env.list_templates()}
 
 
+def build_message(recipient: str, subject: str, template_name: str, **context) -> EmailMessage:
+    """
+    The build_message function renders an HTML email from one of the compiled templates.
+
+    :param recipient: str: The email address to send the message to
+    :param subject: str: The subject of the message
+    :param template_name: str: The file name of the template in the templates folder
+    :param context: The variables of the template
+    :return: The message
+    """
+    message = EmailMessage()
+    message["From"] = formataddr((settings.mail_from_name, settings.mail_from))
+    message["To"] = recipient
+    message["Subject"] = subject
+    message.set_content(TEMPLATES[template_name].render(**context), subtype="html")
+    return message
+
+
+def connect_smtp() -> aiosmtplib.SMTP:
+    return aiosmtplib.SMTP(
+        hostname=settings.mail_server,
+        port=settings.mail_port,
+        username=settings.mail_username if settings.mail_use_credentials else None,
+        password=settings.mail_password if settings.mail_use_credentials else None,
+        use_tls=settings.mail_ssl_tls,
+        start_tls=settings.mail_starttls,
+        validate_certs=settings.mail_validate_certs,
+        timeout=settings.mail_timeout,
+    )
+
+
+class SMTPPool:
+    """
+    Long-lived SMTP connections shared by the messages this worker sends, so a message does not pay
+    for a TCP and TLS handshake and a login. At most size connections are open, further sends wait for a free one,
+    which keeps within the connection limits of the provider. A connection idle for idle_timeout seconds
+    or that sent max_messages messages is replaced, and one the server dropped is reopened once before a send fails.
+    """
+
+    def __init__(self, connect: Callable[[], aiosmtplib.SMTP], size: int, idle_timeout: float, max_messages: int):
+        self.connect = connect
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.opened = 0
+        self.reconnects = 0
+        self.sent = 0
+        self._slots = asyncio.Semaphore(size)
+        # Connections waiting for a message, with the time they were last used and the messages they sent
+        self._idle: list[tuple[aiosmtplib.SMTP, float, int]] = []
+
+    async def _open(self) -> aiosmtplib.SMTP:
+        smtp = self.connect()
+        await smtp.connect()
+        self.opened += 1
+        return smtp
+
+    @staticmethod
+    async def _quit(smtp: aiosmtplib.SMTP):
+        try:
+            await smtp.quit()
+        except (SMTPException, OSError):
+            smtp.close()
+
+    async def _acquire(self) -> tuple[aiosmtplib.SMTP, int]:
+        while self._idle:
+            smtp, used_at, sent = self._idle.pop()
+            if smtp.is_connected and time.monotonic() - used_at < self.idle_timeout:
+                return smtp, sent
+            await self._quit(smtp)
+        return await self._open(), 0
+
+    async def send(self, *messages: EmailMessage):
+        """
+        The send function sends messages over one pooled connection, in order.
+        If a send fails, the messages before it were sent and the ones after it were not.
+
+        :param self: Represent the instance of the class
+        :param messages: EmailMessage: The messages to send
+        :return: None
+        """
+        async with self._slots:
+            smtp, sent = await self._acquire()
+            try:
+                for message in messages:
+                    if sent >= self.max_messages:
+                        await self._quit(smtp)
+                        smtp, sent = await self._open(), 0
+                    try:
+                        await smtp.send_message(message)
+                    except SMTPServerDisconnected:
+                        # The server closed a connection that was kept alive
+                        smtp.close()
+                        self.reconnects += 1
+                        smtp, sent = await self._open(), 0
+                        await smtp.send_message(message)
+                    sent += 1
+                    self.sent += 1
+            except BaseException:
+                smtp.close()
+                raise
+            self._idle.append((smtp, time.monotonic(), sent))
+
+    async def close(self):
+        """
+        The close function ends the idle connections, the pool opens new ones if it is used again.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        idle, self._idle = self._idle, []
+        for smtp, _, _ in idle:
+            await self._quit(smtp)
+
+    def stats(self) -> dict:
+        return {"idle": len(self._idle), "opened": self.opened, "reconnects": self.reconnects, "sent": self.sent}
+
+
+smtp_pool = SMTPPool(connect_smtp, size=settings.mail_pool_size, idle_timeout=settings.mail_idle_timeout,
+                     max_messages=settings.mail_max_messages_per_connection)
+
+
+@job_handler("send_email")
 async def send_email(email: EmailStr, username: str, host: str):
     """
     The send_email function sends an email to the user with a link to confirm their email address.
@@ -30,22 +149,15 @@ async def send_email(email: EmailStr, username: str, host: str):
             -email: the user's email address, which is used as a recipient for the message and also as part of
                 the token verification payload. This parameter must be of type EmailStr (a custom class that validates
                 whether or not an input string is a valid email). If it isn't, then this function will raise an exception.
+        The message goes out over a pooled SMTP connection, see SMTPPool. It is run by the job worker,
+        which retries it if the SMTP server cannot be reached.
 
     :param email: EmailStr: Ensure that the email is a valid email address
     :param username: str: Get the username of the user who is trying to register
     :param host: str: Send the host to the email template
     :return: A coroutine object, which is an awaitable
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email!",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        logging.error(err)
+    token_verification = auth_service.create_email_token({"sub": email})
+    message = build_message(email, "Confirm your email!", "email_template.html",
+                            host=host, username=username, token=token_verification)
+    await smtp_pool.send(message)
@@ -0,0 +1,54 @@
+import hashlib
+
+from fastapi import Response, status
+
+
+def contact_etag(contact_id: int, version: int) -> str:
+    """
+    The contact_etag function returns the strong ETag of a contact. Every write increments
+    Contact.version, so the tag changes exactly when the contact does.
+
+    :param contact_id: int: The id of the contact
+    :param version: int: The version of the contact
+    :return: A quoted entity tag
+    """
+    return f'"c{contact_id}v{version}"'
+
+
+def page_etag(rows) -> str:
+    """
+    The page_etag function returns the strong ETag of a page of contacts, a digest of the
+    ids and versions on the page in order. Anything added, removed, reordered or changed on the page changes it.
+
+    :param rows: An iterable of objects with id and version attributes, contacts or version rows
+    :return: A quoted entity tag
+    """
+    digest = hashlib.sha256(",".join(f"{row.id}:{row.version}" for row in rows).encode())
+    return f'"p{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    The etag_matches function checks an If-None-Match header against an ETag.
+    As the header requires, tags are compared weakly, so a W/ prefix is ignored.
+
+    :param if_none_match: str | None: The If-None-Match header of the request
+    :param etag: str: The current ETag of the resource
+    :return: True if the client already has the current representation
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str, headers: dict | None = None) -> Response:
+    """
+    The not_modified function builds the empty 304 response for a client that has the current representation.
+
+    :param etag: str: The current ETag of the resource
+    :param headers: dict | None: Other headers the full response would have carried
+    :return: A 304 response
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={**(headers or {}), "ETag": etag})
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+from src.conf.config import settings
+from src.database.conn_to_db import DBSession, maybe_await
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactFileFormat
+
+MEDIA_TYPES = {
+    ContactFileFormat.csv: "text/csv",
+    ContactFileFormat.ndjson: "application/x-ndjson",
+}
+
+
+def _to_csv(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(col.key for col in repository_contacts.EXPORT_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _to_ndjson(rows) -> bytes:
+    return "".join(json.dumps(row._asdict(), ensure_ascii=False) + "\n" for row in rows).encode()
+
+
+async def export_contacts(fmt: ContactFileFormat, after_id: int, owner_id: int,
+                          db: DBSession) -> AsyncIterator[bytes]:
+    """
+    The export_contacts function streams every contact of one owner with an id greater than after_id, in id order.
+    Contacts are read in chunks of settings.export_chunk_size, so memory stays flat however large the table is.
+    The session is closed after each chunk is read, which hands the connection back to the pool
+    while the chunk is written to a possibly slow client. An interrupted export can be resumed by
+    passing the id of the last contact received as after_id.
+
+    :param fmt: ContactFileFormat: Format of the output, csv or ndjson
+    :param after_id: int: Export contacts with an id greater than this one
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the repository
+    :return: An async iterator of encoded chunks
+    """
+    if fmt == ContactFileFormat.csv:
+        yield _to_csv([], header=True)
+    while True:
+        rows = await repository_contacts.get_contact_rows(after_id, settings.export_chunk_size, owner_id, db)
+        await maybe_await(db.close())
+        if not rows:
+            return
+        yield _to_csv(rows) if fmt == ContactFileFormat.csv else _to_ndjson(rows)
+        if len(rows) < settings.export_chunk_size:
+            return
+        after_id = rows[-1].id
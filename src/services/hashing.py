@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from src.conf.config import settings
+
+
+class BoundedExecutor:
+    """
+    A thread pool for CPU-bound calls made from async handlers, so they do not block the event loop.
+    At most workers calls run at a time and at most queue more wait for a thread. Calls beyond that
+    are rejected at once with 503 instead of piling up behind a growing queue.
+    With processes, the calls run in worker processes instead, for work that holds the GIL;
+    fn and its arguments must then be picklable.
+    """
+
+    def __init__(self, workers: int, queue: int, name: str, processes: bool = False):
+        self.workers = workers
+        self.capacity = workers + queue
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        if processes:
+            # Spawned rather than forked, the workers do not inherit the threads and locks of the event loop
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+    async def run(self, fn, *args):
+        """
+        The run function calls fn(*args) on a worker thread or process and waits for the result
+        without blocking the event loop.
+
+        :param self: Represent the instance of the class
+        :param fn: The blocking function to call
+        :param args: Arguments of the call
+        :return: The return value of fn
+        """
+        with self._lock:
+            if self.pending >= self.capacity:
+                self.rejected += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Server is busy, try again later", headers={"Retry-After": "1"})
+            self.pending += 1
+        # The slot is released when the call finishes, even if the request was cancelled meanwhile
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the load of the pool.
+
+        :param self: Represent the instance of the class
+        :return: A dict with workers, capacity, pending, completed and rejected
+        """
+        return {"workers": self.workers, "capacity": self.capacity, "pending": self.pending,
+                "completed": self.completed, "rejected": self.rejected}
+
+
+password_hasher = BoundedExecutor(settings.password_hash_workers, settings.password_hash_queue, "password-hash")
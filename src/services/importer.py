@@ -0,0 +1,138 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+
+from src.conf.config import settings
+from src.database.conn_to_db import DBSession
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactFileFormat, ContactModel
+
+
+CONTENT_TYPES = {
+    "text/csv": ContactFileFormat.csv,
+    "application/csv": ContactFileFormat.csv,
+    "application/x-ndjson": ContactFileFormat.ndjson,
+    "application/ndjson": ContactFileFormat.ndjson,
+    "application/jsonl": ContactFileFormat.ndjson,
+}
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    The iter_lines function splits a stream of UTF-8 bytes into lines as the chunks arrive,
+    so only one chunk and one partial line are held in memory.
+
+    :param chunks: AsyncIterator[bytes]: The body of the request
+    :return: An async iterator over the lines, line endings included
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_csv_records(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, dict | str]]:
+    """
+    The iter_csv_records function parses CSV lines with a header row into one dict per record.
+    Lines are joined while a quoted field is still open, so values may contain line breaks.
+
+    :param lines: AsyncIterator[str]: The lines of the file
+    :return: An async iterator of (record number, record or error message)
+    """
+    header, record, number = None, "", 0
+    async for line in lines:
+        record += line
+        if record.count('"') % 2:
+            continue
+        values, record = next(csv.reader([record]), []), ""
+        if not values:
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        number += 1
+        if len(values) != len(header):
+            yield number, f"Expected {len(header)} fields, got {len(values)}"
+        else:
+            yield number, dict(zip(header, values))
+    if record:
+        yield number + 1, "Unterminated quoted field"
+
+
+async def iter_ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, dict | str]]:
+    """
+    The iter_ndjson_records function parses one JSON object per line. Blank lines are skipped.
+
+    :param lines: AsyncIterator[str]: The lines of the file
+    :return: An async iterator of (line number, record or error message)
+    """
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        yield number, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+async def import_contacts(chunks: AsyncIterator[bytes], fmt: ContactFileFormat, batch_size: int, owner_id: int,
+                          db: DBSession) -> dict:
+    """
+    The import_contacts function streams contacts from a CSV or NDJSON body into the database.
+    Records are validated one by one and upserted in batches of batch_size, one statement and one commit per batch.
+    Memory use depends on the batch size only, not on the size of the file. The error list is capped
+    at settings.import_max_errors entries; failed counts every rejected record.
+
+    :param chunks: AsyncIterator[bytes]: The body of the request
+    :param fmt: ContactFileFormat: Format of the body
+    :param batch_size: int: Number of contacts per statement
+    :param owner_id: int: The id of the user who owns the contacts
+    :param db: Session: Pass the database session to the repository
+    :return: A report with the number of processed, stored and failed records and the errors per record
+    """
+    report = {"processed": 0, "upserted": 0, "failed": 0, "errors": []}
+
+    def reject(number: int, detail: str):
+        report["failed"] += 1
+        if len(report["errors"]) < settings.import_max_errors:
+            report["errors"].append({"row": number, "detail": detail})
+
+    async def flush(batch: list[tuple[int, ContactModel]]):
+        results = await repository_contacts.upsert_many([body for _, body in batch], owner_id, db)
+        for (number, _), error in zip(batch, results):
+            if error is None:
+                report["upserted"] += 1
+            else:
+                reject(number, error)
+
+    parse = iter_csv_records if fmt == ContactFileFormat.csv else iter_ndjson_records
+    batch = []
+    async for number, record in parse(iter_lines(chunks)):
+        report["processed"] += 1
+        if isinstance(record, str):
+            reject(number, record)
+            continue
+        try:
+            batch.append((number, ContactModel(**record)))
+        except ValidationError as e:
+            reject(number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return report
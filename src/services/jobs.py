@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError, ResponseError
+
+from src.conf.config import settings
+from src.services.metrics import JOB_DURATION, JOB_QUEUE_DEPTH, JOBS
+from src.services.redis_pool import get_redis
+
+# Job name -> coroutine function run by the workers with the kwargs of the job, see job_handler()
+JOBS_BY_NAME: dict[str, Callable[..., Awaitable]] = {}
+
+# Moves the retries that are due from the delayed set back to the stream
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, job in ipairs(due) do
+    redis.call('XADD', KEYS[2], '*', 'job', job)
+    redis.call('ZREM', KEYS[1], job)
+end
+return #due
+"""
+# Shorter than the socket timeout of the Redis client
+READ_BLOCK_MS = 500
+DEPTH_INTERVAL = 5
+
+
+def job_handler(name: str):
+    """
+    The job_handler function registers a coroutine function as the handler of the jobs called name.
+    The module of a handler must be imported by the worker, see src.worker.
+
+    :param name: str: The name the job is enqueued by
+    :return: A decorator that registers the function and returns it unchanged
+    """
+    def register(func):
+        JOBS_BY_NAME[name] = func
+        return func
+    return register
+
+
+class JobQueue:
+    """
+    A durable job queue on a Redis stream, read by the workers through a consumer group.
+    A job stays pending in the group until a worker acknowledges it, so the jobs of a worker that dies
+    are claimed by another one after visibility_timeout seconds; a job may thus run more than once.
+    A failed job is retried with exponential backoff from a sorted set of delayed jobs,
+    and after max_attempts it is moved to the dead letter stream with its last error.
+    """
+
+    def __init__(self, get_client: Callable[[], redis.Redis], stream: str, group: str, max_attempts: int,
+                 retry_base: float, retry_max: float, visibility_timeout: float):
+        self.get_client = get_client
+        self.stream = stream
+        self.group = group
+        self.delayed = f"{stream}:delayed"
+        self.dead = f"{stream}:dead"
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.visibility_timeout = visibility_timeout
+        self._promote = None
+
+    async def enqueue(self, name: str, /, **kwargs) -> str:
+        """
+        The enqueue function adds a job to the queue, it is run by a worker as soon as one is free.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the job, see job_handler()
+        :param kwargs: The arguments of the job, JSON compatible
+        :return: The id of the stream entry
+        """
+        payload = json.dumps({"id": uuid.uuid4().hex, "name": name, "kwargs": kwargs, "attempt": 0})
+        entry_id = await self.get_client().xadd(self.stream, {"job": payload})
+        return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+    async def create_group(self):
+        try:
+            await self.get_client().xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def promote_due(self, count: int = 100) -> int:
+        """
+        The promote_due function moves the retries whose backoff is over back to the stream.
+
+        :param self: Represent the instance of the class
+        :param count: int: Most retries moved at once
+        :return: The number of retries moved
+        """
+        if self._promote is None:
+            self._promote = self.get_client().register_script(PROMOTE_SCRIPT)
+        return await self._promote(keys=[self.delayed, self.stream], args=[time.time(), count])
+
+    async def read(self, consumer: str, count: int, block_ms: int | None = None) -> list[tuple[str, dict]]:
+        """
+        The read function takes up to count jobs for a consumer: first jobs left pending by a consumer
+        for longer than visibility_timeout, then new ones, waiting up to block_ms for them.
+
+        :param self: Represent the instance of the class
+        :param consumer: str: The name of the worker
+        :param count: int: Most jobs returned
+        :param block_ms: int | None: Milliseconds to wait for new jobs, None to return at once
+        :return: A list of (entry id, job)
+        """
+        client = self.get_client()
+        _, entries, *_ = await client.xautoclaim(self.stream, self.group, consumer,
+                                                 min_idle_time=int(self.visibility_timeout * 1000), count=count)
+        if not entries:
+            response = await client.xreadgroup(self.group, consumer, streams={self.stream: ">"}, count=count,
+                                               block=block_ms)
+            entries = response[0][1] if response else []
+        return [(entry_id.decode(), json.loads(fields[b"job"])) for entry_id, fields in entries if fields]
+
+    def backoff(self, attempt: int) -> float:
+        """
+        The backoff function returns the delay before a retry: it doubles with every attempt up to retry_max,
+        with jitter so jobs that failed together are not retried together.
+
+        :param self: Represent the instance of the class
+        :param attempt: int: The number of the failed attempt, from 1
+        :return: Seconds to wait
+        """
+        return min(self.retry_base * 2 ** (attempt - 1), self.retry_max) * random.uniform(0.5, 1)
+
+    async def ack(self, entry_id: str):
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            await pipe.xack(self.stream, self.group, entry_id).xdel(self.stream, entry_id).execute()
+
+    async def fail(self, entry_id: str, job: dict, error: Exception) -> str:
+        """
+        The fail function records a failed attempt of a job: it is retried after a backoff,
+        or moved to the dead letter stream once it used its attempts. Either way, in the same transaction
+        the entry is acknowledged.
+
+        :param self: Represent the instance of the class
+        :param entry_id: str: The id of the stream entry of the job
+        :param job: dict: The job
+        :param error: Exception: The error the attempt failed with
+        :return: retry or dead
+        """
+        attempt = job["attempt"] + 1
+        job = {**job, "attempt": attempt, "error": repr(error)}
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            if attempt < self.max_attempts and job["name"] in JOBS_BY_NAME:
+                outcome = "retry"
+                pipe.zadd(self.delayed, {json.dumps(job): time.time() + self.backoff(attempt)})
+            else:
+                outcome = "dead"
+                pipe.xadd(self.dead, {"job": json.dumps(job)})
+            await pipe.xack(self.stream, self.group, entry_id).xdel(self.stream, entry_id).execute()
+        return outcome
+
+    async def depth(self) -> dict:
+        """
+        The depth function counts the jobs of the queue by state. Finished jobs are deleted from the stream,
+        so the stream holds the pending jobs and the ones no worker took yet.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the jobs waiting for a worker, running or left by a dead worker, waiting for a retry
+            and dead
+        """
+        await self.create_group()
+        async with self.get_client().pipeline(transaction=False) as pipe:
+            pipe.xlen(self.stream).xpending(self.stream, self.group).zcard(self.delayed).xlen(self.dead)
+            length, pending, delayed, dead = await pipe.execute()
+        return {"ready": length - pending["pending"], "pending": pending["pending"], "delayed": delayed, "dead": dead}
+
+
+job_queue = JobQueue(get_redis, stream=settings.job_stream, group=settings.job_group,
+                     max_attempts=settings.job_max_attempts, retry_base=settings.job_retry_base_seconds,
+                     retry_max=settings.job_retry_max_seconds, visibility_timeout=settings.job_visibility_timeout)
+
+
+class JobWorker:
+    """
+    Runs the jobs of a queue, at most concurrency at a time. Throughput scales by starting more workers,
+    in this process or others: the consumer group hands every job to one of them.
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int, consumer: str | None = None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks: set[asyncio.Task] = set()
+        self._stopping = False
+
+    async def _run_job(self, entry_id: str, job: dict):
+        handler = JOBS_BY_NAME.get(job["name"])
+        start = time.perf_counter()
+        error = None
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job {job['name']}")
+            await handler(**job["kwargs"])
+        except Exception as e:
+            logging.warning("Job %s %s failed on attempt %d: %r", job["name"], job["id"], job["attempt"] + 1, e)
+            error = e
+        try:
+            if error is None:
+                await self.queue.ack(entry_id)
+                outcome = "done"
+            else:
+                outcome = await self.queue.fail(entry_id, job, error)
+        except RedisError as e:
+            # The job stays pending and is claimed again after the visibility timeout
+            logging.warning("Job %s %s could not be recorded: %s", job["name"], job["id"], e)
+            outcome = "unrecorded"
+        JOBS.labels(job["name"], outcome).inc()
+        JOB_DURATION.labels(job["name"]).observe(time.perf_counter() - start)
+
+    async def poll(self, block_ms: int | None = None) -> int:
+        """
+        The poll function starts as many jobs as there are free slots.
+
+        :param self: Represent the instance of the class
+        :param block_ms: int | None: Milliseconds to wait for new jobs, None to return at once
+        :return: The number of jobs started
+        """
+        await self.queue.promote_due()
+        free = self.concurrency - len(self._tasks)
+        if free <= 0:
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+            return 0
+        entries = await self.queue.read(self.consumer, free, block_ms)
+        for entry_id, job in entries:
+            task = asyncio.create_task(self._run_job(entry_id, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return len(entries)
+
+    async def drain(self):
+        """
+        The drain function waits for the running jobs to finish.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def update_depth(self):
+        for state, count in (await self.queue.depth()).items():
+            JOB_QUEUE_DEPTH.labels(state).set(count)
+
+    async def run(self):
+        """
+        The run function runs jobs until stop is called, then waits for the running ones.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        await self.queue.create_group()
+        depth_at = 0.0
+        while not self._stopping:
+            try:
+                if time.monotonic() - depth_at >= DEPTH_INTERVAL:
+                    await self.update_depth()
+                    depth_at = time.monotonic()
+                await self.poll(READ_BLOCK_MS)
+            except RedisError as e:
+                logging.warning("Job queue unavailable: %s", e)
+                await asyncio.sleep(1)
+        await self.drain()
+
+    def stop(self):
+        self._stopping = True
@@ -0,0 +1,251 @@
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from src.database.conn_to_db import engine, replica_engines
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUESTS = Counter("http_requests_total", "Requests by route template and status", ["method", "route", "status"])
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Request latency by route template",
+                             ["method", "route"],
+                             buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being served by route template", ["method", "route"],
+                    multiprocess_mode="livesum")
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements executed per request", ["route"],
+                                   buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_TIME_PER_REQUEST = Histogram("db_time_per_request_seconds", "Time spent in SQL statements per request", ["route"],
+                                buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Duration of single SQL statements", ["operation"],
+                              buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1))
+REDIS_CALLS_PER_REQUEST = Histogram("redis_calls_per_request", "Redis round trips per request", ["route"],
+                                    buckets=(0, 1, 2, 3, 5, 10, 20))
+REDIS_COMMAND_DURATION = Histogram("redis_command_duration_seconds", "Redis round trip time by command", ["command"],
+                                   buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .5))
+RATE_LIMITED = Counter("rate_limit_rejections_total", "Requests rejected by the rate limiter", ["route"])
+JOBS = Counter("jobs_total", "Background jobs run by the worker by outcome", ["job", "outcome"])
+JOB_DURATION = Histogram("job_duration_seconds", "Duration of background jobs", ["job"],
+                         buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+JOB_QUEUE_DEPTH = Gauge("job_queue_depth", "Jobs in the queue by state", ["state"], multiprocess_mode="max")
+
+
+@dataclass
+class RequestStats:
+    route: str = UNMATCHED_ROUTE
+    db_queries: int = 0
+    db_time: float = 0.0
+    redis_calls: int = 0
+    # Statement -> [count, time, parameter fingerprints], filled by the SQL profiler when it is enabled
+    statements: dict | None = None
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+# Called with (stats, statement, parameters, duration) after every SQL statement, stats is None outside of requests
+statement_observers: list[Callable] = []
+# Called with the stats of every finished request
+request_observers: list[Callable[[RequestStats], None]] = []
+
+
+# Path -> route template, reset when it grows past the limit so unknown paths cannot fill memory
+_templates: dict[str, str] = {}
+TEMPLATE_CACHE_SIZE = 10000
+
+
+def route_template(scope) -> str:
+    """
+    The route_template function finds the path template of the route a request goes to, e.g. /api/users/{contact_id},
+    so requests are labelled by route and not by their concrete path. Templates are cached per path.
+
+    :param scope: The ASGI scope of the request
+    :return: The path template, or UNMATCHED_ROUTE
+    """
+    path = scope["path"]
+    template = _templates.get(path)
+    if template is None:
+        template = next((route.path for route in scope["app"].routes if route.path_regex.match(path)),
+                        UNMATCHED_ROUTE)
+        if len(_templates) >= TEMPLATE_CACHE_SIZE:
+            _templates.clear()
+        _templates[path] = template
+    return template
+
+
+class _RouteMetrics(NamedTuple):
+    in_progress: Gauge
+    duration: Histogram
+    db_queries: Histogram
+    db_time: Histogram
+    redis_calls: Histogram
+
+
+@lru_cache(maxsize=1024)
+def _route_metrics(method: str, route: str) -> _RouteMetrics:
+    # Looking up labelled children costs more than observing them, so they are looked up once per route
+    return _RouteMetrics(IN_PROGRESS.labels(method, route), REQUEST_DURATION.labels(method, route),
+                         DB_QUERIES_PER_REQUEST.labels(route), DB_TIME_PER_REQUEST.labels(route),
+                         REDIS_CALLS_PER_REQUEST.labels(route))
+
+
+@lru_cache(maxsize=1024)
+def _requests_counter(method: str, route: str, status: int) -> Counter:
+    return REQUESTS.labels(method, route, status)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency, status and in-flight count of every request by route template,
+    with the number of SQL statements, SQL time and Redis round trips the request caused.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method, route = scope["method"], route_template(scope)
+        metrics = _route_metrics(method, route)
+        stats = RequestStats(route)
+        token = request_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.duration.observe(time.perf_counter() - start)
+            metrics.in_progress.dec()
+            request_stats.reset(token)
+            _requests_counter(method, route, status_code).inc()
+            metrics.db_queries.observe(stats.db_queries)
+            metrics.db_time.observe(stats.db_time)
+            metrics.redis_calls.observe(stats.redis_calls)
+            for observer in request_observers:
+                observer(stats)
+
+
+def instrument_engine(sync_engine):
+    """
+    The instrument_engine function times every SQL statement run on an engine and adds it to the stats
+    of the current request.
+
+    :param sync_engine: Engine: The engine, for an AsyncEngine pass its sync_engine
+    :return: None
+    """
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_DURATION.labels(statement.split(None, 1)[0].upper()).observe(duration)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_time += duration
+        for observer in statement_observers:
+            observer(stats, statement, parameters, duration)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def observe_redis(command: str, duration: float):
+    """
+    The observe_redis function records one Redis round trip.
+
+    :param command: str: Name of the command, or PIPELINE
+    :param duration: float: Round trip time in seconds
+    :return: None
+    """
+    REDIS_COMMAND_DURATION.labels(command).observe(duration)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.redis_calls += 1
+
+
+def observe_rate_limited():
+    """
+    The observe_rate_limited function counts a request of the current route rejected by the rate limiter.
+
+    :return: None
+    """
+    stats = request_stats.get()
+    RATE_LIMITED.labels(stats.route if stats is not None else UNMATCHED_ROUTE).inc()
+
+
+class StatsCollector:
+    """
+    Exposes the hit and miss counters of caches and the load of worker pools, read from their stats()
+    at scrape time, so the request path pays nothing for them.
+    """
+
+    def __init__(self, caches: dict[str, Callable[[], dict]], pools: dict[str, Callable[[], dict]],
+                 db_pools: dict[str, Callable[[], dict]] | None = None):
+        self.caches = caches
+        self.pools = pools
+        self.db_pools = db_pools or {}
+
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        size = GaugeMetricFamily("cache_entries", "Entries in the cache", labels=["cache"])
+        for name, stats in self.caches.items():
+            stats = stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            if "size" in stats:
+                size.add_metric([name], stats["size"])
+        pending = GaugeMetricFamily("pool_pending", "Calls running or queued in a worker pool", labels=["pool"])
+        rejected = CounterMetricFamily("pool_rejected", "Calls a worker pool rejected because it was full",
+                                       labels=["pool"])
+        for name, stats in self.pools.items():
+            stats = stats()
+            pending.add_metric([name], stats["pending"])
+            rejected.add_metric([name], stats["rejected"])
+        yield from (hits, misses, size, pending, rejected)
+        yield from self._collect_db_pools()
+
+    def _collect_db_pools(self):
+        gauges = {name: GaugeMetricFamily(f"db_pool_{name}", description, labels=["pool"]) for name, description in (
+            ("size", "Connections the pool keeps open"), ("checked_out", "Connections in use"),
+            ("overflow", "Connections open beyond the pool size"))}
+        counters = {name: CounterMetricFamily(f"db_pool_{name}", description, labels=["pool"])
+                    for name, description in (("checkouts", "Connections taken from the pool"),
+                                              ("timeouts", "Checkouts that gave up after the pool timeout"),
+                                              ("wait_seconds", "Time spent waiting for a connection"))}
+        for name, stats in self.db_pools.items():
+            stats = stats()
+            for metric in ("size", "checked_out", "overflow", "checkouts", "timeouts"):
+                (gauges.get(metric) or counters[metric]).add_metric([name], stats[metric])
+            counters["wait_seconds"].add_metric([name], stats["wait_time"])
+        yield from gauges.values()
+        yield from counters.values()
+
+
+def metrics_response() -> Response:
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+for instrumented in (engine, *replica_engines):
+    instrument_engine(instrumented)
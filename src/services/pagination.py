@@ -0,0 +1,36 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(sort_by: str, value, contact_id: int) -> str:
+    """
+    The encode_cursor function packs the position of the last row on a page into an opaque string.
+    The client sends it back as the after parameter to get the next page.
+
+    :param sort_by: str: The name of the sort key the page was ordered by
+    :param value: The sort key value of the last row
+    :param contact_id: int: The id of the last row, used as a tie-breaker
+    :return: A url-safe cursor string
+    """
+    raw = json.dumps([sort_by, value, contact_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str) -> tuple:
+    """
+    The decode_cursor function unpacks a cursor made by encode_cursor.
+    It raises a ValueError if the cursor is malformed or was issued for a different sort key.
+
+    :param cursor: str: The cursor received from the client
+    :param sort_by: str: The sort key of the current request
+    :return: A (value, id) tuple of the last row of the previous page
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort_by, value, contact_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
+    if cursor_sort_by != sort_by or not isinstance(contact_id, int):
+        raise ValueError("Cursor does not match the requested sort order")
+    return value, contact_id
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import logging
+from collections import deque
+from typing import Callable
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services import metrics
+from src.services.redis_pool import get_redis, listen_to_channel
+
+PROFILING_CHANNEL = "sql-profiling:config"
+MAX_LOGGED_STATEMENT = 1000
+
+logger = logging.getLogger("sql")
+
+
+def parameter_fingerprint(parameters) -> str:
+    """
+    The parameter_fingerprint function describes the bound parameters of a statement without logging their values:
+    the parameter types and a short digest of the values. Equal digests mean the same values were bound.
+
+    :param parameters: The parameters passed to the DBAPI cursor, a sequence, a mapping or a list of them
+    :return: A fingerprint such as "int,str#9f2c41d0a7"
+    """
+    if isinstance(parameters, list):
+        first = parameters[0] if parameters else ()
+        shape = f"many[{len(parameters)}]:" + _types(first)
+    else:
+        shape = _types(parameters)
+    digest = hashlib.blake2b(repr(parameters).encode(), digest_size=5).hexdigest()
+    return f"{shape}#{digest}"
+
+
+def _types(parameters) -> str:
+    values = parameters.values() if isinstance(parameters, dict) else parameters or ()
+    return ",".join(type(value).__name__ for value in values)
+
+
+class SQLProfiler:
+    """
+    Statement-level profiling on top of the engine events of the metrics.
+    The slow-query log is always active: statements slower than slow_query_ms are logged with a
+    fingerprint of their parameters. When enabled, every request also records its statements,
+    logs a summary and flags statements repeated n_plus_one_threshold times or more (N+1 patterns).
+    The settings can be changed at runtime, for every worker at once through Redis.
+    """
+
+    def __init__(self, get_client: Callable[[], redis.Redis], enabled: bool, slow_query_ms: float,
+                 n_plus_one_threshold: int):
+        self.get_client = get_client
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.slow_queries = 0
+        self.n_plus_one = 0
+        self.recent = deque(maxlen=50)
+        self._listener = None
+
+    def config(self) -> dict:
+        return {"enabled": self.enabled, "slow_query_ms": self.slow_query_ms,
+                "n_plus_one_threshold": self.n_plus_one_threshold}
+
+    def configure(self, **changes) -> dict:
+        """
+        The configure function changes the settings of the profiler of this worker. None values are ignored.
+
+        :param self: Represent the instance of the class
+        :param changes: New values for enabled, slow_query_ms or n_plus_one_threshold
+        :return: The resulting settings
+        """
+        for name, value in changes.items():
+            if name in ("enabled", "slow_query_ms", "n_plus_one_threshold") and value is not None:
+                setattr(self, name, value)
+        return self.config()
+
+    async def update(self, **changes) -> dict:
+        """
+        The update function changes the settings of the profiler here and on every other worker.
+
+        :param self: Represent the instance of the class
+        :param changes: New values for enabled, slow_query_ms or n_plus_one_threshold
+        :return: The resulting settings
+        """
+        config = self.configure(**changes)
+        try:
+            await self.get_client().publish(PROFILING_CHANNEL, json.dumps(config))
+        except RedisError as e:
+            logging.warning("Profiling settings were changed on this worker only: %s", e)
+        return config
+
+    def on_statement(self, stats, statement: str, parameters, duration: float):
+        """
+        The on_statement function is called by the engine events after every statement.
+
+        :param self: Represent the instance of the class
+        :param stats: RequestStats | None: Stats of the current request, None outside of requests
+        :param statement: str: The SQL sent to the database
+        :param parameters: The bound parameters
+        :param duration: float: Execution time in seconds
+        :return: None
+        """
+        if duration * 1000 >= self.slow_query_ms:
+            self.slow_queries += 1
+            logger.warning(json.dumps({
+                "event": "slow_query", "route": getattr(stats, "route", None), "duration_ms": round(duration * 1000, 3),
+                "statement": statement[:MAX_LOGGED_STATEMENT], "parameters": parameter_fingerprint(parameters)}))
+        if self.enabled and stats is not None:
+            if stats.statements is None:
+                stats.statements = {}
+            entry = stats.statements.setdefault(statement, [0, 0.0, set()])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2].add(parameter_fingerprint(parameters))
+
+    def on_request_end(self, stats):
+        """
+        The on_request_end function logs the profile of a request and flags its N+1 patterns.
+
+        :param self: Represent the instance of the class
+        :param stats: RequestStats: Stats of the finished request
+        :return: None
+        """
+        if not stats.statements:
+            return
+        repeated = [{"statement": statement[:MAX_LOGGED_STATEMENT], "count": count, "time_ms": round(time * 1000, 3),
+                     "distinct_parameters": len(fingerprints)}
+                    for statement, (count, time, fingerprints) in stats.statements.items()
+                    if count >= self.n_plus_one_threshold]
+        profile = {"event": "request_profile", "route": stats.route, "statements": stats.db_queries,
+                   "distinct_statements": len(stats.statements), "db_time_ms": round(stats.db_time * 1000, 3),
+                   # The same statement with the same parameters ran more than once
+                   "duplicates": sum(count - len(fingerprints) for count, _, fingerprints in stats.statements.values()),
+                   "n_plus_one": repeated}
+        if repeated:
+            self.n_plus_one += 1
+            self.recent.append(profile)
+            logger.warning(json.dumps(profile))
+        else:
+            logger.info(json.dumps(profile))
+
+    def _on_message(self, message):
+        self.configure(**json.loads(message["data"]))
+
+    def listen(self):
+        """
+        The listen function starts a background task that applies settings changed on other workers.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._listener is None:
+            self._listener = asyncio.create_task(
+                listen_to_channel(self.get_client, PROFILING_CHANNEL, self._on_message, on_subscribe=lambda: None))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def stats(self) -> dict:
+        return {**self.config(), "slow_queries": self.slow_queries, "n_plus_one_requests": self.n_plus_one,
+                "recent_n_plus_one": list(self.recent)}
+
+
+sql_profiler = SQLProfiler(get_redis, enabled=settings.sql_profiling, slow_query_ms=settings.sql_slow_query_ms,
+                           n_plus_one_threshold=settings.sql_n_plus_one_threshold)
+metrics.statement_observers.append(sql_profiler.on_statement)
+metrics.request_observers.append(sql_profiler.on_request_end)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable
+
+import redis.asyncio as redis
+from fastapi import HTTPException, Request, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+from src.services.metrics import observe_rate_limited
+from src.services.redis_pool import get_redis
+
+# Adds the tokens each worker consumed to the shared counters and returns their totals, one round trip per sync
+SYNC_SCRIPT = """
+local totals = {}
+for i, key in ipairs(KEYS) do
+    totals[i] = redis.call('INCRBY', key, ARGV[i])
+    redis.call('PEXPIRE', key, ARGV[#KEYS + i])
+end
+return totals
+"""
+
+
+@lru_cache(maxsize=None)
+def parse_policy(policy: str) -> tuple[int, float]:
+    """
+    The parse_policy function reads a rate limit policy of the form times/seconds, e.g. 2/5.
+
+    :param policy: str: The policy
+    :return: The number of requests and the period they are allowed in
+    """
+    times, _, seconds = policy.partition("/")
+    return int(times), float(seconds)
+
+
+def client_key(request: Request) -> str:
+    """
+    The client_key function identifies who a request is counted against: the user of a valid access token,
+    so users behind one NAT get a bucket each, and the client IP otherwise.
+
+    :param request: Request: The current request
+    :return: The key of the client
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        claims = auth_service.token_claims(token)
+        if claims is not None and claims.get("scope") == "access_token" and claims.get("sub"):
+            return f"user:{claims['sub']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+class Bucket:
+    __slots__ = ("tokens", "updated", "pending", "seen")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        # Tokens taken here and not yet added to the shared counter, and the last total read from it
+        self.pending = 0
+        self.seen: int | None = None
+
+
+class RateLimiter:
+    """
+    Token buckets kept in the worker, so a request is admitted or rejected without a network hop.
+    Every sync_interval seconds one Lua script adds the tokens taken on this worker to a counter per bucket
+    in Redis and returns the totals; what the other workers took since the last sync is then taken
+    from the local bucket as well. Every worker thus tracks the shared bucket, off by at most
+    what the others admitted in one sync interval. Without Redis each worker limits on its own.
+    """
+
+    def __init__(self, get_client: Callable[[], redis.Redis], sync_interval: float, maxsize: int):
+        self.get_client = get_client
+        self.sync_interval = sync_interval
+        self.maxsize = maxsize
+        self.allowed = 0
+        self.rejected = 0
+        self.syncs = 0
+        self.sync_failures = 0
+        self._buckets: OrderedDict[tuple[str, str], Bucket] = OrderedDict()
+        self._script = None
+        self._task = None
+
+    def hit(self, policy: str, key: str) -> float:
+        """
+        The hit function takes a token from the bucket of a client for a policy.
+
+        :param self: Represent the instance of the class
+        :param policy: str: The name of the policy, a key of settings.rate_limits
+        :param key: str: The client, see client_key
+        :return: 0 if the request is allowed, otherwise the seconds until a token is available
+        """
+        times, seconds = parse_policy(settings.rate_limits[policy])
+        rate = times / seconds
+        now = time.monotonic()
+        bucket = self._buckets.get((policy, key))
+        if bucket is None:
+            bucket = self._buckets[(policy, key)] = Bucket(times, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(times, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+            self._buckets.move_to_end((policy, key))
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.pending += 1
+            self.allowed += 1
+            return 0
+        self.rejected += 1
+        return (1 - bucket.tokens) / rate
+
+    async def sync(self):
+        """
+        The sync function reconciles the local buckets with the shared counters in Redis in one round trip.
+        Buckets that are full, idle for a whole period and have nothing to report are dropped instead.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        now = time.monotonic()
+        batch = []
+        for (policy, key), bucket in list(self._buckets.items()):
+            times, seconds = parse_policy(settings.rate_limits.get(policy, "1/1"))
+            if not bucket.pending and now - bucket.updated >= seconds:
+                del self._buckets[(policy, key)]
+            else:
+                batch.append((policy, key, bucket, bucket.pending, seconds))
+                bucket.pending = 0
+        if not batch:
+            return
+        if self._script is None:
+            self._script = self.get_client().register_script(SYNC_SCRIPT)
+        try:
+            totals = await self._script(keys=[f"rate-limit:{policy}:{key}" for policy, key, *_ in batch],
+                                        args=[taken for *_, taken, _ in batch] +
+                                             [math.ceil(seconds * 2000) for *_, seconds in batch])
+        except RedisError as e:
+            self.sync_failures += 1
+            logging.warning("Rate limit sync failed: %s", e)
+            for _, _, bucket, taken, _ in batch:
+                bucket.pending += taken
+            return
+        self.syncs += 1
+        for (_, _, bucket, taken, _), total in zip(batch, totals):
+            if bucket.seen is not None:
+                # A counter that expired starts again from zero, which is not taken by others
+                bucket.tokens = max(bucket.tokens - max(total - bucket.seen - taken, 0), 0)
+            bucket.seen = total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync()
+
+    def start(self):
+        """
+        The start function starts the background task that syncs the buckets every sync_interval seconds.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"buckets": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected,
+                "syncs": self.syncs, "sync_failures": self.sync_failures}
+
+
+rate_limiter = RateLimiter(get_redis, sync_interval=settings.rate_limit_sync_interval,
+                           maxsize=settings.rate_limit_max_keys)
+
+
+class RateLimit:
+    """
+    Dependency that applies the rate limit policy named policy in settings.rate_limits to a route.
+    A policy missing from the settings does not limit anything.
+    """
+
+    def __init__(self, policy: str):
+        self.policy = policy
+
+    async def __call__(self, request: Request):
+        if self.policy not in settings.rate_limits:
+            return
+        retry_after = rate_limiter.hit(self.policy, client_key(request))
+        if retry_after:
+            observe_rate_limited()
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
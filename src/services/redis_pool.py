@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.metrics import observe_redis
+
+_client: redis.Redis | None = None
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            observe_redis("PIPELINE", time.perf_counter() - start)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    A Redis client that reports the round trip time of every command and pipeline to the metrics.
+    """
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis(str(args[0]), time.perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def create_redis() -> redis.Redis:
+    """
+    The create_redis function builds an async Redis client on a bounded connection pool configured from Settings.
+    When every connection is busy a caller waits up to redis_pool_timeout seconds for one to be returned.
+    Commands are timed for the metrics.
+
+    :return: A Redis client
+    """
+    pool = redis.BlockingConnectionPool(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        db=settings.redis_db,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_connect_timeout=settings.redis_socket_connect_timeout,
+        health_check_interval=settings.redis_health_check_interval,
+    )
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def get_redis() -> redis.Redis:
+    """
+    The get_redis function returns the Redis client shared by the whole worker.
+    It is created on first use, which is the startup of the application.
+
+    :return: The shared Redis client
+    """
+    global _client
+    if _client is None:
+        _client = create_redis()
+    return _client
+
+
+async def close_redis():
+    """
+    The close_redis function closes the shared client and disconnects every pooled connection.
+
+    :return: None
+    """
+    global _client
+    if _client is not None:
+        await _client.close(close_connection_pool=True)
+        _client = None
+
+
+async def listen_to_channel(get_client: Callable[[], redis.Redis], channel: str,
+                            on_message: Callable[[dict], None], on_subscribe: Callable[[], None]):
+    """
+    The listen_to_channel function passes the messages published on a Redis channel to on_message until it is cancelled.
+    If the connection fails it subscribes again, and on_subscribe is called after every (re)subscription
+    so the caller can drop what may have been missed in between.
+
+    :param get_client: Callable[[], redis.Redis]: Returns the shared Redis client
+    :param channel: str: The channel to subscribe to
+    :param on_message: Callable[[dict], None]: Called with every published message
+    :param on_subscribe: Callable[[], None]: Called once the subscription is active
+    :return: None
+    """
+    while True:
+        pubsub = get_client().pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(channel)
+            on_subscribe()
+            while True:
+                # A bounded wait, a blocking read would hit the socket timeout of the pool
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=30)
+                if message is not None:
+                    on_message(message)
+        except RedisError as e:
+            logging.warning("Listener of %s failed: %s", channel, e)
+        finally:
+            await pubsub.close()
+        await asyncio.sleep(1)
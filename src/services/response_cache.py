@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, NamedTuple
+from urllib.parse import urlencode
+
+import redis.asyncio as redis
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.cache import LRUCache
+from src.services.redis_pool import get_redis, listen_to_channel
+from src.services.serialization import dumps
+
+RESPONSE_INVALIDATION_CHANNEL = "response-cache:invalidate"
+
+
+def contact_list_tag(owner_id: int) -> str:
+    return f"contacts:list:{owner_id}"
+
+
+def contact_tag(contact_id: int) -> str:
+    return f"contact:{contact_id}"
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    headers: dict
+    tags: frozenset
+
+    def response(self) -> Response:
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
+
+
+def json_entry(content, tags: Iterable[str], headers: dict | None = None) -> CachedResponse:
+    """
+    The json_entry function renders content the way the other responses are rendered and wraps it in a cache entry.
+
+    :param content: JSON compatible data, e.g. the dict of a response model
+    :param tags: Iterable[str]: Tags the entry is invalidated by
+    :param headers: dict | None: Headers to send with the cached body
+    :return: The cache entry
+    """
+    return CachedResponse(dumps(content), headers or {}, frozenset(tags))
+
+
+def response_cache_key(request: Request, owner_id: int) -> str:
+    """
+    The response_cache_key function keys a cached response by route, query parameters and the user it was built for,
+    so responses are never shared between users, while the sessions of one user share them.
+
+    :param request: Request: The current request
+    :param owner_id: int: The id of the user the response belongs to
+    :return: The cache key of the request
+    """
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}|{owner_id}"
+
+
+class ResponseCache:
+    """
+    Per-worker cache of rendered GET responses. Every entry carries tags, and writes invalidate
+    the tags they affect, on this worker and, through Redis pub/sub, on the others.
+    Concurrent misses of one key share a single load, so a cold key costs one database query.
+    """
+
+    def __init__(self, get_client: Callable[[], redis.Redis], maxsize: int, ttl: float):
+        self.get_client = get_client
+        self.local = LRUCache(maxsize, ttl)
+        self.loads = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self._generation = 0
+        self._invalidated_at = 0.0
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._listener = None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.local
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[CachedResponse]],
+                          settle: float = 0) -> CachedResponse:
+        """
+        The get_or_load function returns the cached response for a key, calling load on a miss.
+        While a load runs, other requests for the same key wait for its result instead of loading too.
+        Errors raised by load, e.g. a 404, are passed to every waiter and are not cached.
+
+        :param self: Represent the instance of the class
+        :param key: str: The cache key, see response_cache_key
+        :param load: Callable[[], Awaitable[CachedResponse]]: Builds the response on a miss
+        :param settle: float: Seconds after an invalidation during which loaded responses are not stored,
+            for loads from a read replica that may not have the write yet
+        :return: The cached response
+        """
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The loading request went away, load in this one instead
+                return await self.get_or_load(key, load, settle=settle)
+        future = asyncio.get_running_loop().create_future()
+        # Mark the result as retrieved, waiters are optional
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            self.loads += 1
+            entry = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            # A response loaded across an invalidation may be stale, it is returned but not stored
+            if generation == self._generation and time.monotonic() - self._invalidated_at >= settle:
+                self.local.set(key, entry)
+            future.set_result(entry)
+            return entry
+        finally:
+            del self._inflight[key]
+
+    async def invalidate(self, *tags: str):
+        """
+        The invalidate function drops the entries carrying any of the tags, here and on the other workers.
+
+        :param self: Represent the instance of the class
+        :param tags: str: The tags affected by a write
+        :return: None
+        """
+        self._drop(set(tags))
+        try:
+            await self.get_client().publish(RESPONSE_INVALIDATION_CHANNEL, json.dumps(tags))
+        except RedisError as e:
+            logging.warning("Response cache invalidation failed: %s", e)
+
+    def _drop(self, tags: set):
+        self.invalidations += 1
+        self._generation += 1
+        self._invalidated_at = time.monotonic()
+        self.local.delete_where(lambda entry: not tags.isdisjoint(entry.tags))
+
+    def _on_invalidate(self, message):
+        self._drop(set(json.loads(message["data"])))
+
+    def _on_subscribe(self):
+        # Entries cached while unsubscribed may have missed an invalidation
+        self._generation += 1
+        self._invalidated_at = time.monotonic()
+        self.local.clear()
+
+    def listen(self):
+        """
+        The listen function starts a background task that applies invalidations published by other workers.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self._listener is None:
+            self._listener = asyncio.create_task(listen_to_channel(
+                self.get_client, RESPONSE_INVALIDATION_CHANNEL, self._on_invalidate, self._on_subscribe))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def stats(self) -> dict:
+        """
+        The stats function reports the hit rate of the cache and how many loads were shared.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the local cache stats and the load counters
+        """
+        return {"local": self.local.stats(), "loads": self.loads, "coalesced": self.coalesced,
+                "invalidations": self.invalidations}
+
+
+response_cache = ResponseCache(get_redis, maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
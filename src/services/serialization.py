@@ -0,0 +1,70 @@
+import json
+from functools import lru_cache
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from src.conf.config import settings
+
+
+def dumps(content) -> bytes:
+    """
+    The dumps function encodes the JSON content of a response: with orjson when settings.fast_json is on,
+    otherwise exactly as JSONResponse does.
+
+    :param content: JSON compatible data
+    :return: The encoded body
+    """
+    if settings.fast_json:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+@lru_cache(maxsize=None)
+def _fields(model: type[BaseModel]) -> tuple[tuple[str, type[BaseModel] | None], ...]:
+    # The fields of a model, with the model of the fields that hold a nested model
+    return tuple((name, field.type_ if isinstance(field.type_, type) and issubclass(field.type_, BaseModel) else None)
+                 for name, field in model.__fields__.items())
+
+
+def to_content(model: type[BaseModel], obj) -> dict:
+    """
+    The to_content function turns a row into the JSON content of a response model.
+    With settings.fast_json the fields of the model are read from the row as they are: the rows come from
+    our own database and were validated when they were written, so they are not validated again.
+    Otherwise the row goes through the model, as FastAPI does with a response_model.
+
+    :param model: type[BaseModel]: The response model
+    :param obj: An ORM row, a pydantic model or a dict with the fields of the model
+    :return: A dict with the fields of the model
+    """
+    if not settings.fast_json:
+        return model.parse_obj(obj).dict() if isinstance(obj, dict) else model.from_orm(obj).dict()
+    get = obj.get if isinstance(obj, dict) else lambda name: getattr(obj, name)
+    content = {}
+    for name, nested in _fields(model):
+        value = get(name)
+        content[name] = to_content(nested, value) if nested is not None and value is not None else value
+    return content
+
+
+def fast_response(model: type[BaseModel], content, headers: dict | None = None):
+    """
+    The fast_response function is what a route with a response_model returns. Without settings.fast_json
+    it returns content unchanged, so FastAPI validates and encodes it as usual. With it, the row or list of rows
+    is encoded right away with to_content and orjson, skipping the validation of the response model.
+    Either way the OpenAPI schema comes from the response_model of the route.
+
+    :param model: type[BaseModel]: The response model of an item
+    :param content: A row, or a list of rows
+    :param headers: dict | None: Headers of the response
+    :return: content, or the encoded response
+    """
+    if not settings.fast_json:
+        return content
+    if isinstance(content, list):
+        data = [to_content(model, row) for row in content]
+    else:
+        data = to_content(model, content)
+    return Response(content=orjson.dumps(data), media_type="application/json", headers=headers)
@@ -0,0 +1,159 @@
+import asyncio
+import io
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+import cloudinary
+import cloudinary.uploader
+
+from src.conf.config import settings
+
+
+class AvatarStorage(ABC):
+    """
+    Where the processed avatars are written. Keys are derived from the content of an avatar,
+    so a key is written once and its URL never changes; the URL is known without a round trip to the storage.
+    """
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        ...
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def save(self, key: str, data: bytes, content_type: str):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+
+class LocalStorage(AvatarStorage):
+    """
+    Avatars in a directory served by the application under base_url, see main. It needs no network,
+    which suits a single server, development and the tests.
+    """
+
+    def __init__(self, directory: str, base_url: str):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, *key.split("/"))
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name and renamed, so a file is never served half written
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def save(self, key: str, data: bytes, content_type: str):
+        """
+        The save function writes an avatar to the directory on a worker thread.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the avatar, a relative path
+        :param data: bytes: The encoded image
+        :param content_type: str: The media type of the image, given by the file extension of the key here
+        :return: None
+        """
+        await asyncio.to_thread(self._write, self.path(key), data)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def delete(self, key: str):
+        """
+        The delete function removes an avatar from the directory on a worker thread, if it is there.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the avatar
+        :return: None
+        """
+        await asyncio.to_thread(self._remove, self.path(key))
+
+
+class CloudinaryStorage(AvatarStorage):
+    """
+    Avatars on Cloudinary, in the folder given by prefix. The images are uploaded already resized,
+    Cloudinary only stores and serves them.
+    """
+
+    def __init__(self, prefix: str):
+        cloudinary.config(
+            cloud_name=settings.cloudinary_name,
+            api_key=settings.cloudinary_api_key,
+            api_secret=settings.cloudinary_api_secret,
+            secure=True
+        )
+        self.prefix = prefix
+
+    def public_id(self, key: str) -> str:
+        return f"{self.prefix}/{os.path.splitext(key)[0]}"
+
+    def url(self, key: str) -> str:
+        return cloudinary.CloudinaryImage(self.public_id(key)).build_url(format=os.path.splitext(key)[1][1:])
+
+    async def exists(self, key: str) -> bool:
+        # Asking would cost an API call as slow as the upload, which overwrites the same image anyway
+        return False
+
+    async def save(self, key: str, data: bytes, content_type: str):
+        """
+        The save function uploads an avatar on a worker thread, the Cloudinary client is blocking.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the avatar
+        :param data: bytes: The encoded image
+        :param content_type: str: The media type of the image
+        :return: None
+        """
+        await asyncio.to_thread(cloudinary.uploader.upload, io.BytesIO(data), public_id=self.public_id(key),
+                                overwrite=True)
+
+    async def delete(self, key: str):
+        """
+        The delete function removes an avatar from Cloudinary on a worker thread.
+
+        :param self: Represent the instance of the class
+        :param key: str: The key of the avatar
+        :return: None
+        """
+        await asyncio.to_thread(cloudinary.uploader.destroy, self.public_id(key))
+
+
+def create_storage(name: str) -> AvatarStorage:
+    """
+    The create_storage function returns the avatar storage called name in the settings.
+
+    :param name: str: local or cloudinary
+    :return: The storage
+    """
+    if name == "local":
+        return LocalStorage(settings.avatar_dir, settings.avatar_url)
+    if name == "cloudinary":
+        return CloudinaryStorage("web10")
+    raise ValueError(f"Unknown avatar storage {name}")
+
+
+avatar_storage = create_storage(settings.avatar_storage)
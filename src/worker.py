@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+import logging
+import signal
+
+from prometheus_client import start_http_server
+
+from src.conf.config import settings
+from src.services.email import smtp_pool
+from src.services.jobs import JOBS_BY_NAME, JobWorker, job_queue
+from src.services.redis_pool import close_redis
+
+
+async def main(concurrency: int, metrics_port: int):
+    """
+    The main function runs the background jobs enqueued by the web workers until SIGINT or SIGTERM,
+    then finishes the running jobs. Start more of these processes to send faster.
+    Importing the modules of the jobs registers them, see src.services.jobs.job_handler.
+
+    :param concurrency: int: Most jobs run at a time by this process
+    :param metrics_port: int: Port of the Prometheus metrics of this process, 0 to disable them
+    :return: None
+    """
+    if metrics_port:
+        start_http_server(metrics_port)
+    worker = JobWorker(job_queue, concurrency)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    logging.info("Worker %s runs %s with %d slots", worker.consumer, ", ".join(sorted(JOBS_BY_NAME)), concurrency)
+    try:
+        await worker.run()
+    finally:
+        await smtp_pool.close()
+        await close_redis()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run the background jobs of the application")
+    parser.add_argument("--concurrency", type=int, default=settings.job_concurrency, help="jobs run at a time")
+    parser.add_argument("--metrics-port", type=int, default=settings.worker_metrics_port,
+                        help="port of the Prometheus metrics, 0 to disable them")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.metrics_port))
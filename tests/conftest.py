@@ -2,12 +2,15 @@
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import DatabaseError
+from sqlalchemy.pool import NullPool
 
 from main import app
 from src.database.models import Base
-from src.database.conn_to_db import  get_db
+from src.database.conn_to_db import get_db, to_async_url
+from src.services.response_cache import response_cache
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -17,9 +20,19 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The async engine shares the sqlite file with the sync one. NullPool keeps aiosqlite
+# connections from outliving the event loop that TestClient creates for each request.
+async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture(scope="module", params=["sync", "async"])
+def db_mode(request):
+    return request.param
+
 
 @pytest.fixture(scope="module")
-def session():
+def session(db_mode):
     # Create the database
 
     Base.metadata.drop_all(bind=engine)
@@ -35,20 +48,31 @@ def session():
 
 
 @pytest.fixture(scope="module")
-def client(session):
+def client(session, db_mode):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    if db_mode == "async":
+        async def override_get_db():
+            async with AsyncTestingSessionLocal() as db:
+                yield db
+    else:
+        def override_get_db():
+            try:
+                yield session
+            finally:
+                session.close()
 
     app.dependency_overrides[get_db] = override_get_db
 
     yield TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    # Tests write to the database directly, which does not invalidate cached responses
+    response_cache.local.clear()
+
+
 @pytest.fixture(scope="module")
 def user():
     return {"username": "deadpool", "email": "deadpool@example.com", "password": "12345678"}
\ No newline at end of file
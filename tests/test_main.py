@@ -1,4 +1,5 @@
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 
 from main import app
 
@@ -7,4 +8,17 @@ client = TestClient(app)
 
 def test_read_main():
     response = client.get("/")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+
+def test_metrics(client):
+    labels = {"method": "GET", "route": "/api/users/{contact_id}", "status": "401"}
+    before = REGISTRY.get_sample_value("http_requests_total", labels) or 0
+    client.get("/api/users/999999")
+    assert REGISTRY.get_sample_value("http_requests_total", labels) == before + 1
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_bucket{le="0.001",method="GET",route="/api/users/{contact_id}"}' \
+           in response.text
+    assert 'cache_hits_total{cache="user_local"}' in response.text
+    assert 'db_pool_checked_out{pool="primary"}' in response.text
@@ -1,11 +1,18 @@
-from unittest.mock import MagicMock
+import io
+from unittest.mock import AsyncMock, MagicMock
+
+import fakeredis
+from PIL import Image
 
 from src.database.models import User
+from src.services.avatars import avatar_pipeline
+from src.services.hashing import BoundedExecutor
+from src.services.storage import LocalStorage
 
 
 def test_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+    mock_enqueue = AsyncMock()
+    monkeypatch.setattr("src.routes.auth.job_queue.enqueue", mock_enqueue)
     response = client.post(
         "/api/auth/signup",
         json=user,
@@ -14,6 +21,27 @@ def test_create_user(client, user, monkeypatch):
     data = response.json()
     assert data["email"] == user.get("email")
     assert "id" in data
+    mock_enqueue.assert_awaited_once_with("send_email", email=user.get("email"), username=user.get("username"),
+                                          host="http://testserver/")
+
+
+def test_create_user_while_redis_is_down(client, monkeypatch):
+    server = fakeredis.FakeServer()
+    server.connected = False
+    monkeypatch.setattr("src.routes.auth.job_queue.get_client", lambda: fakeredis.aioredis.FakeRedis(server=server))
+    new_user = {"username": "wolverine", "email": "wolverine@example.com", "password": "12345678"}
+    response = client.post("/api/auth/signup", json=new_user)
+    assert response.status_code == 201, response.text
+    # The email can be asked for again, once the queue is back
+    response = client.post("/api/auth/request_email", json={"email": new_user["email"]})
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "30"
+    monkeypatch.undo()
+    mock_enqueue = AsyncMock()
+    monkeypatch.setattr("src.routes.auth.job_queue.enqueue", mock_enqueue)
+    response = client.post("/api/auth/request_email", json={"email": new_user["email"]})
+    assert response.status_code == 200, response.text
+    mock_enqueue.assert_awaited_once()
 
 
 def test_repeat_create_user(client, user):
@@ -66,4 +94,85 @@ def test_login_user_wrong_email(client, user):
     )
     assert response.status_code == 401, response.text
     data = response.json()
-    assert data["detail"] == "Invalid email"
\ No newline at end of file
+    assert data["detail"] == "Invalid email"
+
+
+def test_read_users_me(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    token = response.json()["access_token"]
+    response = client.get("/api/users_prof/me/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["email"] == user.get("email")
+
+
+def test_verified_token_is_cached(client, user, monkeypatch):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    tokens = response.json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/api/users_prof/me/", headers=headers).status_code == 200
+    decode = MagicMock(side_effect=AssertionError("token verified twice"))
+    monkeypatch.setattr("src.services.auth.jwt.decode", decode)
+    assert client.get("/api/users_prof/me/", headers=headers).status_code == 200
+    decode.assert_not_called()
+    monkeypatch.undo()
+    # The scope is still checked for cached tokens
+    client.get("/api/users_prof/me/", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    response = client.get("/api/users_prof/me/", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401, response.text
+
+
+def test_update_avatar(client, user, monkeypatch, tmp_path):
+    monkeypatch.setattr(avatar_pipeline, "storage", LocalStorage(str(tmp_path), "/media/avatars"))
+    monkeypatch.setattr(avatar_pipeline, "processor", BoundedExecutor(workers=1, queue=1, name="avatar-test"))
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    image = io.BytesIO()
+    Image.new("RGB", (640, 480), "blue").save(image, "PNG")
+    files = {"avatar": ("me.png", image.getvalue(), "image/png")}
+    store = MagicMock(wraps=avatar_pipeline.store)
+    monkeypatch.setattr(avatar_pipeline, "store", store)
+
+    response = client.patch("/api/users_prof/avatar", files=files, headers=headers)
+    assert response.status_code == 200, response.text
+    avatar = response.json()["avatar"]
+    assert avatar.startswith("/media/avatars/") and avatar.endswith("-250.jpg")
+    with Image.open(tmp_path / avatar.removeprefix("/media/avatars/")) as stored:
+        assert (stored.format, stored.size) == ("JPEG", (250, 250))
+    assert client.get("/api/users_prof/me/", headers=headers).json()["avatar"] == avatar
+
+    # The same picture again is not processed
+    response = client.patch("/api/users_prof/avatar", files=files, headers=headers)
+    assert response.json()["avatar"] == avatar
+    assert store.call_count == 1
+
+    response = client.patch("/api/users_prof/avatar", files={"avatar": ("me.png", b"not an image")}, headers=headers)
+    assert response.status_code == 422, response.text
+
+
+def test_ops_routes_are_for_operators_only(client, user, monkeypatch):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    update = AsyncMock(return_value={"enabled": True})
+    monkeypatch.setattr("src.routes.ops.sql_profiler.update", update)
+    assert client.get("/api/ops/profiling", headers=headers).status_code == 403
+    assert client.put("/api/ops/profiling", json={"enabled": True}, headers=headers).status_code == 403
+    update.assert_not_awaited()
+
+    monkeypatch.setattr("src.routes.ops.settings.ops_admin_emails", ["Deadpool@example.com"])
+    assert client.get("/api/ops/profiling", headers=headers).status_code == 200
+    response = client.put("/api/ops/profiling", json={"enabled": True}, headers=headers)
+    assert response.status_code == 200, response.text
+    update.assert_awaited_once_with(enabled=True)
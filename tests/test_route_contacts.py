@@ -0,0 +1,366 @@
+import asyncio
+import csv
+import io
+import json
+import time
+from datetime import date, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from main import app
+from src.database import conn_to_db
+from src.database.models import Base, Contact, User
+from src.database.replicas import STICKY_COOKIE, ReplicaSet
+from src.repository.contacts import get_upcoming_birthdays
+from src.schemas import ContactModel
+from src.services.auth import auth_service
+from src.services.rate_limit import rate_limiter
+from src.services.response_cache import response_cache
+
+
+@pytest.fixture()
+def current_user():
+    user = User(id=1, username="deadpool", email="deadpool@example.com", avatar="")
+    app.dependency_overrides[auth_service.get_current_user] = lambda: user
+    yield user
+    del app.dependency_overrides[auth_service.get_current_user]
+
+
+@pytest.fixture(scope="module")
+def contacts(session):
+    rows = [
+        Contact(name="Alice", sure_name="Cooper", email="alice@rock.com", phone_number="+380671112233",
+                birthday="1948-02-04", additional_data="school's out", owner_id=1),
+        Contact(name="Bob", sure_name="Dylan", email="bob@folk.org", phone_number="+380501234567",
+                birthday="1941-05-24", additional_data="blowin in the wind", owner_id=1),
+        Contact(name="Bobby", sure_name="McFerrin", email="bobby@jazz.net", phone_number="+380931112299",
+                birthday="1950-03-11", additional_data="don't worry", owner_id=1),
+    ]
+    session.add_all(rows)
+    session.commit()
+    return [row.id for row in rows]
+
+
+def test_search_by_name_fragment(client, contacts, current_user):
+    response = client.get("/api/users/search", params={"q": "bob"})
+    assert response.status_code == 200, response.text
+    assert {c["email"] for c in response.json()} == {"bob@folk.org", "bobby@jazz.net"}
+
+
+def test_search_by_phone_fragment(client, contacts, current_user):
+    response = client.get("/api/users/search", params={"q": "11122"})
+    assert response.status_code == 200, response.text
+    assert {c["email"] for c in response.json()} == {"alice@rock.com", "bobby@jazz.net"}
+
+
+def test_search_all_fragments_must_match(client, contacts, current_user):
+    response = client.get("/api/users/search", params={"q": "bob wind"})
+    assert response.status_code == 200, response.text
+    assert [c["email"] for c in response.json()] == ["bob@folk.org"]
+
+
+def test_search_follows_updates_and_deletes(client, session, contacts, current_user):
+    contact = session.get(Contact, contacts[0])
+    contact.additional_data = "poison"
+    session.commit()
+    assert [c["email"] for c in client.get("/api/users/search", params={"q": "poison"}).json()] == ["alice@rock.com"]
+    assert client.get("/api/users/search", params={"q": "school"}).json() == []
+
+    session.delete(contact)
+    session.commit()
+    assert client.get("/api/users/search", params={"q": "poison"}).json() == []
+
+
+def test_search_query_too_short(client, current_user):
+    response = client.get("/api/users/search", params={"q": "bo"})
+    assert response.status_code == 422, response.text
+
+
+def test_upcoming_birthdays(client, session, current_user):
+    today = date.today()
+    rows = [Contact(name=f"Born{shift}", sure_name="Soon", email=f"born{shift}@example.com",
+                    phone_number=f"+38050000{shift:04}", birthday=(today + timedelta(days=shift)).isoformat(),
+                    additional_data="", owner_id=1) for shift in (9, 2, 0, 30, 10)]
+    session.add_all(rows)
+    session.commit()
+    response = client.get("/api/users/birthdays", params={"days": 10})
+    assert response.status_code == 200, response.text
+    # Ten days are today and the nine after it
+    assert [c["name"] for c in response.json() if c["name"].startswith("Born")] == ["Born0", "Born2", "Born9"]
+    response = client.get("/api/users/birthdays", params={"days": 1})
+    assert [c["name"] for c in response.json() if c["name"].startswith("Born")] == ["Born0"]
+    assert client.get("/api/users/birthdays", params={"days": 0}).status_code == 422
+
+
+def test_upcoming_birthdays_wrap_around_new_year(session):
+    session.add_all([
+        Contact(name="December", email="dec@example.com", phone_number="+380990000001", birthday="1980-12-30",
+                owner_id=1),
+        Contact(name="January", email="jan@example.com", phone_number="+380990000002", birthday="1985-01-02",
+                owner_id=1),
+        Contact(name="March", email="mar@example.com", phone_number="+380990000003", birthday="1985-03-02",
+                owner_id=1),
+    ])
+    session.commit()
+    contacts = asyncio.run(get_upcoming_birthdays(7, 100, 0, 1, session, today=date(2023, 12, 29)))
+    assert [c.name for c in contacts if c.email.endswith("@example.com")] == ["December", "January"]
+    # December 29 to January 1
+    contacts = asyncio.run(get_upcoming_birthdays(4, 100, 0, 1, session, today=date(2023, 12, 29)))
+    assert [c.name for c in contacts if c.email.endswith("@example.com")] == ["December"]
+
+
+def test_contacts_belong_to_their_owner(client, current_user):
+    body = {"name": "Owned", "sure_name": "Tester", "email": "owned@example.com", "phone_number": "+380991234503",
+            "birthday": "1990-01-01", "additional_data": ""}
+    contact = client.post("/api/users/", json=body).json()
+    other = User(id=2, username="wolverine", email="wolverine@example.com", avatar="")
+    app.dependency_overrides[auth_service.get_current_user] = lambda: other
+    # The same email and phone number may be stored once per owner
+    assert client.post("/api/users/", json=body).status_code == 201
+    assert client.get(f"/api/users/{contact['id']}").status_code == 404
+    assert client.put(f"/api/users/{contact['id']}", json=body).status_code == 404
+    assert client.delete(f"/api/users/{contact['id']}").status_code == 404
+    assert [c["id"] for c in client.get("/api/users/search", params={"q": "owned@"}).json()] != [contact["id"]]
+
+    app.dependency_overrides[auth_service.get_current_user] = lambda: current_user
+    assert [c["id"] for c in client.get("/api/users/search", params={"q": "owned@"}).json()] == [contact["id"]]
+
+
+def test_contacts_require_authentication(client):
+    assert client.get("/api/users/1").status_code == 401
+
+
+def test_birthday_must_be_a_date():
+    with pytest.raises(ValidationError):
+        ContactModel(email="bob@example.com", birthday="184-03-09", additional_data="")
+
+
+def test_import_csv(client, current_user):
+    body = (
+        "name,sure_name,email,phone_number,birthday,additional_data\r\n"
+        "Freddie,Mercury,freddie@queen.com,+447000000001,1946-09-05,\"Bohemian\r\nRhapsody\"\r\n"
+        "Brian,May,not-an-email,+447000000002,1947-07-19,guitar\r\n"
+        "Roger,Taylor,roger@queen.com,+447000000003,1949-07-26,\"drums, \"\"vocals\"\"\"\r\n"
+    )
+    response = client.post("/api/users/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["processed"], report["upserted"], report["failed"]) == (3, 2, 1)
+    assert report["errors"][0]["row"] == 2
+    found = client.get("/api/users/search", params={"q": "Rhapsody"}).json()
+    assert [c["additional_data"] for c in found] == ["Bohemian\r\nRhapsody"]
+
+
+def test_import_ndjson_upserts_and_reports_conflicts(client, current_user):
+    rows = [
+        {"name": "Freddie", "sure_name": "Bulsara", "email": "freddie@queen.com", "phone_number": "+447000000001",
+         "birthday": "1946-09-05", "additional_data": "updated"},
+        {"name": "John", "sure_name": "Deacon", "email": "john@queen.com", "phone_number": "+447000000003",
+         "birthday": "1951-08-19", "additional_data": "bass"},
+        {"name": "Paul", "sure_name": "Rodgers", "email": "paul@queen.com", "phone_number": "+447000000004",
+         "birthday": "1949-12-17", "additional_data": "vocals"},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows) + "\n[1, 2]\n"
+    response = client.post("/api/users/import", params={"format": "ndjson", "batch_size": 2}, content=body)
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["processed"], report["upserted"], report["failed"]) == (4, 2, 2)
+    assert [error["row"] for error in report["errors"]] == [2, 4]
+    found = client.get("/api/users/search", params={"q": "freddie@queen"}).json()
+    assert [(c["sure_name"], c["additional_data"]) for c in found] == [("Bulsara", "updated")]
+
+
+def test_import_unknown_format(client, current_user):
+    response = client.post("/api/users/import", content="<xml/>", headers={"Content-Type": "text/xml"})
+    assert response.status_code == 415, response.text
+
+
+def test_export_ndjson_in_chunks(client, session, current_user, monkeypatch):
+    monkeypatch.setattr("src.services.exporter.settings.export_chunk_size", 2)
+    ids = [row[0] for row in session.query(Contact.id).filter_by(owner_id=1).order_by(Contact.id)]
+    response = client.get("/api/users/export", params={"format": "ndjson"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in exported] == ids
+
+    response = client.get("/api/users/export", params={"format": "ndjson", "after_id": ids[2]})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ids[3:]
+
+
+def test_export_csv(client, session, current_user, monkeypatch):
+    monkeypatch.setattr("src.services.exporter.settings.export_chunk_size", 3)
+    count = session.query(Contact).filter_by(owner_id=1).count()
+    response = client.get("/api/users/export", params={"format": "csv"})
+    assert response.status_code == 200, response.text
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "name", "sure_name", "email", "phone_number", "birthday", "additional_data"]
+    assert len(rows) == count + 1
+
+
+@pytest.fixture()
+def no_rate_limit():
+    limiters = [dep.dependency for route in app.routes for dep in getattr(route, "dependencies", [])]
+    for limiter in limiters:
+        app.dependency_overrides[limiter] = lambda: None
+    yield
+    for limiter in limiters:
+        del app.dependency_overrides[limiter]
+
+
+def test_contact_etag(client, current_user):
+    contact = client.post("/api/users/", json={"name": "Etag", "sure_name": "Tester", "email": "etag@example.com",
+                                               "phone_number": "+380991234500", "birthday": "1990-01-01",
+                                               "additional_data": ""})
+    contact_id, etag = contact.json()["id"], contact.headers["ETag"]
+    response = client.get(f"/api/users/{contact_id}")
+    assert response.headers["ETag"] == etag
+    response = client.get(f"/api/users/{contact_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    updated = client.put(f"/api/users/{contact_id}", json={**contact.json(), "additional_data": "changed"})
+    assert updated.headers["ETag"] != etag
+    response = client.get(f"/api/users/{contact_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["additional_data"] == "changed"
+    assert response.headers["ETag"] == updated.headers["ETag"]
+
+
+def test_uncached_contact_is_revalidated_without_loading(client, current_user, monkeypatch):
+    contact = client.post("/api/users/", json={"name": "Cold", "sure_name": "Tester", "email": "cold@example.com",
+                                               "phone_number": "+380991234510", "birthday": "1990-01-01",
+                                               "additional_data": ""})
+    contact_id, etag = contact.json()["id"], contact.headers["ETag"]
+    monkeypatch.setattr("src.routes.contacts.repository_contacts.get_contact_by_id",
+                        AsyncMock(side_effect=AssertionError("loaded")))
+    response = client.get(f"/api/users/{contact_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    monkeypatch.undo()
+    assert client.get(f"/api/users/{contact_id}", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get("/api/users/100000", headers={"If-None-Match": etag}).status_code == 404
+
+
+def test_page_etag(client, current_user, no_rate_limit):
+    first = client.get("/api/users/", params={"limit": 2})
+    etag = first.headers["ETag"]
+    response = client.get("/api/users/", params={"limit": 2}, headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers.get("X-Next-Cursor") == first.headers.get("X-Next-Cursor")
+
+    contact = first.json()[0]
+    client.put(f"/api/users/{contact['id']}", json={**contact, "additional_data": "changed"})
+    response = client.get("/api/users/", params={"limit": 2}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_cached_contact_is_invalidated_by_writes(client, session, current_user):
+    contact = client.post("/api/users/", json={"name": "Cached", "sure_name": "Tester", "email": "cached@example.com",
+                                               "phone_number": "+380991234501", "birthday": "1990-01-01",
+                                               "additional_data": "first"}).json()
+    assert client.get(f"/api/users/{contact['id']}").json()["additional_data"] == "first"
+    # A write that bypasses the repository is not seen while the response is cached
+    session.query(Contact).filter_by(id=contact["id"]).update({"additional_data": "direct"})
+    session.commit()
+    assert client.get(f"/api/users/{contact['id']}").json()["additional_data"] == "first"
+
+    client.put(f"/api/users/{contact['id']}", json={**contact, "additional_data": "second"})
+    assert client.get(f"/api/users/{contact['id']}").json()["additional_data"] == "second"
+    client.delete(f"/api/users/{contact['id']}")
+    assert client.get(f"/api/users/{contact['id']}").status_code == 404
+
+
+def test_reads_go_to_the_replica(client, session, current_user, monkeypatch, tmp_path):
+    contact = client.post("/api/users/", json={"name": "Replica", "sure_name": "Tester", "email": "lag@example.com",
+                                               "phone_number": "+380991234502", "birthday": "1990-01-01",
+                                               "additional_data": ""}).json()
+    # An empty database stands in for a replica that has not caught up with the write yet
+    replica = create_engine(f"sqlite:///{tmp_path}/replica.db")
+    Base.metadata.create_all(bind=replica)
+    broken = create_engine(f"sqlite:///{tmp_path}/missing/replica.db")
+    replicas = ReplicaSet([sessionmaker(bind=broken), sessionmaker(bind=replica)], retry_after=30)
+    monkeypatch.setattr(conn_to_db, "read_replicas", replicas)
+
+    assert client.get(f"/api/users/{contact['id']}").status_code == 404
+    assert [r["healthy"] for r in replicas.stats()["replicas"]] == [False, True]
+    sticky = {"Cookie": f"{STICKY_COOKIE}={time.time() + 5}"}
+    assert client.get(f"/api/users/{contact['id']}", headers=sticky).status_code == 200
+
+    replicas.mark_down(1, Exception("down"))
+    assert client.get(f"/api/users/{contact['id']}").status_code == 200
+    assert replicas.stats()["fallbacks"] == 1
+    replica.dispose()
+
+
+def test_batch_endpoints(client, current_user):
+    created = [client.post("/api/users/", json={"name": f"Batch{i}", "sure_name": "Tester",
+                                                "email": f"batch{i}@example.com", "phone_number": f"+38099123460{i}",
+                                                "birthday": "1990-01-01", "additional_data": ""}).json()
+               for i in range(3)]
+    ids = [contact["id"] for contact in created]
+
+    response = client.get("/api/users/batch", params={"ids": [ids[1], 999999, ids[0]]})
+    assert response.status_code == 200, response.text
+    assert [(item["id"], item["status"]) for item in response.json()] == [(ids[1], 200), (999999, 404), (ids[0], 200)]
+    assert response.json()[0]["contact"]["email"] == "batch1@example.com"
+
+    updates = [
+        {**created[0], "phone_number": "+380991234699", "additional_data": "changed"},
+        # Takes the email of a contact that keeps it
+        {**created[1], "email": "batch2@example.com"},
+        {**created[2], "id": 999999},
+        # Takes the phone number the first update gave up
+        {**created[2], "phone_number": created[0]["phone_number"]},
+    ]
+    response = client.put("/api/users/batch", json=updates)
+    assert response.status_code == 200, response.text
+    assert [item["status"] for item in response.json()] == [200, 409, 404, 200]
+    assert response.json()[0]["contact"]["additional_data"] == "changed"
+    assert response.json()[3]["contact"]["phone_number"] == created[0]["phone_number"]
+    updated = client.get(f"/api/users/{ids[0]}")
+    assert updated.json()["additional_data"] == "changed"
+    assert updated.headers["ETag"] == f'"c{ids[0]}v2"'
+    assert client.get(f"/api/users/{ids[1]}").json()["email"] == "batch1@example.com"
+
+    response = client.delete("/api/users/batch", params={"ids": [ids[0], ids[2], 999999]})
+    assert [item["status"] for item in response.json()] == [204, 204, 404]
+    assert client.get(f"/api/users/{ids[0]}").status_code == 404
+    assert client.get(f"/api/users/{ids[1]}").status_code == 200
+
+
+def test_batch_limits(client, current_user, monkeypatch):
+    monkeypatch.setattr("src.routes.contacts.settings.batch_max_size", 2)
+    assert client.get("/api/users/batch", params={"ids": [1, 2, 3]}).status_code == 422
+    assert client.delete("/api/users/batch", params={"ids": [1, 1]}).status_code == 422
+
+
+def test_fast_json_renders_the_same_responses(client, contacts, current_user, no_rate_limit, monkeypatch):
+    urls = [f"/api/users/{contacts[2]}", "/api/users/search?q=bob", f"/api/users/batch?ids={contacts[1]}&ids=999999",
+            "/api/users_prof/me/"]
+    openapi = app.openapi()
+    responses = {}
+    for fast_json in (False, True):
+        monkeypatch.setattr("src.services.serialization.settings.fast_json", fast_json)
+        response_cache.local.clear()
+        responses[fast_json] = [client.get(url) for url in urls]
+    for normal, fast in zip(responses[False], responses[True]):
+        assert normal.status_code == fast.status_code == 200, fast.text
+        assert fast.json() == normal.json()
+        assert fast.headers["content-type"] == normal.headers["content-type"]
+    assert app.openapi() == openapi
+
+
+def test_contacts_list_is_rate_limited(client, current_user, monkeypatch):
+    monkeypatch.setattr("src.services.rate_limit.settings.rate_limits", {"contacts_list": "1/60"})
+    monkeypatch.setattr(rate_limiter, "_buckets", type(rate_limiter._buckets)())
+    assert client.get("/api/users/", params={"offset": 100000}).status_code == 200
+    response = client.get("/api/users/", params={"offset": 100000})
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 60
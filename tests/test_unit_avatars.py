@@ -0,0 +1,139 @@
+import hashlib
+import io
+import tempfile
+import unittest
+
+from fastapi import HTTPException
+from PIL import Image
+
+from src.services.avatars import AvatarPipeline, read_upload, render_avatar
+from src.services.hashing import BoundedExecutor
+from src.services.storage import AvatarStorage, LocalStorage
+
+
+def image_bytes(size=(600, 400), mode="RGB", color="red", fmt="JPEG", **options) -> bytes:
+    out = io.BytesIO()
+    Image.new(mode, size, color).save(out, fmt, **options)
+    return out.getvalue()
+
+
+def multipart(*parts: tuple[str, bytes], boundary: str = "b0undary") -> bytes:
+    body = b""
+    for name, content in parts:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.bin"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+async def in_chunks(body: bytes, size: int = 7):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+class TestReadUpload(unittest.IsolatedAsyncioTestCase):
+    content_type = "multipart/form-data; boundary=b0undary"
+
+    async def test_reads_the_field_across_chunks(self):
+        image = image_bytes()
+        body = multipart(("other", b"x" * 500), ("avatar", image))
+        data, digest = await read_upload(in_chunks(body), self.content_type, "avatar", len(image))
+        self.assertEqual(data, image)
+        self.assertEqual(digest, hashlib.sha256(image).hexdigest())
+
+    async def test_rejects(self):
+        cases = [
+            (multipart(("avatar", b"x" * 1001)), self.content_type, 413),
+            (multipart(("other", b"x")), self.content_type, 422),
+            (b"x", "application/octet-stream", 415),
+        ]
+        for body, content_type, status_code in cases:
+            with self.subTest(status_code), self.assertRaises(HTTPException) as e:
+                await read_upload(in_chunks(body), content_type, "avatar", 1000)
+            self.assertEqual(e.exception.status_code, status_code)
+
+
+class TestRenderAvatar(unittest.TestCase):
+
+    def render(self, data: bytes, max_pixels: int = 10 ** 7) -> Image.Image:
+        return Image.open(io.BytesIO(render_avatar(data, 50, 85, max_pixels)))
+
+    def test_square_jpeg(self):
+        for data in (image_bytes(), image_bytes((30, 90), fmt="PNG")):
+            avatar = self.render(data)
+            self.assertEqual((avatar.format, avatar.size, avatar.mode), ("JPEG", (50, 50), "RGB"))
+
+    def test_transparency_becomes_white(self):
+        avatar = self.render(image_bytes(mode="RGBA", color=(0, 0, 0, 0), fmt="PNG"))
+        self.assertTrue(all(channel > 250 for channel in avatar.getpixel((25, 25))))
+
+    def test_orientation(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees
+        data = image_bytes((100, 50), exif=exif.tobytes())
+        with Image.open(io.BytesIO(render_avatar(data, 40, 85, 10 ** 7))) as avatar:
+            self.assertNotIn(0x0112, avatar.getexif())
+
+    def test_too_many_pixels(self):
+        with self.assertRaises(ValueError):
+            render_avatar(image_bytes((200, 200)), 50, 85, max_pixels=200 * 199)
+
+
+class TestAvatarPipeline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.processor = BoundedExecutor(workers=1, queue=1, name="avatar-test")
+        self.addCleanup(self.processor.shutdown)
+        self.storage = LocalStorage(self.directory.name, "/media/avatars/")
+        self.pipeline = AvatarPipeline(self.storage, self.processor, size=50, quality=85, max_pixels=10 ** 7)
+
+    async def test_same_upload_is_stored_once(self):
+        data = image_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        url = await self.pipeline.store(data, digest)
+        self.assertEqual(url, f"/media/avatars/{digest[:2]}/{digest}-50.jpg")
+        self.assertEqual(url, self.pipeline.url(digest))
+        with Image.open(self.storage.path(self.pipeline.key(digest))) as avatar:
+            self.assertEqual(avatar.size, (50, 50))
+        self.assertEqual(await self.pipeline.store(data, digest), url)
+        self.assertEqual((self.pipeline.processed, self.pipeline.reused), (1, 1))
+
+    async def test_not_an_image(self):
+        with self.assertRaises(HTTPException) as e:
+            await self.pipeline.store(b"not an image", "0" * 64)
+        self.assertEqual(e.exception.status_code, 422)
+        self.assertFalse(await self.storage.exists(self.pipeline.key("0" * 64)))
+
+    async def test_delete(self):
+        data = image_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        await self.pipeline.store(data, digest)
+        await self.storage.delete(self.pipeline.key(digest))
+        self.assertFalse(await self.storage.exists(self.pipeline.key(digest)))
+        await self.storage.delete(self.pipeline.key(digest))
+
+    def test_incomplete_storage_cannot_be_created(self):
+        class NoDelete(AvatarStorage):
+            def url(self, key: str) -> str:
+                return key
+
+            async def exists(self, key: str) -> bool:
+                return False
+
+            async def save(self, key: str, data: bytes, content_type: str):
+                pass
+
+        with self.assertRaises(TypeError):
+            NoDelete()
+
+    async def test_runs_in_a_process_pool(self):
+        self.pipeline.processor = BoundedExecutor(workers=1, queue=1, name="avatar-test", processes=True)
+        self.addCleanup(self.pipeline.processor.shutdown)
+        data = image_bytes()
+        await self.pipeline.store(data, hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.pipeline.processor.stats()["completed"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
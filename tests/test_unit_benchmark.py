@@ -0,0 +1,37 @@
+import unittest
+
+from benchmarks.http_bench import compare, percentile, summarize
+
+
+class TestBenchmarkStats(unittest.TestCase):
+
+    def test_percentile_nearest_rank(self):
+        values = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 0.05)
+        self.assertEqual(percentile(values, 99), 0.099)
+        self.assertEqual(percentile(values, 100), 0.1)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_summarize_counts_errors(self):
+        result = summarize([0.01, 0.02, 0.03, 0.04], {200: 3, 404: 1}, elapsed=0.05)
+        self.assertEqual(result["throughput_rps"], 80.0)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(result["p50_ms"], 20.0)
+        self.assertEqual(result["statuses"], {"200": 3, "404": 1})
+
+    def test_compare_flags_regressions(self):
+        def run(**results):
+            return {"results": {name: {"throughput_rps": rps, "p95_ms": p95, "errors": errors}
+                                for name, (rps, p95, errors) in results.items()}}
+
+        base = run(steady=(100, 10, 0), slower=(100, 10, 0), failing=(100, 10, 0), removed=(100, 10, 0))
+        new = run(steady=(95, 10.5, 0), slower=(80, 14, 0), failing=(100, 10, 3), added=(1, 1000, 0))
+        rows, regressed = compare(base, new, threshold=0.1)
+        self.assertTrue(regressed)
+        self.assertEqual({row["scenario"]: row["regressions"] for row in rows},
+                         {"steady": [], "slower": ["throughput", "p95"], "failing": ["errors"]})
+        self.assertFalse(compare(base, base, threshold=0.1)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import json
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import redis
+
+from src.database.models import User
+from src.services.cache import LRUCache, TokenCache, UserCache, USER_CACHE_VERSION, USER_INVALIDATION_CHANNEL
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(maxsize=10, ttl=5)
+        with patch("src.services.cache.time.monotonic", return_value=100):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=50)
+        with patch("src.services.cache.time.monotonic", return_value=106):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.get = AsyncMock(return_value=None)
+        self.redis.set = AsyncMock()
+        self.pipeline = self.redis.pipeline.return_value
+        self.pipeline.execute = AsyncMock()
+        self.cache = UserCache(lambda: self.redis, maxsize=10, ttl=60, redis_ttl=900)
+        self.user = User(id=1, username="deadpool", email="deadpool@example.com", avatar="a.png",
+                         password="secret", refresh_token="token", confirmed=True)
+
+    async def test_set_stores_compact_versioned_json(self):
+        await self.cache.set(self.user)
+        key, payload = self.redis.set.call_args.args
+        self.assertEqual(key, f"user:v{USER_CACHE_VERSION}:deadpool@example.com")
+        self.assertEqual(json.loads(payload), {"v": USER_CACHE_VERSION, "id": 1, "username": "deadpool",
+                                               "email": "deadpool@example.com", "avatar": "a.png",
+                                               "confirmed": True})
+        self.assertEqual(self.redis.set.call_args.kwargs, {"ex": 900})
+
+    async def test_local_tier_is_checked_first(self):
+        await self.cache.set(self.user)
+        self.assertEqual((await self.cache.get("deadpool@example.com")).id, 1)
+        self.redis.get.assert_not_called()
+
+    async def test_redis_tier_fills_local_tier(self):
+        self.redis.get.return_value = json.dumps({"v": USER_CACHE_VERSION, "id": 1, "username": "deadpool",
+                                                  "email": "deadpool@example.com", "avatar": None,
+                                                  "confirmed": True})
+        self.assertEqual((await self.cache.get("deadpool@example.com")).username, "deadpool")
+        self.assertEqual((await self.cache.get("deadpool@example.com")).username, "deadpool")
+        self.redis.get.assert_called_once()
+        self.assertEqual(self.cache.redis_hits, 1)
+
+    async def test_other_versions_are_ignored(self):
+        self.redis.get.return_value = json.dumps({"v": USER_CACHE_VERSION + 1, "id": 1})
+        self.assertIsNone(await self.cache.get("deadpool@example.com"))
+        self.assertEqual(self.cache.redis_misses, 1)
+
+    async def test_invalidate_drops_both_tiers_and_notifies_workers(self):
+        await self.cache.set(self.user)
+        await self.cache.invalidate("deadpool@example.com")
+        self.assertIsNone(self.cache.local.get("deadpool@example.com"))
+        self.pipeline.delete.assert_called_once_with(f"user:v{USER_CACHE_VERSION}:deadpool@example.com")
+        self.pipeline.publish.assert_called_once_with(USER_INVALIDATION_CHANNEL, "deadpool@example.com")
+        self.pipeline.execute.assert_awaited_once()
+
+    async def test_invalidation_from_other_worker(self):
+        await self.cache.set(self.user)
+        self.cache._on_invalidate({"data": b"deadpool@example.com"})
+        self.assertIsNone(self.cache.local.get("deadpool@example.com"))
+
+    async def test_redis_errors_are_a_miss(self):
+        self.redis.get.side_effect = redis.ConnectionError("down")
+        self.redis.set.side_effect = redis.ConnectionError("down")
+        self.assertIsNone(await self.cache.get("deadpool@example.com"))
+        self.assertEqual((await self.cache.set(self.user)).email, "deadpool@example.com")
+        self.assertEqual(self.cache.redis_errors, 2)
+
+    async def test_invalidation_notifies_subscribers(self):
+        dropped = []
+        self.cache.subscribers.append(dropped.append)
+        await self.cache.invalidate("deadpool@example.com")
+        self.cache._on_invalidate({"data": b"deadpool@example.com"})
+        self.assertEqual(dropped, ["deadpool@example.com"] * 2)
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TokenCache(maxsize=10)
+
+    def test_entry_expires_with_token(self):
+        with patch("src.services.cache.time.time", return_value=1000), \
+                patch("src.services.cache.time.monotonic", return_value=100):
+            self.cache.set("token", {"sub": "deadpool@example.com", "scope": "access_token", "exp": 1030})
+            self.cache.set("expired", {"sub": "deadpool@example.com", "scope": "access_token", "exp": 999})
+        with patch("src.services.cache.time.monotonic", return_value=129):
+            self.assertEqual(self.cache.get("token"), {"sub": "deadpool@example.com", "scope": "access_token"})
+            self.assertIsNone(self.cache.get("expired"))
+        with patch("src.services.cache.time.monotonic", return_value=130):
+            self.assertIsNone(self.cache.get("token"))
+
+    def test_revoke_drops_tokens_of_user(self):
+        exp = time.time() + 60
+        self.cache.set("a", {"sub": "deadpool@example.com", "scope": "access_token", "exp": exp})
+        self.cache.set("b", {"sub": "wolverine@example.com", "scope": "access_token", "exp": exp})
+        self.cache.revoke("deadpool@example.com")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("b"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import json
+import unittest
+import zlib
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from src.services.compression import CompressionMiddleware, accepted_encoding, decoded_etags, encoded_etag
+from src.services.etag import etag_matches, not_modified
+
+ROWS = [{"id": i, "name": f"Contact{i}", "email": f"contact{i}@example.com"} for i in range(100)]
+
+
+def make_app(chunks: list[bytes]):
+    app = FastAPI()
+
+    @app.get("/page")
+    async def page(request: Request):
+        if etag_matches(request.headers.get("if-none-match"), '"p1"'):
+            return not_modified('"p1"')
+        return JSONResponse(ROWS, headers={"ETag": '"p1"'})
+
+    @app.get("/small")
+    async def small():
+        return JSONResponse({"id": 1})
+
+    @app.get("/html")
+    async def html():
+        return PlainTextResponse("<p>" * 1000, media_type="text/html")
+
+    @app.get("/export")
+    async def export():
+        async def rows():
+            for chunk in chunks:
+                yield chunk
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=500,
+                       content_types=["application/json", "application/x-ndjson"], levels={"gzip": 6, "br": 4})
+    return app
+
+
+async def call(app, path: str, headers: dict) -> tuple[dict, list[bytes]]:
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # The client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "server": ("test", 80),
+             "client": ("test", 1234), "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    await app(scope, receive, send)
+    start = messages[0]
+    return ({"status": start["status"], **{k.decode(): v.decode() for k, v in start["headers"]}},
+            [m.get("body", b"") for m in messages[1:]])
+
+
+class TestAcceptedEncoding(unittest.TestCase):
+
+    def test_preference_and_quality(self):
+        self.assertEqual(accepted_encoding("gzip, deflate", ("br", "gzip")), "gzip")
+        self.assertEqual(accepted_encoding("gzip;q=0.5, br", ("br", "gzip")), "br")
+        self.assertEqual(accepted_encoding("br;q=0, *", ("br", "gzip")), "gzip")
+        self.assertIsNone(accepted_encoding("identity", ("br", "gzip")))
+        self.assertIsNone(accepted_encoding("gzip;q=0", ("gzip",)))
+        self.assertIsNone(accepted_encoding("", ("gzip",)))
+
+    def test_etags(self):
+        self.assertEqual(encoded_etag('"c1v2"', "gzip"), '"c1v2-gzip"')
+        self.assertEqual(encoded_etag('W/"c1v2"', "gzip"), 'W/"c1v2"')
+        self.assertEqual(decoded_etags('"c1v2-gzip", "c2v1"', "gzip"), '"c1v2", "c2v1"')
+
+
+class TestCompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def test_large_json_is_compressed(self):
+        headers, bodies = await call(make_app([]), "/page", {"Accept-Encoding": "gzip"})
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        self.assertEqual(headers["etag"], '"p1-gzip"')
+        self.assertEqual(int(headers["content-length"]), len(b"".join(bodies)))
+        self.assertEqual(json.loads(gzip.decompress(b"".join(bodies))), ROWS)
+
+    async def test_not_compressed(self):
+        app = make_app([])
+        for path, accept_encoding in (("/small", "gzip"), ("/html", "gzip"), ("/page", "identity")):
+            headers, bodies = await call(app, path, {"Accept-Encoding": accept_encoding})
+            self.assertNotIn("content-encoding", headers, path)
+        self.assertEqual(headers["etag"], '"p1"')
+
+    async def test_revalidation_of_the_compressed_representation(self):
+        app = make_app([])
+        headers, _ = await call(app, "/page", {"Accept-Encoding": "gzip", "If-None-Match": '"p1-gzip"'})
+        self.assertEqual((headers["status"], headers["etag"]), (304, '"p1-gzip"'))
+        headers, _ = await call(app, "/page", {"Accept-Encoding": "gzip", "If-None-Match": '"p1"'})
+        self.assertEqual((headers["status"], headers["etag"]), (304, '"p1"'))
+
+    async def test_stream_is_compressed_chunk_by_chunk(self):
+        chunks = [json.dumps(row).encode() + b"\n" for row in ROWS[:3]]
+        headers, bodies = await call(make_app(chunks), "/export", {"Accept-Encoding": "gzip"})
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", headers)
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        # Every chunk can be decoded as soon as it arrives
+        received = [decompressor.decompress(body) for body in bodies]
+        self.assertEqual(received[:3], chunks)
+        self.assertEqual(b"".join(received), b"".join(chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
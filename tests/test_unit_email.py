@@ -0,0 +1,97 @@
+import asyncio
+import email
+import socket
+import unittest
+from unittest.mock import patch
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+
+from src.services.email import SMTPPool, build_message, send_email
+
+
+class Inbox(Sink):
+
+    def __init__(self):
+        self.messages = []
+        self.servers = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.content.decode())
+        # The protocol instance of the connection the message came in on
+        self.servers.append(server)
+        return "250 OK"
+
+    def connections(self) -> int:
+        return len(set(map(id, self.servers)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestSMTPPool(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.inbox = Inbox()
+        self.port = free_port()
+        self.server = Controller(self.inbox, hostname="127.0.0.1", port=self.port)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def pool(self, **options) -> SMTPPool:
+        options = {"size": 2, "idle_timeout": 60, "max_messages": 100, **options}
+        return SMTPPool(lambda: aiosmtplib.SMTP(hostname="127.0.0.1", port=self.port), **options)
+
+    def message(self, i: int):
+        return build_message(f"user{i}@example.com", "Confirm your email!", "email_template.html",
+                             host="http://test/", username=f"user{i}", token=f"token{i}")
+
+    async def test_messages_share_a_connection(self):
+        pool = self.pool()
+        await pool.send(self.message(0), self.message(1))
+        await pool.send(self.message(2))
+        await pool.close()
+        self.assertEqual(len(self.inbox.messages), 3)
+        self.assertEqual(self.inbox.connections(), 1)
+        self.assertEqual(pool.stats(), {"idle": 0, "opened": 1, "reconnects": 0, "sent": 3})
+
+    async def test_connection_is_replaced(self):
+        pool = self.pool(max_messages=2)
+        await pool.send(*(self.message(i) for i in range(3)))
+        self.assertEqual(pool.opened, 2)
+        pool.idle_timeout = 0
+        await pool.send(self.message(3))
+        self.assertEqual(pool.opened, 3)
+        await pool.close()
+
+    async def test_reconnect_after_the_server_dropped_the_connection(self):
+        pool = self.pool()
+        await pool.send(self.message(0))
+        self.server.loop.call_soon_threadsafe(self.inbox.servers[0].transport.close)
+        await asyncio.sleep(0.1)
+        await pool.send(self.message(1))
+        self.assertEqual((pool.opened, pool.sent), (2, 2))
+        self.assertEqual(self.inbox.connections(), 2)
+        await pool.close()
+
+    async def test_send_email(self):
+        pool = self.pool()
+        with patch("src.services.email.smtp_pool", pool):
+            await send_email("new@example.com", "<b>new</b>", "http://test/")
+        await pool.close()
+        message = email.message_from_string(self.inbox.messages[0])
+        body = message.get_payload(decode=True).decode()
+        self.assertEqual(message["To"], "new@example.com")
+        self.assertIn('href="http://test/api/auth/confirmed_email/', body)
+        # The template escapes what users typed
+        self.assertIn("Hi &lt;b&gt;new&lt;/b&gt;,", body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import asyncio
+import threading
+import unittest
+
+from fastapi import HTTPException
+
+from src.services.hashing import BoundedExecutor
+
+
+class TestBoundedExecutor(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.pool = BoundedExecutor(workers=1, queue=1, name="test")
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    async def test_runs_on_worker_thread(self):
+        name = await self.pool.run(lambda: threading.current_thread().name)
+        self.assertTrue(name.startswith("test"))
+        self.assertEqual(self.pool.stats()["completed"], 1)
+
+    async def test_rejects_when_saturated(self):
+        release = threading.Event()
+        running = [asyncio.ensure_future(self.pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with self.assertRaises(HTTPException) as e:
+            await self.pool.run(release.wait)
+        self.assertEqual(e.exception.status_code, 503)
+        self.assertEqual(e.exception.headers, {"Retry-After": "1"})
+        release.set()
+        await asyncio.gather(*running)
+        self.assertEqual(self.pool.stats()["pending"], 0)
+        self.assertEqual(self.pool.stats()["rejected"], 1)
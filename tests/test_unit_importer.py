@@ -0,0 +1,35 @@
+import unittest
+
+from src.services.importer import iter_csv_records, iter_lines
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+class TestImporter(unittest.IsolatedAsyncioTestCase):
+
+    async def test_lines_split_across_chunks(self):
+        data = "Ім'я,email\nЖанна,zh@example.com\nОстап,o@example.com".encode()
+        for size in (1, 2, 3, 7, len(data)):
+            lines = await collect(iter_lines(chunked(data, size)))
+            self.assertEqual(lines, ["Ім'я,email\n", "Жанна,zh@example.com\n", "Остап,o@example.com"])
+
+    async def test_csv_quoted_line_breaks(self):
+        data = b'name,note\nBob,"line one\nline ""two"""\nAlice,\n'
+        records = await collect(iter_csv_records(iter_lines(chunked(data, 4))))
+        self.assertEqual(records, [(1, {"name": "Bob", "note": 'line one\nline "two"'}),
+                                   (2, {"name": "Alice", "note": ""})])
+
+    async def test_csv_field_count_mismatch(self):
+        records = await collect(iter_csv_records(iter_lines(chunked(b"a,b\n1,2,3\n", 100))))
+        self.assertEqual(records, [(1, "Expected 2 fields, got 3")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import fakeredis
+
+from src.services.jobs import JOBS_BY_NAME, JobQueue, JobWorker
+
+
+class TestJobQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        self.queue = JobQueue(lambda: client, stream="jobs", group="workers", max_attempts=2, retry_base=0,
+                              retry_max=0, visibility_timeout=60)
+        await self.queue.create_group()
+        self.handler = AsyncMock()
+        patcher = patch.dict(JOBS_BY_NAME, {"greet": self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def run_worker(self, worker: JobWorker, polls: int = 3):
+        for _ in range(polls):
+            await worker.poll()
+            await worker.drain()
+
+    async def test_jobs_run_once(self):
+        for i in range(3):
+            await self.queue.enqueue("greet", name=f"user{i}")
+        await self.run_worker(JobWorker(self.queue, concurrency=2, consumer="a"))
+        self.assertEqual(sorted(call.kwargs["name"] for call in self.handler.await_args_list),
+                         ["user0", "user1", "user2"])
+        self.assertEqual(await self.queue.depth(), {"ready": 0, "pending": 0, "delayed": 0, "dead": 0})
+
+    async def test_failed_job_is_retried_then_dead_lettered(self):
+        self.handler.side_effect = [ConnectionError("smtp down"), None]
+        await self.queue.enqueue("greet", name="retried")
+        await self.queue.enqueue("unknown")
+        worker = JobWorker(self.queue, concurrency=4, consumer="a")
+        with self.assertLogs(level="WARNING"):
+            await self.run_worker(worker)
+        self.assertEqual(self.handler.await_count, 2)
+        depth = await self.queue.depth()
+        self.assertEqual((depth["delayed"], depth["dead"]), (0, 1))
+
+        self.handler.side_effect = ConnectionError("smtp down")
+        await self.queue.enqueue("greet", name="failing")
+        with self.assertLogs(level="WARNING"):
+            await self.run_worker(worker)
+        self.assertEqual(self.handler.await_count, 4)
+        self.assertEqual((await self.queue.depth())["dead"], 2)
+
+    async def test_jobs_of_a_dead_worker_are_claimed(self):
+        await self.queue.enqueue("greet", name="orphan")
+        # A worker takes the job and dies before running it
+        self.assertEqual(len(await self.queue.read("dead-worker", 10)), 1)
+        self.assertEqual((await self.queue.depth())["pending"], 1)
+        self.queue.visibility_timeout = 0
+        await self.run_worker(JobWorker(self.queue, concurrency=1, consumer="b"), polls=1)
+        self.handler.assert_awaited_once_with(name="orphan")
+        self.assertEqual((await self.queue.depth())["pending"], 0)
+
+    def test_backoff(self):
+        self.queue.retry_base, self.queue.retry_max = 5, 60
+        self.assertTrue(2.5 <= self.queue.backoff(1) <= 5)
+        self.assertTrue(10 <= self.queue.backoff(3) <= 20)
+        self.assertTrue(30 <= self.queue.backoff(10) <= 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
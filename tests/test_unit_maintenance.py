@@ -0,0 +1,27 @@
+import unittest
+
+from sqlalchemy import create_engine
+
+from src.database.maintenance import add_missing_columns
+from src.database.models import Contact
+
+
+class TestAddMissingColumns(unittest.TestCase):
+
+    def test_new_column_gets_its_foreign_key(self):
+        engine = create_engine("sqlite://")
+        self.addCleanup(engine.dispose)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+            # The contacts table from before contacts had owners
+            connection.exec_driver_sql("CREATE TABLE contacts (id INTEGER PRIMARY KEY, name VARCHAR, "
+                                       "sure_name VARCHAR, email VARCHAR, phone_number VARCHAR, birthday VARCHAR, "
+                                       "additional_data VARCHAR, created_at DATETIME, updated_at DATETIME)")
+            add_missing_columns(connection, Contact.__table__)
+            foreign_keys = connection.exec_driver_sql("PRAGMA foreign_key_list(contacts)").all()
+        self.assertEqual([(fk.table, fk._mapping["from"], fk.to, fk.on_delete) for fk in foreign_keys],
+                         [("users", "owner_id", "id", "CASCADE")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.services.metrics import RequestStats, instrument_engine, observe_redis, request_stats
+
+
+class TestRequestStats(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.stats = RequestStats("/test")
+        self.token = request_stats.set(self.stats)
+
+    def tearDown(self):
+        request_stats.reset(self.token)
+
+    def test_sync_engine_statements_are_counted(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        self.assertEqual(self.stats.db_queries, 2)
+        self.assertGreater(self.stats.db_time, 0)
+
+    async def test_async_engine_statements_are_counted(self):
+        engine = create_async_engine("sqlite+aiosqlite://")
+        instrument_engine(engine.sync_engine)
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        await engine.dispose()
+        self.assertEqual(self.stats.db_queries, 1)
+
+    def test_failed_statement_is_not_left_open(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        with engine.connect() as connection:
+            with self.assertRaises(Exception):
+                connection.execute(text("SELECT * FROM missing"))
+            self.assertEqual(connection.info["query_start"], [])
+
+    def test_redis_round_trips(self):
+        before = REGISTRY.get_sample_value("redis_command_duration_seconds_count", {"command": "GET"}) or 0
+        observe_redis("GET", 0.001)
+        self.assertEqual(self.stats.redis_calls, 1)
+        self.assertEqual(REGISTRY.get_sample_value("redis_command_duration_seconds_count", {"command": "GET"}),
+                         before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
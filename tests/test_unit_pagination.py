@@ -0,0 +1,24 @@
+import unittest
+
+from src.services.pagination import decode_cursor, encode_cursor
+
+
+class TestCursor(unittest.TestCase):
+
+    def test_round_trip(self):
+        cursor = encode_cursor("name", "Bob", 42)
+        self.assertEqual(decode_cursor(cursor, "name"), ("Bob", 42))
+
+    def test_sort_mismatch(self):
+        cursor = encode_cursor("name", "Bob", 42)
+        with self.assertRaises(ValueError):
+            decode_cursor(cursor, "id")
+
+    def test_malformed(self):
+        for cursor in ("not-a-cursor", "", encode_cursor("id", 1, 2)[:-3]):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, "id")
+
+
+if __name__ == '__main__':
+    unittest.main()
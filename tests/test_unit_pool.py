@@ -0,0 +1,43 @@
+import unittest
+
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database.pool import TimedAsyncAdaptedQueuePool, TimedQueuePool
+
+
+class TestTimedPool(unittest.IsolatedAsyncioTestCase):
+
+    def test_checkouts_are_counted(self):
+        engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=2, max_overflow=1)
+        first, second, third = engine.connect(), engine.connect(), engine.connect()
+        stats = engine.pool.stats()
+        self.assertEqual((stats["checked_out"], stats["overflow"], stats["checkouts"]), (3, 1, 3))
+        for connection in (first, second, third):
+            connection.close()
+        stats = engine.pool.stats()
+        self.assertEqual((stats["checked_out"], stats["checked_in"]), (0, 2))
+        engine.dispose()
+
+    def test_timeout_is_counted(self):
+        engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0,
+                               pool_timeout=0.05)
+        with engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                engine.connect()
+        stats = engine.pool.stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["max_wait"], 0.05)
+        engine.dispose()
+
+    async def test_async_pool(self):
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=TimedAsyncAdaptedQueuePool, pool_size=1,
+                                     max_overflow=0)
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            self.assertEqual(engine.sync_engine.pool.stats()["checked_out"], 1)
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
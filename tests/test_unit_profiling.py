@@ -0,0 +1,83 @@
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from sqlalchemy import create_engine, text
+
+from src.services.metrics import RequestStats, instrument_engine, request_stats
+from src.services.profiling import SQLProfiler, parameter_fingerprint, sql_profiler
+
+
+class TestParameterFingerprint(unittest.TestCase):
+
+    def test_values_are_not_logged(self):
+        fingerprint = parameter_fingerprint(("secret@example.com", 7))
+        self.assertTrue(fingerprint.startswith("str,int#"))
+        self.assertNotIn("secret", fingerprint)
+
+    def test_equal_values_have_equal_fingerprints(self):
+        self.assertEqual(parameter_fingerprint({"id": 1}), parameter_fingerprint({"id": 1}))
+        self.assertNotEqual(parameter_fingerprint({"id": 1}), parameter_fingerprint({"id": 2}))
+
+    def test_executemany(self):
+        self.assertTrue(parameter_fingerprint([(1, "a"), (2, "b")]).startswith("many[2]:int,str#"))
+
+
+class TestSQLProfiler(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.profiler = SQLProfiler(MagicMock(), enabled=True, slow_query_ms=100, n_plus_one_threshold=3)
+        self.stats = RequestStats("/api/contacts")
+
+    def test_slow_query_is_logged(self):
+        with self.assertLogs("sql", level="WARNING") as logs:
+            self.profiler.on_statement(None, "SELECT 1", (), 0.2)
+        self.profiler.on_statement(None, "SELECT 1", (), 0.01)
+        self.assertEqual(self.profiler.slow_queries, 1)
+        self.assertEqual(json.loads(logs.records[0].getMessage())["event"], "slow_query")
+
+    def test_n_plus_one_is_flagged(self):
+        for contact_id in range(4):
+            self.profiler.on_statement(self.stats, "SELECT * FROM users WHERE id = ?", (contact_id,), 0.001)
+        self.profiler.on_statement(self.stats, "SELECT * FROM contacts", (), 0.001)
+        with self.assertLogs("sql", level="WARNING") as logs:
+            self.profiler.on_request_end(self.stats)
+        profile = json.loads(logs.records[0].getMessage())
+        self.assertEqual(profile["distinct_statements"], 2)
+        self.assertEqual(profile["n_plus_one"][0]["count"], 4)
+        self.assertEqual(profile["n_plus_one"][0]["distinct_parameters"], 4)
+        self.assertEqual(self.profiler.n_plus_one, 1)
+
+    def test_disabled_profiler_records_nothing(self):
+        self.profiler.configure(enabled=False)
+        self.profiler.on_statement(self.stats, "SELECT 1", (), 0.001)
+        self.assertIsNone(self.stats.statements)
+
+    async def test_update_is_published(self):
+        client = MagicMock()
+        client.publish = AsyncMock()
+        self.profiler.get_client = lambda: client
+        config = await self.profiler.update(slow_query_ms=50, enabled=None)
+        self.assertEqual(config, {"enabled": True, "slow_query_ms": 50, "n_plus_one_threshold": 3})
+        self.profiler._on_message({"data": json.dumps({**config, "enabled": False})})
+        self.assertFalse(self.profiler.enabled)
+
+    def test_engine_statements_reach_the_profiler(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        enabled = sql_profiler.enabled
+        sql_profiler.configure(enabled=True)
+        token = request_stats.set(self.stats)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT :x"), {"x": 1})
+                connection.execute(text("SELECT :x"), {"x": 1})
+        finally:
+            request_stats.reset(token)
+            sql_profiler.configure(enabled=enabled)
+        count, _, fingerprints = self.stats.statements["SELECT ?"]
+        self.assertEqual((count, len(fingerprints)), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+
+from src.services.auth import auth_service
+from src.services.rate_limit import RateLimiter, client_key, parse_policy
+
+
+def fake_request(headers: dict | None = None, host: str = "10.0.0.1"):
+    request = MagicMock()
+    request.headers = headers or {}
+    request.client.host = host
+    return request
+
+
+@patch("src.services.rate_limit.settings.rate_limits", {"test": "2/10"})
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        client = fakeredis.aioredis.FakeRedis(server=self.server)
+        self.workers = [RateLimiter(lambda: client, sync_interval=0.1, maxsize=100) for _ in range(2)]
+
+    def test_parse_policy(self):
+        self.assertEqual(parse_policy("2/5"), (2, 5.0))
+
+    def test_bucket(self):
+        worker = self.workers[0]
+        self.assertEqual([worker.hit("test", "a"), worker.hit("test", "a")], [0, 0])
+        self.assertAlmostEqual(worker.hit("test", "a"), 5, places=1)
+        self.assertEqual(worker.hit("test", "b"), 0)
+        # Half the period later one token is back
+        worker._buckets[("test", "a")].updated -= 5
+        self.assertEqual(worker.hit("test", "a"), 0)
+        self.assertEqual(worker.stats()["rejected"], 1)
+
+    async def test_workers_share_the_bucket(self):
+        first, second = self.workers
+        second.hit("test", "a")
+        await second.sync()
+        first.hit("test", "a")
+        await first.sync()
+        await second.sync()
+        # The token taken on the first worker is gone on the second one as well
+        self.assertGreater(second.hit("test", "a"), 0)
+        self.assertEqual(second.stats()["syncs"], 2)
+
+    async def test_failed_sync_is_retried(self):
+        worker = self.workers[0]
+        worker.hit("test", "a")
+        self.server.connected = False
+        with self.assertLogs(level="WARNING"):
+            await worker.sync()
+        self.assertEqual(worker._buckets[("test", "a")].pending, 1)
+        self.server.connected = True
+        await worker.sync()
+        self.assertEqual(worker._buckets[("test", "a")].pending, 0)
+        self.assertEqual(worker.stats()["sync_failures"], 1)
+
+
+class TestClientKey(unittest.TestCase):
+
+    def test_user_or_ip(self):
+        with patch.object(auth_service, "token_claims", return_value={"sub": "a@example.com", "scope": "access_token"}):
+            self.assertEqual(client_key(fake_request({"authorization": "Bearer token"})), "user:a@example.com")
+        with patch.object(auth_service, "token_claims", return_value=None):
+            self.assertEqual(client_key(fake_request({"authorization": "Bearer forged"})), "ip:10.0.0.1")
+        self.assertEqual(client_key(fake_request()), "ip:10.0.0.1")
+
+
+if __name__ == '__main__':
+    unittest.main()
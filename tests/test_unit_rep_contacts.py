@@ -1,6 +1,7 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from src.database.models import Contact
@@ -17,21 +18,30 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         limit = 10
         offset = 0
         contacts = [Contact() for _ in range(5)]
-        self.session.query(Contact()).limit().offset().all.return_value = contacts
-        result = await get_contacts(limit=limit, offset=offset, db=self.session)
+        self.session.execute().scalars().all.return_value = contacts
+        result = await get_contacts(limit=limit, offset=offset, owner_id=1, db=self.session)
         self.assertEqual(result, contacts)
 
+    async def test_get_contacts_after_cursor(self):
+        await get_contacts(limit=10, offset=50, owner_id=1, db=self.session, sort_by="name", after=("Bob", 7))
+        stmt = self.session.execute.call_args.args[0]
+        sql = str(stmt.compile(compile_kwargs={"literal_binds": True}))
+        self.assertIn("contacts.owner_id = 1", sql)
+        self.assertIn("(contacts.name, contacts.id) > ('Bob', 7)", sql)
+        self.assertIn("ORDER BY contacts.name, contacts.id", sql)
+        self.assertNotIn("OFFSET", sql)
+
     async def test_get_contact_by_id_found(self):
         contact_id = 1
         contact = Contact(name="John", email="john@example.com")
-        self.session.query().filter_by().first.return_value = contact
-        result = await get_contact_by_id(contact_id=contact_id, db=self.session)
+        self.session.execute().scalars().first.return_value = contact
+        result = await get_contact_by_id(contact_id=contact_id, owner_id=1, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_by_id_not_found(self):
         contact_id = 1
-        self.session.query().filter_by().first.return_value = None
-        result = await get_contact_by_id(contact_id=contact_id, db=self.session)
+        self.session.execute().scalars().first.return_value = None
+        result = await get_contact_by_id(contact_id=contact_id, owner_id=1, db=self.session)
         self.assertIsNone(result)
 
     async def test_create(self):
@@ -41,8 +51,9 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
                             phone_number='+38087111233',
                             birthday='1814-03-09',
                             additional_data='blalavav')
-        result = await create(body=body, db=self.session)
+        result = await create(body=body, owner_id=1, db=self.session)
         self.assertEqual(result.name, body.name)
+        self.assertEqual(result.owner_id, 1)
         self.assertTrue(hasattr(result, 'id'))
 
     async def test_update(self):
@@ -61,8 +72,8 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
                           birthday='1814-03-09',
                           additional_data='blalavav')
 
-        self.session.query().filter_by().first.return_value = contact
-        result = await update(contact_id=contact_id, body=updated_data, db=self.session)
+        self.session.execute().scalars().first.return_value = contact
+        result = await update(contact_id=contact_id, body=updated_data, owner_id=1, db=self.session)
 
         self.assertEqual(result.name, updated_data.name)
         self.assertEqual(result.sure_name, updated_data.sure_name)
@@ -81,10 +92,44 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
                           birthday='1814-03-09',
                           additional_data='blalavav')
 
-        self.session.query().filter_by().first.return_value = contact
-        result = await delete(contact_id=contact_id, db=self.session)
+        self.session.execute().scalars().first.return_value = contact
+        result = await delete(contact_id=contact_id, owner_id=1, db=self.session)
+
+        self.assertEqual(result, contact)
+
+
+class TestContactsAsyncSession(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
+
+    async def test_get_contacts(self):
+        contacts = [Contact() for _ in range(5)]
+        self.session.execute.return_value.scalars.return_value.all.return_value = contacts
+        result = await get_contacts(limit=10, offset=0, owner_id=1, db=self.session)
+        self.assertEqual(result, contacts)
+        self.session.execute.assert_awaited_once()
 
+    async def test_create(self):
+        body = ContactModel(name='Bob',
+                            sure_name='Dilan',
+                            email='bob@gmail.com',
+                            phone_number='+38087111233',
+                            birthday='1814-03-09',
+                            additional_data='blalavav')
+        result = await create(body=body, owner_id=1, db=self.session)
+        self.assertEqual(result.name, body.name)
+        self.session.commit.assert_awaited_once()
+        self.session.refresh.assert_awaited_once_with(result)
+
+    async def test_delete(self):
+        contact = Contact(id=1, name='Bob')
+        self.session.execute.return_value.scalars.return_value.first.return_value = contact
+        result = await delete(contact_id=1, owner_id=1, db=self.session)
         self.assertEqual(result, contact)
+        self.session.delete.assert_awaited_once_with(contact)
+        self.session.commit.assert_awaited_once()
 
 
 if __name__ == '__main__':
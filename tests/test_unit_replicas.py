@@ -0,0 +1,38 @@
+import time
+import unittest
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.database.replicas import STICKY_COOKIE, ReadYourWritesMiddleware, is_sticky
+
+
+class TestStickyWindow(unittest.TestCase):
+
+    def setUp(self):
+        async def endpoint(request):
+            return PlainTextResponse("ok", status_code=int(request.query_params.get("status", 200)))
+
+        app = Starlette(routes=[Route("/", endpoint, methods=["GET", "POST"])])
+        app.add_middleware(ReadYourWritesMiddleware, seconds=5)
+        self.client = TestClient(app)
+
+    def test_write_sets_the_cookie(self):
+        response = self.client.post("/")
+        self.assertTrue(is_sticky(response.cookies))
+        self.assertIn("Max-Age=5", response.headers["set-cookie"])
+
+    def test_reads_and_failed_writes_do_not(self):
+        self.assertNotIn("set-cookie", self.client.get("/").headers)
+        self.assertNotIn("set-cookie", self.client.post("/", params={"status": 422}).headers)
+
+    def test_expired_or_invalid_cookie(self):
+        self.assertFalse(is_sticky({STICKY_COOKIE: str(time.time() - 1)}))
+        self.assertFalse(is_sticky({STICKY_COOKIE: "yes"}))
+        self.assertFalse(is_sticky({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.services.response_cache import ResponseCache, RESPONSE_INVALIDATION_CHANNEL, json_entry
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.publish = AsyncMock()
+        self.cache = ResponseCache(lambda: self.redis, maxsize=10, ttl=60)
+
+    async def test_concurrent_misses_load_once(self):
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return json_entry({"id": 1}, tags=("contact:1",))
+
+        entries = await asyncio.gather(*(self.cache.get_or_load("key", load) for _ in range(5)))
+        self.assertEqual(calls, 1)
+        self.assertEqual({entry.body for entry in entries}, {b'{"id":1}'})
+        self.assertEqual((self.cache.loads, self.cache.coalesced), (1, 4))
+
+    async def test_errors_reach_waiters_and_are_not_cached(self):
+        async def load():
+            await asyncio.sleep(0.01)
+            raise LookupError("missing")
+
+        results = await asyncio.gather(*(self.cache.get_or_load("key", load) for _ in range(2)),
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(result, LookupError) for result in results))
+        self.assertNotIn("key", self.cache)
+
+    async def test_invalidate_drops_tagged_entries(self):
+        await self.cache.get_or_load("one", AsyncMock(return_value=json_entry({}, tags=("contact:1",))))
+        await self.cache.get_or_load("list", AsyncMock(return_value=json_entry([], tags=("contacts:list",))))
+        await self.cache.invalidate("contact:1")
+        self.assertNotIn("one", self.cache)
+        self.assertIn("list", self.cache)
+        self.redis.publish.assert_awaited_once_with(RESPONSE_INVALIDATION_CHANNEL, '["contact:1"]')
+
+        self.cache._on_invalidate({"data": b'["contacts:list"]'})
+        self.assertNotIn("list", self.cache)
+
+    async def test_replica_load_right_after_invalidation_is_not_stored(self):
+        await self.cache.invalidate("contact:1")
+        load = AsyncMock(return_value=json_entry({}, tags=("contact:1",)))
+        await self.cache.get_or_load("one", load, settle=5)
+        self.assertNotIn("one", self.cache)
+        await self.cache.get_or_load("one", load)
+        self.assertIn("one", self.cache)
+
+    async def test_waiter_of_a_cancelled_load_keeps_the_settle_window(self):
+        await self.cache.invalidate("contact:1")
+        started = asyncio.Event()
+
+        async def slow_load():
+            started.set()
+            await asyncio.sleep(10)
+
+        first = asyncio.create_task(self.cache.get_or_load("one", slow_load, settle=5))
+        await started.wait()
+        load = AsyncMock(return_value=json_entry({}, tags=("contact:1",)))
+        waiter = asyncio.create_task(self.cache.get_or_load("one", load, settle=5))
+        await asyncio.sleep(0)
+        first.cancel()
+        await waiter
+        load.assert_awaited_once()
+        self.assertNotIn("one", self.cache)
+
+    async def test_load_across_invalidation_is_not_stored(self):
+        async def load():
+            await self.cache.invalidate("contact:1")
+            return json_entry({}, tags=("contact:1",))
+
+        await self.cache.get_or_load("key", load)
+        self.assertNotIn("key", self.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
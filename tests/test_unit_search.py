@@ -0,0 +1,83 @@
+import unittest
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects import postgresql
+
+from src.database import maintenance, search
+from src.database.models import Base, Contact
+from src.database.search import fts5_query, search_statement
+
+
+class TestSearchStatement(unittest.TestCase):
+
+    def compile(self, q: str) -> str:
+        stmt = search_statement(Contact, "postgresql", q, 7)
+        return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+    def test_every_fragment_must_occur_on_postgresql(self):
+        sql = self.compile("ali 0501 x")
+        self.assertEqual(sql.count("ILIKE"), 2)
+        self.assertIn("ILIKE '%%ali%%'", sql)
+        self.assertIn("ILIKE '%%0501%%'", sql)
+        self.assertIn("contacts.owner_id = 7", sql)
+        self.assertNotIn("@@", sql)
+
+    def test_like_wildcards_are_escaped(self):
+        self.assertIn(r"ILIKE '%%100/%%%%' ESCAPE '/'", self.compile("100%"))
+
+    def test_nothing_searchable(self):
+        self.assertIsNone(search_statement(Contact, "postgresql", "ab c", 7))
+        self.assertIsNone(fts5_query("ab c", 7))
+        self.assertEqual(fts5_query('ali "0501"', 7),
+                         'owner : "~7~" AND {name sure_name email phone_number additional_data} : ("ali" """0501""")')
+
+
+class TestSqliteSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(self.engine)
+        # Owners whose ids contain each other, with the best matches in another owner's contacts
+        rows = [{"owner_id": owner_id, "name": "Bob" if owner_id == 12 else "Bobbob", "sure_name": "Tester",
+                 "email": f"bob{i}@example.com", "phone_number": f"+38099{i:07}", "additional_data": ""}
+                for i, owner_id in enumerate([1, 112, 12, 112, 1, 12, 2])]
+        with self.engine.begin() as connection:
+            connection.execute(insert(Contact), rows)
+
+    def search(self, owner_id: int, q: str = "bob", limit: int = 10, offset: int = 0) -> list[int]:
+        stmt = search_statement(Contact, "sqlite", q, owner_id).limit(limit).offset(offset)
+        with self.engine.connect() as connection:
+            return [contact.owner_id for contact in connection.execute(stmt)]
+
+    def test_other_owners_never_reach_the_window(self):
+        self.assertEqual(self.search(12), [12, 12])
+        self.assertEqual(self.search(12, limit=1, offset=1), [12])
+        self.assertEqual(self.search(1), [1, 1])
+        self.assertEqual(self.search(2), [2])
+        self.assertEqual(self.search(3), [])
+        # The owner column is not searched
+        self.assertEqual(self.search(12, "~12~"), [])
+
+    def test_the_owner_is_matched_in_the_index(self):
+        stmt = search_statement(Contact, "sqlite", "bob", 12)
+        sql = str(stmt.compile(dialect=self.engine.dialect, compile_kwargs={"literal_binds": True}))
+        with self.engine.connect() as connection:
+            plan = " | ".join(row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+        # The index yields the matches of the owner, each contact is then read by its id
+        self.assertIn("SCAN contacts_fts VIRTUAL TABLE INDEX", plan)
+        self.assertIn("SEARCH contacts USING INTEGER PRIMARY KEY", plan)
+
+    def test_search_index_without_owners_is_replaced(self):
+        with self.engine.begin() as connection:
+            for statement in search.SQLITE_DROP:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql("CREATE VIRTUAL TABLE contacts_fts USING fts5(name, content='contacts', "
+                                       "content_rowid='id', tokenize='trigram')")
+            maintenance.drop_replaced_search_index(connection)
+            search.install(connection)
+        self.assertEqual(self.search(12), [12, 12])
+
+
+if __name__ == '__main__':
+    unittest.main()